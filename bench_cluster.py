@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+多进程服务器吞吐量基准测试
+对每个 worker 数启动一个 ClusterServer，由多个负载进程模拟房间内的玩家：
+每个房间由一个玩家创建，所有玩家加入（加入其他 worker 上的房间时经过连接转交），
+之后每个玩家保持固定数量的 ping 在途，收到 pong 立即发出下一个。
+吞吐量为每秒完成的 ping/pong 往返数，每次往返服务器处理一个可靠请求并发出一个可靠回复。
+负载进程本身也消耗CPU，机器核心数应不少于 worker 数加负载进程数，否则测不出扩展性。
+所有数据报都经过同一个前端进程，前端的分发能力是多进程模式吞吐量的上限：
+先单独测量前端每个数据报的CPU时间（只运行前端，worker 换成只读取管道的进程，与核心数无关），
+每次唤醒读到的数据报越多，每次管道写入分摊的数据报越多
+用法: python bench_cluster.py [worker 数列表，0 表示单进程服务器，如 0,1,2,4] [每项测量秒数] [负载进程数]
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+import client.reliable_udp as reliable_udp
+import frame_sync_cluster
+import frame_sync_server
+from client.packet_codec import encode_binary
+from client.reliable_udp import ReliableUDP
+from frame_sync_cluster import ClusterServer
+from frame_sync_server import FrameSyncServer
+
+ROOMS_PER_LOADER = 4
+PLAYERS_PER_ROOM = 4
+PINGS_IN_FLIGHT = 4  # 每个玩家同时在途的 ping 数
+FRONT_BATCHES = [1, 8, 64, 256]  # 前端开销测量中每次唤醒时内核队列中的数据报数
+FRONT_DATAGRAMS = 40000  # 前端开销测量中每项发送的数据报数
+
+
+def quiet():
+    """关闭服务器和网络层的日志，避免打印成为瓶颈"""
+    for module in (reliable_udp, frame_sync_server, frame_sync_cluster):
+        module.print = lambda *args, **kwargs: None
+
+
+class PingPlayer:
+    """加入房间后循环发送 ping 的玩家"""
+
+    def __init__(self, port: int):
+        self.server = ('127.0.0.1', port)
+        self.room_id = None
+        self.joined = False
+        self.pongs = 0
+        self.udp = ReliableUDP('127.0.0.1', 0)
+        self.udp.register_callback('on_message', self._on_message)
+        self.udp.connect(*self.server)
+
+    def _on_message(self, data: dict, addr: tuple):
+        msg_type = data.get('type')
+        if msg_type == 'create_room_success':
+            self.room_id = data['room_id']
+        elif msg_type == 'join_room_success':
+            self.joined = True
+        elif msg_type == 'pong':
+            self.pongs += 1
+            self.ping()
+
+    def send(self, data: dict):
+        self.udp.send_reliable(data, self.server)
+
+    def ping(self):
+        self.send({'type': 'ping', 'timestamp': int(time.time() * 1000)})
+
+
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def run_loader(port: int, seconds: float, results):
+    """负载进程：创建房间、加入、预热 1 秒后统计 seconds 秒内完成的往返数"""
+    quiet()
+    rooms = [[PingPlayer(port) for _ in range(PLAYERS_PER_ROOM)] for _ in range(ROOMS_PER_LOADER)]
+    players = [player for room in rooms for player in room]
+    for room in rooms:
+        room[0].send({'type': 'create_room'})
+    if not wait_until(lambda: all(room[0].room_id for room in rooms)):
+        results.put(None)
+        return
+    for room in rooms:
+        for player in room:
+            player.send({'type': 'join_room', 'room_id': room[0].room_id})
+    if not wait_until(lambda: all(player.joined for player in players)):
+        results.put(None)
+        return
+
+    for player in players:
+        for _ in range(PINGS_IN_FLIGHT):
+            player.ping()
+    time.sleep(1.0)
+    start = sum(player.pongs for player in players)
+    time.sleep(seconds)
+    results.put(sum(player.pongs for player in players) - start)
+    for player in players:
+        player.udp.close()
+
+
+def run_server(port: int, workers: int):
+    quiet()
+    if workers == 0:
+        # 对照：单进程服务器
+        FrameSyncServer('127.0.0.1', port).run()
+    else:
+        ClusterServer('127.0.0.1', port, workers=workers).run()
+
+
+def drain_pipe(conn):
+    """代替 worker 读取前端写入管道的数据，不做处理"""
+    try:
+        while True:
+            conn.recv_bytes()
+    except EOFError:
+        pass
+
+
+def measure_front(workers: int, batch: int, port: int) -> float:
+    """
+    前端分发每个数据报的CPU时间（微秒）：每次向前端 socket 发送 batch 个携带会话令牌的 ping，
+    只统计前端读取、选择 worker 和写入管道的时间
+    """
+    front = ClusterServer('127.0.0.1', port, workers=workers)
+    front.recv_batch_size = max(batch, front.recv_batch_size)
+    sinks = []
+    for _ in range(workers):
+        front_end, worker_end = multiprocessing.Pipe()
+        sink = multiprocessing.Process(target=drain_pipe, args=(worker_end,), daemon=True)
+        sink.start()
+        worker_end.close()
+        front.pipes.append(front_end)
+        sinks.append(sink)
+    clients = []
+    for index in range(PLAYERS_PER_ROOM * ROOMS_PER_LOADER):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        packet = {'type': 1, 'seq': index, 'data': {'type': 'ping', 'timestamp': int(time.time() * 1000)}}
+        clients.append((sock, encode_binary(packet, (index, 0), session=index + 1)))
+
+    cpu, sent = 0.0, 0
+    while sent < FRONT_DATAGRAMS:
+        for index in range(batch):
+            sock, data = clients[(sent + index) % len(clients)]
+            sock.sendto(data, ('127.0.0.1', port))
+        sent += batch
+        start = time.process_time()
+        front._drain_socket()
+        cpu += time.process_time() - start
+
+    for sock, _ in clients:
+        sock.close()
+    for sink in sinks:
+        sink.terminate()
+    front.close()
+    return cpu / sent * 1e6
+
+
+def measure(workers: int, seconds: float, loaders: int, port: int):
+    """返回每秒往返数，负载进程没能完成加入房间时返回 None"""
+    server = multiprocessing.Process(target=run_server, args=(port, workers))
+    server.start()
+    time.sleep(0.5)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_loader, args=(port, seconds, results)) for _ in range(loaders)]
+    for process in processes:
+        process.start()
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    os.kill(server.pid, signal.SIGINT)
+    server.join()
+    if None in counts:
+        return None
+    return sum(counts) / seconds
+
+
+def main():
+    worker_counts = [int(count) for count in sys.argv[1].split(',')] if len(sys.argv) > 1 else [0, 1, 2, 4]
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    loaders = int(sys.argv[3]) if len(sys.argv) > 3 else max(max(worker_counts), 1)
+    print(f"每项测量 {seconds:.0f} 秒，{loaders} 个负载进程，每个 {ROOMS_PER_LOADER} 个房间 x "
+          f"{PLAYERS_PER_ROOM} 个玩家，每个玩家 {PINGS_IN_FLIGHT} 个 ping 在途，本机 {os.cpu_count()} 个核心")
+    quiet()
+    pipes = max(max(worker_counts), 1)
+    print(f"\n前端分发开销（{pipes} 个 worker 管道）")
+    print(f"{'每次唤醒数据报':<10}{'微秒/数据报':>12}{'前端上限 数据报/秒':>20}")
+    for index, batch in enumerate(FRONT_BATCHES):
+        cost = measure_front(pipes, batch, 18800 + index)
+        print(f"{batch:<16}{cost:>12.2f}{1e6 / cost:>22,.0f}")
+    if (os.cpu_count() or 1) < max(worker_counts) + loaders + 1:
+        print("\n本机核心数少于 worker 数 + 负载进程数 + 前端，下表只反映多进程的额外开销，不能说明扩展性")
+    print(f"\n{'worker数':<10}{'往返/秒':>12}{'相对第一项':>14}")
+    baseline = None
+    for index, workers in enumerate(worker_counts):
+        rate = measure(workers, seconds, loaders, 18900 + index)
+        if rate is None:
+            print(f"{workers or '单进程':<10}{'加入房间失败':>12}")
+            continue
+        baseline = baseline or rate
+        label = workers if workers else '单进程'
+        print(f"{label:<10}{rate:>12.0f}{rate / baseline:>13.2f}x")
+
+
+if __name__ == "__main__":
+    main()
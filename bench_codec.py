@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+线路编码基准测试
+对比旧格式（json + zlib）与二进制格式的编解码耗时和包大小
+用法: python bench_codec.py [迭代次数]
+"""
+
+import sys
+import time
+from client.packet_codec import CODEC_BINARY, CODEC_JSON, encode, decode
+from client.reliable_udp import PacketType
+
+
+def make_packet(data: dict, packet_type=PacketType.RELIABLE, seq=1234) -> dict:
+    return {
+        'type': packet_type.value,
+        'seq': seq,
+        'data': data,
+        'timestamp': time.time()
+    }
+
+
+def sample_packets() -> dict:
+    """典型的热点消息"""
+    move = {'type': 'move_units', 'unit_ids': ['1_0', '1_1', '1_2'], 'x': 320, 'y': 416}
+    return {
+        'ack': {'type': PacketType.ACK.value, 'ack_seq': 1234, 'timestamp': time.time()},
+        'heartbeat': make_packet({'type': 'heartbeat'}, PacketType.HEARTBEAT, 0),
+        'player_input(空)': make_packet({'type': 'player_input', 'frame': 1024, 'inputs': []}),
+        'player_input(移动)': make_packet({'type': 'player_input', 'frame': 1024, 'inputs': [move]}),
+        'input_ack': make_packet({'type': 'input_ack', 'frame': 1024, 'server_frame': 1022, 'player_id': 2}),
+        'frame_inputs(4人空帧)': make_packet({'type': 'frame_inputs', 'frame': 1021,
+                                             'inputs': {1: [], 2: [], 3: [], 4: []}}),
+        'frame_inputs(4人1输入)': make_packet({'type': 'frame_inputs', 'frame': 1021,
+                                              'inputs': {1: [move], 2: [], 3: [], 4: []}}),
+        'ping': make_packet({'type': 'ping', 'timestamp': 51200}),
+        'pong': make_packet({'type': 'pong', 'timestamp': 51200, 'server_frame': 1022}),
+        'room_list': make_packet({'type': 'room_list', 'rooms': [
+            {'room_id': f'room_17300000000{i:02d}', 'player_count': i % 4} for i in range(8)]}),
+    }
+
+
+def bench(packet: dict, codec: str, iterations: int):
+    """返回 (编码耗时us, 解码耗时us, 字节数)，二进制格式按实际情况在包头捎带确认"""
+    ack = (1233, 0b101) if codec == CODEC_BINARY else None
+    data = encode(packet, codec, ack)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encode(packet, codec, ack)
+    encode_us = (time.perf_counter() - start) / iterations * 1e6
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode(data)
+    decode_us = (time.perf_counter() - start) / iterations * 1e6
+
+    return encode_us, decode_us, len(data)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"迭代次数: {iterations}")
+    print(f"{'消息':<22}{'json编码us':>12}{'json解码us':>12}{'json字节':>10}"
+          f"{'bin编码us':>12}{'bin解码us':>12}{'bin字节':>10}")
+
+    totals = {CODEC_JSON: [0.0, 0.0, 0], CODEC_BINARY: [0.0, 0.0, 0]}
+    for name, packet in sample_packets().items():
+        row = []
+        for codec in (CODEC_JSON, CODEC_BINARY):
+            result = bench(packet, codec, iterations)
+            for i, value in enumerate(result):
+                totals[codec][i] += value
+            row.extend(result)
+        print(f"{name:<22}{row[0]:>12.2f}{row[1]:>12.2f}{row[2]:>10}"
+              f"{row[3]:>12.2f}{row[4]:>12.2f}{row[5]:>10}")
+
+    json_total, bin_total = totals[CODEC_JSON], totals[CODEC_BINARY]
+    print(f"{'合计':<22}{json_total[0]:>12.2f}{json_total[1]:>12.2f}{json_total[2]:>10}"
+          f"{bin_total[0]:>12.2f}{bin_total[1]:>12.2f}{bin_total[2]:>10}")
+    print(f"编码加速 {json_total[0] / bin_total[0]:.1f}x, 解码加速 {json_total[1] / bin_total[1]:.1f}x, "
+          f"字节减少 {(1 - bin_total[2] / json_total[2]) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
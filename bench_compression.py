@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+自适应压缩基准测试
+对典型流量比较 不压缩 / 无字典 deflate / 预置字典 deflate 的字节数和CPU耗时
+用法: python bench_compression.py [迭代次数]
+      python bench_compression.py --build    从样本流量生成预置字典并输出 Python 字面量
+"""
+
+import random
+import sys
+import time
+import zlib
+from client.packet_codec import (COMPRESS_LEVEL, COMPRESS_MEMLEVEL, COMPRESS_THRESHOLD, COMPRESS_WBITS,
+                                 compress_payload, decompress_payload, encode_bundle, encode_message)
+from client.zlib_dictionary import build_dictionary
+
+
+def sample_traffic(seed: int) -> dict:
+    """按消息类别生成典型的已编码负载（与线路上的二进制负载一致）"""
+    rng = random.Random(seed)
+
+    def unit_ids(player_id):
+        return [f'{player_id}_{i}' for i in rng.sample(range(12), rng.randint(1, 5))]
+
+    def player_inputs(player_id):
+        inputs = []
+        for _ in range(rng.choice((0, 0, 0, 1, 1, 2))):
+            if rng.random() < 0.85:
+                inputs.append({'type': 'move_units', 'unit_ids': unit_ids(player_id),
+                               'x': rng.randrange(0, 1280, 32) + 16, 'y': rng.randrange(0, 960, 32) + 16})
+            else:
+                inputs.append({'type': 'produce_unit', 'building_id': f'{player_id}_base', 'unit_type': 'tank'})
+        return inputs
+
+    def frame_inputs(frame, players=4):
+        return {'type': 'frame_inputs', 'frame': frame,
+                'inputs': {player_id: player_inputs(player_id) for player_id in range(1, players + 1)},
+                'input_acks': {player_id: frame + rng.randint(0, 3) for player_id in range(1, players + 1)}}
+
+    def player_list(players):
+        colors = [[255, 0, 0], [0, 0, 255], [0, 255, 0], [255, 255, 0]]
+        return {'type': 'player_list', 'players': {
+            str(i): {'id': i, 'name': f'Player{i}', 'color': colors[i - 1], 'is_host': i == 1}
+            for i in range(1, players + 1)}}
+
+    def room_list(rooms):
+        base = 1730000000000 + rng.randrange(10 ** 8)
+        return {'type': 'room_list', 'rooms': [
+            {'room_id': f'room_{base + i * rng.randrange(1000, 90000)}', 'player_count': rng.randint(1, 4)}
+            for i in range(rooms)]}
+
+    traffic = {'frame_inputs': [], 'player_list': [], 'room_list': [], 'resync': [], 'small': []}
+    for i in range(200):
+        frame = rng.randrange(100, 5000)
+        traffic['frame_inputs'].append(encode_message(frame_inputs(frame)))
+        traffic['player_list'].append(encode_message(player_list(rng.randint(2, 4))))
+        traffic['room_list'].append(encode_message(room_list(rng.randint(3, 12))))
+        # 补帧：一个合并包内连续的多帧输入
+        payloads, size = [], 2
+        while True:
+            payload = encode_message(frame_inputs(frame + len(payloads)))
+            if size + len(payload) + 2 > 1150:
+                break
+            payloads.append(payload)
+            size += len(payload) + 2
+        traffic['resync'].append(encode_bundle(payloads))
+        traffic['small'].append(encode_message({'type': 'player_input', 'frame': frame, 'inputs': []}))
+    return traffic
+
+
+def time_us(func, payloads: list, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for payload in payloads:
+            func(payload)
+    return (time.perf_counter() - start) / (iterations * len(payloads)) * 1e6
+
+
+def plain_deflate(payload: bytes) -> bytes:
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -COMPRESS_WBITS, COMPRESS_MEMLEVEL)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def adaptive_size(payload: bytes) -> int:
+    compressed = compress_payload(payload)
+    return len(compressed) if compressed is not None else len(payload)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--build':
+        samples = [payload for payloads in sample_traffic(1).values() for payload in payloads]
+        dictionary = build_dictionary(samples)
+        print(f"# {len(dictionary)} 字节")
+        print('PRESET_DICTIONARY = (')
+        for start in range(0, len(dictionary), 72):
+            print(f'    {dictionary[start:start + 72]!r}')
+        print(')')
+        return
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"迭代次数: {iterations}，压缩阈值 {COMPRESS_THRESHOLD} 字节（样本与生成字典所用样本不同）")
+    print(f"{'类别':<14}{'原始字节':>10}{'deflate字节':>12}{'字典字节':>10}{'节省':>8}"
+          f"{'压缩us':>10}{'解压us':>10}")
+
+    totals = [0, 0, 0]
+    for name, payloads in sample_traffic(2).items():
+        raw = sum(len(payload) for payload in payloads)
+        plain = sum(min(len(plain_deflate(payload)), len(payload)) for payload in payloads)
+        adaptive = sum(adaptive_size(payload) for payload in payloads)
+        compress_us = time_us(compress_payload, payloads, iterations)
+        compressed = [body for body in map(compress_payload, payloads) if body is not None]
+        decompress_us = time_us(decompress_payload, compressed, iterations) if compressed else 0.0
+        for i, value in enumerate((raw, plain, adaptive)):
+            totals[i] += value
+        print(f"{name:<14}{raw / len(payloads):>10.0f}{plain / len(payloads):>12.0f}"
+              f"{adaptive / len(payloads):>10.0f}{(1 - adaptive / raw) * 100:>7.0f}%"
+              f"{compress_us:>10.2f}{decompress_us:>10.2f}")
+
+    raw, plain, adaptive = totals
+    print(f"合计: 无字典 deflate 节省 {(1 - plain / raw) * 100:.0f}%，预置字典节省 {(1 - adaptive / raw) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
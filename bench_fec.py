@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+帧数据前向纠错基准测试
+服务端按固定帧间隔在帧同步通道上向一个客户端发送 frame_inputs，服务端启用网络损伤模拟
+（两个方向都生效，确认包也会丢失），在几种丢包场景下比较不同的修复组大小：
+客户端收到每一帧的延迟（相对发送时刻）的百分位数、由修复包还原的帧数、重传次数和发送字节数。
+不启用纠错时丢失的帧要等重传超时，通道中后面的帧也被阻塞；启用后组内只丢一个包可以立即还原。
+两端运行在内存回环网络（LoopbackNetwork）上，时间是虚拟的，损伤模拟使用固定的随机种子 1..N，
+各种子的结果合并统计（单个种子的 p99 只由几个包决定，波动很大），
+同样的参数每次运行得到完全相同的结果，不受机器负载影响
+用法: python bench_fec.py [修复组大小列表，0 表示不启用，如 0,2,4,8] [每项发送帧数] [帧间隔毫秒] [随机种子数]
+"""
+
+import sys
+import random
+import client.reliable_udp as reliable_udp
+from client.loopback_transport import LoopbackNetwork, LoopbackReliableUDP
+from client.packet_codec import CODEC_BINARY
+from frame_sync_server import CHANNEL_FRAMES
+
+SERVER = ('127.0.0.1', 8888)
+
+# 丢包场景，即服务端的 impairment 配置
+PROFILES = {
+    '均匀丢包2%': {'latency_ms': 20, 'loss': 0.02},
+    '均匀丢包5%': {'latency_ms': 20, 'loss': 0.05},
+    '均匀丢包10%': {'latency_ms': 20, 'loss': 0.10},
+    # 移动网络：抖动加突发丢包，平均丢包率约 5%
+    '移动网络突发': {'latency_ms': 40, 'jitter_ms': 10,
+                'gilbert': {'p': 0.02, 'r': 0.3, 'good_loss': 0.01, 'bad_loss': 0.5}}
+}
+PLAYERS = 4  # 每帧包含的玩家输入数
+
+
+def quiet():
+    """关闭网络层的日志，避免打印影响计时"""
+    reliable_udp.print = lambda *args, **kwargs: None
+
+
+def frame_message(frame: int, rng: random.Random) -> dict:
+    """与服务器广播格式相近的一帧输入"""
+    inputs = {str(player): [{'action': 'move', 'unit_id': player * 100 + frame % 7,
+                             'x': rng.randint(0, 99), 'y': rng.randint(0, 99)}]
+              for player in range(1, PLAYERS + 1)}
+    return {'type': 'frame_inputs', 'frame': frame, 'inputs': inputs}
+
+
+def measure(profile: dict, group_size: int, frames: int, interval: float, seed: int) -> dict:
+    network = LoopbackNetwork()
+    server = LoopbackReliableUDP(network, *SERVER, is_server=True, coalesce=True,
+                                 impairment=dict(profile, seed=seed))
+    server.set_channel('frame_inputs', CHANNEL_FRAMES)
+    received = {}
+    client = LoopbackReliableUDP(network)
+    client.register_callback('on_message', lambda data, addr: received.setdefault(data.get('frame'), network.now)
+                             if data.get('type') == 'frame_inputs' else None)
+    client.connect(*SERVER)
+    # 等待握手和编码格式协商完成
+    if not network.run(5.0, lambda: client.get_codec(SERVER) == CODEC_BINARY and server.connection_states):
+        return {'latencies': [], 'recovered': 0, 'repairs': 0, 'retransmits': 0, 'bytes': 0}
+    addr = next(iter(server.connection_states))
+    server.set_fec(addr, group_size, CHANNEL_FRAMES)
+    # 握手包是 JSON 格式，大小随 cookie 和时间戳的位数变化，只统计之后发送的字节数
+    handshake_bytes = server.get_metrics()['counters']['bytes_sent']
+
+    rng = random.Random(1)
+    sent = {}
+
+    def send_frame():
+        frame = len(sent)
+        if frame < frames:
+            sent[frame] = network.now
+            server.send_reliable(frame_message(frame, rng), addr)
+            server.flush()
+
+    network.every(interval, send_frame)
+    network.run(frames * interval + 3.0, lambda: len(received) == frames)
+    network.run(0.2)
+
+    server_counters = server.get_metrics()['counters']
+    client_counters = client.get_metrics()['counters']
+    client.close()
+    server.close()
+    return {
+        'latencies': [(received[frame] - sent[frame]) * 1000 for frame in received if frame in sent],
+        'recovered': client_counters['fec_recovered'],
+        'repairs': server_counters['fec_repairs'],
+        'retransmits': server_counters['retransmits'],
+        'bytes': server_counters['bytes_sent'] - handshake_bytes
+    }
+
+
+def measure_seeds(profile: dict, group_size: int, frames: int, interval: float, seeds: int) -> dict:
+    """用随机种子 1..seeds 各运行一次，合并延迟并累加计数"""
+    latencies = []
+    totals = {'recovered': 0, 'repairs': 0, 'retransmits': 0, 'bytes': 0}
+    for seed in range(1, seeds + 1):
+        result = measure(profile, group_size, frames, interval, seed)
+        latencies.extend(result['latencies'])
+        for key in totals:
+            totals[key] += result[key]
+    latencies.sort()
+    return dict(totals, **{
+        'received': len(latencies),
+        'p50': latencies[len(latencies) // 2] if latencies else None,
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else None,
+        'max': latencies[-1] if latencies else None
+    })
+
+
+def main():
+    group_sizes = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [0, 2, 4, 8]
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    interval = (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+    seeds = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+    quiet()
+    print(f"每项发送 {frames} 帧 x {seeds} 个随机种子，帧间隔 {interval * 1000:.0f}ms，每帧 {PLAYERS} 个玩家的输入")
+    for name, profile in PROFILES.items():
+        print(f"\n{name}: {profile}")
+        print(f"{'修复组':<8}{'收到':>6}{'p50ms':>8}{'p99ms':>8}{'最大ms':>8}{'还原':>6}{'修复包':>8}"
+              f"{'重传':>6}{'发送字节':>10}{'字节开销':>10}")
+        baseline = None
+        for group_size in group_sizes:
+            result = measure_seeds(profile, group_size, frames, interval, seeds)
+            if not result['received']:
+                print(f"{group_size or '关闭':<8}{'没有收到任何帧':>12}")
+                continue
+            baseline = baseline or result['bytes']
+            print(f"{group_size or '关闭':<8}{result['received']:>8}{result['p50']:>8.1f}{result['p99']:>8.1f}"
+                  f"{result['max']:>8.1f}{result['recovered']:>8}{result['repairs']:>8}{result['retransmits']:>8}"
+                  f"{result['bytes']:>12}{result['bytes'] / baseline - 1:>+11.0%}")
+
+
+if __name__ == "__main__":
+    main()
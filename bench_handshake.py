@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+握手洪水负载测试
+服务器运行在子进程中，主进程从大量不同的源地址（127/8 网段内的随机 IP 加临时端口）各发送一个握手心跳，
+模拟伪造源地址的洪水：这些地址永远不会回应服务器。分别在开启和关闭 cookie 握手时测量服务器的
+连接状态数、Python 堆内存（tracemalloc）和进程 RSS，并在洪水进行到一半时让一个正常客户端创建房间，
+确认洪水期间正常玩家仍能连接。
+开启 cookie 时服务器只答复无状态的 cookie，连接状态和内存应保持平稳；关闭时每个伪造地址都会创建
+连接状态，直到会话超时才释放
+用法: python bench_handshake.py [伪造地址数] [每秒发送数]
+"""
+
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import client.reliable_udp as reliable_udp
+import frame_sync_server
+from client.packet_codec import CODEC_BINARY, CODEC_JSON, encode
+from client.reliable_udp import PacketType, ReliableUDP
+from frame_sync_server import FrameSyncServer
+
+SAMPLE_INTERVAL = 0.25
+
+
+def quiet():
+    """关闭服务器和网络层的日志，避免打印成为瓶颈"""
+    for module in (reliable_udp, frame_sync_server):
+        module.print = lambda *args, **kwargs: None
+
+
+def rss_kb() -> int:
+    """当前进程的常驻内存（KB），读取 /proc，其他平台返回 0"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return 0
+
+
+def run_server(port: int, require_cookie: bool, samples):
+    """服务器子进程：主线程运行服务器，采样线程定期上报连接数和内存"""
+    quiet()
+    tracemalloc.start()
+    server = FrameSyncServer('127.0.0.1', port)
+    server.udp.require_cookie = require_cookie
+
+    def sample():
+        while True:
+            counters = server.udp.get_metrics()['counters']
+            samples.put((time.time(), len(server.udp.connection_states), tracemalloc.get_traced_memory()[0],
+                         rss_kb(), counters['handshake_cookies'], counters['handshake_dropped']))
+            time.sleep(SAMPLE_INTERVAL)
+
+    threading.Thread(target=sample, daemon=True).start()
+    server.run()
+
+
+def heartbeat_datagram() -> bytes:
+    """客户端首次连接时发送的握手心跳，此时还没有协商编码格式，使用旧格式"""
+    packet = {'type': PacketType.HEARTBEAT.value, 'seq': 0, 'timestamp': time.time(),
+              'data': {'type': 'heartbeat', 'codecs': [CODEC_BINARY, CODEC_JSON]}}
+    return encode(packet, CODEC_JSON)
+
+
+def flood(port: int, count: int, rate: float, halfway):
+    """从 count 个不同的源地址各发送一个握手心跳，发到一半时调用 halfway"""
+    datagram = heartbeat_datagram()
+    start = time.monotonic()
+    for index in range(count):
+        if index == count // 2:
+            halfway()
+        delay = start + index / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        source = f"127.{random.randint(1, 254)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind((source, 0))
+            sock.sendto(datagram, ('127.0.0.1', port))
+    return time.monotonic() - start
+
+
+class Player:
+    """洪水期间连接服务器并创建房间的正常玩家"""
+
+    def __init__(self, port: int):
+        self.server = ('127.0.0.1', port)
+        self.started = None
+        self.joined = None
+        self.udp = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.udp = ReliableUDP('127.0.0.1', 0)
+        self.udp.register_callback('on_message', self._on_message)
+        self.udp.connect(*self.server)
+        self.udp.send_reliable({'type': 'create_room'}, self.server)
+
+    def _on_message(self, data: dict, addr: tuple):
+        if data.get('type') == 'create_room_success' and self.joined is None:
+            self.joined = time.monotonic()
+
+
+def measure(require_cookie: bool, count: int, rate: float, port: int) -> dict:
+    samples = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server, args=(port, require_cookie, samples))
+    server.start()
+    time.sleep(1.0)
+    flood_start = time.time()
+    player = Player(port)
+    elapsed = flood(port, count, rate, player.start)
+    flood_end = time.time()
+    time.sleep(1.0)
+    os.kill(server.pid, signal.SIGINT)
+    server.join()
+    if player.udp is not None:
+        player.udp.close()
+
+    rows = []
+    while not samples.empty():
+        rows.append(samples.get())
+    before = [row for row in rows if row[0] < flood_start][-1]
+    during = [row for row in rows if flood_start <= row[0] <= flood_end + 1.0] or [rows[-1]]
+    return {
+        'elapsed': elapsed,
+        'connections': max(row[1] for row in during),
+        'heap_kb': (max(row[2] for row in during) - before[2]) / 1024,
+        'rss_kb': max(row[3] for row in during) - before[3],
+        'cookies': rows[-1][4],
+        'dropped': rows[-1][5],
+        'join_ms': (player.joined - player.started) * 1000 if player.joined else None
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    print(f"{count} 个伪造源地址，每秒 {rate:.0f} 个握手心跳，心跳大小 {len(heartbeat_datagram())} 字节")
+    print(f"{'cookie':<8}{'实际秒数':>8}{'连接状态峰值':>12}{'堆增长KB':>10}{'RSS增长KB':>10}"
+          f"{'答复cookie':>11}{'丢弃':>8}{'正常玩家建房ms':>15}")
+    for index, require_cookie in enumerate((True, False)):
+        result = measure(require_cookie, count, rate, 18950 + index)
+        join = f"{result['join_ms']:.1f}" if result['join_ms'] is not None else '失败'
+        print(f"{'开启' if require_cookie else '关闭':<8}{result['elapsed']:>10.1f}{result['connections']:>14}"
+              f"{result['heap_kb']:>12.0f}{result['rss_kb']:>12}{result['cookies']:>12}{result['dropped']:>10}"
+              f"{join:>17}")
+
+
+if __name__ == "__main__":
+    main()
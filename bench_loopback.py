@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+内存回环网络基准测试
+服务器和所有玩家运行在同一个进程的 LoopbackNetwork 上：没有 socket 和后台线程，时间是虚拟的，
+按下一个事件的时间跳跃前进。每个房间由一个玩家创建，所有玩家加入后由房主（最先加入的玩家）开始游戏，
+每个玩家每 50ms 提交一次输入，运行指定的虚拟秒数后统计实际耗时、虚拟时间与实际时间之比、
+每个玩家收到的帧数和网络中传递的数据报数。
+同样的配置运行两次，比较所有玩家收到消息的顺序和虚拟时间，验证结果可以复现；
+有房间没有开始游戏或有玩家没有收到任何帧时基准测试失败（空的运行总是“一致”，比较没有意义）
+用法: python bench_loopback.py [房间数] [每个房间的玩家数] [虚拟秒数] [丢包率]
+"""
+
+import hashlib
+import sys
+import time
+import client.reliable_udp as reliable_udp
+import frame_sync_server
+from client.loopback_transport import LoopbackNetwork, LoopbackReliableUDP
+from frame_sync_server import FrameSyncServer, BACKEND_LOOPBACK
+
+SERVER = ('127.0.0.1', 8888)
+INPUT_INTERVAL = 0.05  # 玩家提交输入的间隔（虚拟秒）
+
+
+def quiet():
+    """关闭服务器和网络层的日志，避免打印成为瓶颈"""
+    for module in (reliable_udp, frame_sync_server):
+        module.print = lambda *args, **kwargs: None
+
+
+class Player:
+    """只收发协议消息的玩家，记录收到的每条消息用于比较两次运行的结果"""
+
+    def __init__(self, network: LoopbackNetwork, impairment):
+        self.network = network
+        self.udp = LoopbackReliableUDP(network, coalesce=True, impairment=impairment)
+        self.udp.register_callback('on_message', self._on_message)
+        self.udp.connect(*SERVER)
+        self.room_id = None
+        self.player_id = None
+        self.players = {}  # 最新的玩家列表 {玩家ID: 玩家信息}
+        self.joined = False
+        self.started = False
+        self.server_frame = -1
+        self.frames = set()
+        self.log = []  # [(虚拟毫秒, 消息类型, 帧号)]
+
+    def _on_message(self, data: dict, addr: tuple):
+        msg_type = data.get('type')
+        self.log.append((round(self.network.now * 1000), msg_type, data.get('frame')))
+        if msg_type == 'create_room_success':
+            self.room_id = data['room_id']
+        elif msg_type == 'connect_success':
+            self.player_id = data['player_id']
+            self.joined = True
+        elif msg_type == 'player_list':
+            self.players = data['players']
+        elif msg_type == 'game_start':
+            self.started = True
+        elif msg_type == 'frame_inputs':
+            self.frames.add(data['frame'])
+            self.server_frame = max(self.server_frame, data['frame'])
+
+    def is_host(self) -> bool:
+        """玩家列表中本玩家是否为房主"""
+        return any(info.get('is_host') and str(info['id']) == str(self.player_id) for info in self.players.values())
+
+    def send(self, data: dict):
+        self.udp.send_reliable(data, SERVER)
+
+    def tick(self):
+        if self.started:
+            self.send({'type': 'player_input', 'frame': self.server_frame + 2,
+                       'inputs': [{'action': 'move', 'x': self.server_frame % 100, 'y': 0}]})
+        self.udp.flush()
+
+
+def measure(rooms: int, players_per_room: int, seconds: float, loss: float) -> dict:
+    network = LoopbackNetwork()
+    server = FrameSyncServer(*SERVER, backend=BACKEND_LOOPBACK, network=network)
+    network.every(0.001, server.run_frame)
+    groups = []
+    for room in range(rooms):
+        group = []
+        for index in range(players_per_room):
+            impairment = {'loss': loss, 'seed': room * players_per_room + index} if loss else None
+            player = Player(network, impairment)
+            network.every(INPUT_INTERVAL, player.tick)
+            group.append(player)
+        groups.append(group)
+    players = [player for group in groups for player in group]
+
+    wall_start = time.perf_counter()
+    for group in groups:
+        group[0].send({'type': 'create_room'})
+    if not network.run(5.0, lambda: all(group[0].room_id for group in groups)):
+        return {'error': '创建房间失败'}
+    for group in groups:
+        for player in group:
+            player.send({'type': 'connect', 'name': 'bench', 'room_id': group[0].room_id})
+    # 房主是第一个加入房间的玩家（丢包时不一定是创建者），由玩家列表中标记为房主的玩家开始游戏
+    if not network.run(5.0, lambda: all(player.joined for player in players) and
+                       all(sum(player.is_host() for player in group) == 1 for group in groups)):
+        return {'error': '加入房间失败'}
+    for group in groups:
+        next(player for player in group if player.is_host()).send({'type': 'game_start'})
+    if not network.run(5.0, lambda: all(player.started for player in players)):
+        return {'error': f"{sum(not player.started for player in players)} 个玩家没有开始游戏"}
+    network.run(seconds)
+    wall = time.perf_counter() - wall_start
+
+    digest = hashlib.sha256(repr([player.log for player in players]).encode()).hexdigest()
+    frames = [len(player.frames) for player in players]
+    for player in players:
+        player.udp.close()
+    server.udp.close()
+    if min(frames) == 0:
+        return {'error': f"{frames.count(0)} 个玩家没有收到任何帧"}
+    return {
+        'wall': wall,
+        'virtual': network.now,
+        'frames_min': min(frames),
+        'frames_max': max(frames),
+        'datagrams': network.stats['datagrams'],
+        'digest': digest
+    }
+
+
+def main():
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    players_per_room = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    loss = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+    quiet()
+    print(f"{rooms} 个房间 x {players_per_room} 个玩家，游戏运行 {seconds:.0f} 虚拟秒，玩家链路丢包率 {loss:.0%}")
+    print(f"{'运行':<6}{'实际秒数':>8}{'虚拟/实际':>10}{'每人帧数':>12}{'数据报':>10}  消息序列摘要")
+    digests = []
+    for run in (1, 2):
+        result = measure(rooms, players_per_room, seconds, loss)
+        if 'error' in result:
+            print(f"{run:<6}{result['error']:>12}")
+            sys.exit(1)
+        digests.append(result['digest'])
+        frames = f"{result['frames_min']}-{result['frames_max']}"
+        print(f"{run:<6}{result['wall']:>10.2f}{result['virtual'] / result['wall']:>11.1f}x"
+              f"{frames:>14}{result['datagrams']:>12}  {result['digest'][:16]}")
+    print("两次运行结果一致" if digests[0] == digests[1] else "两次运行结果不一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+接收路径基准测试
+对比逐个 recvfrom + 完整解码（旧实现）与 recvfrom_into 缓冲环 + 按需解码负载（当前实现）
+的内存分配和耗时。流量按服务器的典型情况混合：纯确认包、重传造成的重复包、心跳和新的可靠包。
+单次计时受机器负载影响较大，两种实现交替运行 REPEATS 次，耗时取中位数。
+用法: python bench_receive.py [轮数]
+"""
+
+import socket
+import sys
+import time
+import tracemalloc
+import client.reliable_udp as reliable_udp
+from client.packet_codec import CODEC_BINARY, decode, encode
+from client.reliable_udp import ReliableUDP, PacketType
+
+BATCH = 64
+REPEATS = 7
+
+
+class BenchReceiver(ReliableUDP):
+    """不启动后台线程的接收端，由基准测试直接调用 _drain_socket"""
+
+    def _start_io(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.recv_ring = [memoryview(bytearray(65507)) for _ in range(self.recv_ring_size)]
+        self.socket.bind((self.host, self.port))
+
+
+class CopyingReceiver(BenchReceiver):
+    """旧实现：每个数据报分配新的 bytes，并在处理前解码整个负载"""
+
+    def _drain_socket(self):
+        received = []
+        for _ in range(self.recv_batch_size):
+            try:
+                data, addr = self.socket.recvfrom(65507)
+            except BlockingIOError:
+                break
+            packet, codec = decode(data)
+            packet['size'] = len(data)
+            received.append((packet, PacketType(packet['type']), packet.get('seq'), codec, addr))
+        with self.lock:
+            for packet, packet_type, seq_num, codec, addr in received:
+                self._handle_packet(packet, packet_type, seq_num, codec, addr)
+
+
+def make_traffic(rounds: int) -> list:
+    """生成数据报序列，每批 BATCH 个：40% 纯确认，20% 重复包，10% 心跳，30% 新包"""
+    move = {'type': 'move_units', 'unit_ids': ['1_0', '1_1', '1_2'], 'x': 320, 'y': 416}
+    messages = [
+        {'type': 'frame_inputs', 'frame': 1021, 'inputs': {1: [move], 2: [], 3: [], 4: []}},
+        {'type': 'player_list', 'players': {str(i): {'id': i, 'name': f'Player{i}', 'color': [255, 0, 0],
+                                                      'is_host': i == 1} for i in range(1, 5)}},
+    ]
+    datagrams, seq = [], 0
+    for _ in range(rounds):
+        for i in range(BATCH):
+            kind = i % 10
+            if kind < 4:
+                packet = {'type': PacketType.ACK.value, 'timestamp': time.time()}
+            elif kind < 6 and seq > 0:
+                packet = {'type': PacketType.RELIABLE.value, 'seq': (seq - 1) % 65536,
+                          'data': messages[i % 2], 'timestamp': time.time()}
+            elif kind < 7:
+                packet = {'type': PacketType.HEARTBEAT.value, 'seq': 0, 'data': {'type': 'heartbeat'},
+                          'timestamp': time.time()}
+            else:
+                packet = {'type': PacketType.RELIABLE.value, 'seq': seq % 65536,
+                          'data': messages[i % 2], 'timestamp': time.time()}
+                seq += 1
+            datagrams.append(encode(packet, CODEC_BINARY, ((seq - 1) % 65536, 0)))
+    return datagrams
+
+
+def run(receiver_class, port: int, datagrams: list, trace: bool) -> float:
+    """trace 为 True 时返回每批峰值分配（KB），否则返回每个数据报的处理耗时（us）"""
+    receiver = receiver_class('127.0.0.1', port, is_server=True)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind(('127.0.0.1', 0))
+    addr = sender.getsockname()
+    with receiver.lock:
+        receiver._get_connection_state(addr)['codec'] = CODEC_BINARY
+
+    total = 0.0
+    for start in range(0, len(datagrams), BATCH):
+        for data in datagrams[start:start + BATCH]:
+            sender.sendto(data, ('127.0.0.1', port))
+        time.sleep(0.002)
+
+        if trace:
+            tracemalloc.start()
+            receiver._drain_socket()
+            total += tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            begin = time.perf_counter()
+            receiver._drain_socket()
+            total += time.perf_counter() - begin
+
+    receiver.close()
+    sender.close()
+    if trace:
+        return total / (len(datagrams) // BATCH) / 1024
+    return total / len(datagrams) * 1e6
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    reliable_udp.print = lambda *args, **kwargs: None
+    datagrams = make_traffic(rounds)
+    print(f"数据报数量: {len(datagrams)}，每批 {BATCH} 个")
+    print(f"{'接收路径':<26}{'每批峰值分配KB':>16}{'耗时us/包':>12}")
+    paths = (('recvfrom + 完整解码', CopyingReceiver), ('recvfrom_into + 按需解码', BenchReceiver))
+    peaks = [run(receiver_class, 18950 + index, datagrams, trace=True)
+             for index, (name, receiver_class) in enumerate(paths)]
+    times = [[] for _ in paths]
+    port = 18960
+    for _ in range(REPEATS):
+        for index, (name, receiver_class) in enumerate(paths):
+            times[index].append(run(receiver_class, port, datagrams, trace=False))
+            port += 1
+    results = []
+    for (name, receiver_class), peak, samples in zip(paths, peaks, times):
+        us = sorted(samples)[len(samples) // 2]
+        results.append((peak, us))
+        print(f"{name:<26}{peak:>16.1f}{us:>12.2f}")
+    (old_peak, old_us), (new_peak, new_us) = results
+    print(f"峰值分配减少 {(1 - new_peak / old_peak) * 100:.0f}%，耗时减少 {(1 - new_us / old_us) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
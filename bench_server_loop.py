@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+服务器主循环基准测试
+分别测量 thread 和 asyncio 两种网络后端的空闲CPU占用和房间 tick 抖动
+每个后端在独立子进程中运行，避免线程残留互相影响
+用法: python bench_server_loop.py [每项测量秒数]
+"""
+
+import asyncio
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import frame_sync_server
+from frame_sync_server import FrameSyncServer, GameRoom, BACKEND_THREAD, BACKEND_ASYNCIO
+
+
+class TickRecorder(FrameSyncServer):
+    """记录每次房间帧号推进的时间"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tick_times = []
+
+    def run_frame(self):
+        room = self.rooms.get('bench')
+        frame = room.current_frame if room else None
+        super().run_frame()
+        if room and room.current_frame != frame:
+            self.tick_times.append(time.perf_counter())
+
+
+def run_child(backend: str, mode: str, seconds: float, port: int):
+    """子进程：运行服务器并输出测量结果"""
+    frame_sync_server.print = lambda *args, **kwargs: None
+    server = TickRecorder('127.0.0.1', port, backend=backend)
+    if mode == 'tick':
+        # 一个已开始游戏的空房间，只产生 tick，不产生网络流量
+        room = GameRoom('bench')
+        room.game_started = True
+        server.rooms['bench'] = room
+
+    def serve():
+        if backend == BACKEND_ASYNCIO:
+            asyncio.run(server.run_async())
+        else:
+            server.run()
+
+    threading.Thread(target=serve, daemon=True).start()
+    time.sleep(0.2)
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    tick_start = len(server.tick_times)
+    time.sleep(seconds)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    if mode == 'idle':
+        print(f"{cpu / wall * 100:.2f}")
+    else:
+        ticks = server.tick_times[tick_start:]
+        intervals = [(b - a) * 1000 for a, b in zip(ticks, ticks[1:])]
+        jitter = [abs(interval - 50) for interval in intervals]
+        print(f"{statistics.mean(intervals):.2f} {statistics.mean(jitter):.2f} "
+              f"{max(jitter):.2f} {cpu / wall * 100:.2f}")
+
+
+def measure(backend: str, mode: str, seconds: float, port: int) -> list:
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', backend, mode, str(seconds), str(port)],
+        capture_output=True, text=True, check=True).stdout
+    # 最后一行是测量结果，之前是服务器启动日志
+    return output.strip().splitlines()[-1].split()
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    print(f"每项测量 {seconds:.0f} 秒")
+    print(f"{'后端':<10}{'空闲CPU%':>10}{'平均tick ms':>14}{'平均抖动 ms':>14}{'最大抖动 ms':>14}{'tick时CPU%':>12}")
+    for index, backend in enumerate((BACKEND_THREAD, BACKEND_ASYNCIO)):
+        idle_cpu, = measure(backend, 'idle', seconds, 18890 + index * 2)
+        mean_tick, mean_jitter, max_jitter, tick_cpu = measure(backend, 'tick', seconds, 18891 + index * 2)
+        print(f"{backend:<10}{idle_cpu:>10}{mean_tick:>14}{mean_jitter:>14}{max_jitter:>14}{tick_cpu:>12}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3], float(sys.argv[4]), int(sys.argv[5]))
+    else:
+        main()
@@ -0,0 +1,142 @@
+import asyncio
+import socket
+from typing import Callable, Hashable, Optional
+from .reliable_udp import ReliableUDP, PRIORITY_CONTROL
+from .timer_queue import TimerEntry
+
+
+class _ReliableUDPProtocol(asyncio.DatagramProtocol):
+    """把 asyncio 收到的数据报转交给 AsyncReliableUDP"""
+
+    def __init__(self, udp: 'AsyncReliableUDP'):
+        self.udp = udp
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        self.udp._receive_datagram(data, addr)
+
+    def error_received(self, exc: Exception):
+        if self.udp.running:
+            print(f"接收数据错误: {exc}")
+
+
+class AsyncReliableUDP(ReliableUDP):
+    """
+    基于 asyncio DatagramProtocol 的可靠UDP
+    协议逻辑与 ReliableUDP 相同，但不创建后台线程：数据报由事件循环回调，
+    重传、延迟确认、心跳和连接超时共用一个按最早截止时间设置的事件循环定时器。
+    构造后需要在事件循环中 await start()。
+    """
+
+    def __init__(self, host='localhost', port=8888, is_server=False, **kwargs):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.timer_handle: Optional[asyncio.TimerHandle] = None
+        self.flush_scheduled = False
+        super().__init__(host, port, is_server, **kwargs)
+
+    def _start_io(self):
+        """创建并绑定 socket，事件循环相关的初始化在 start() 中完成"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self._configure_socket()
+        if self.is_server:
+            self.socket.bind((self.host, self.port))
+
+    async def start(self):
+        """在当前事件循环上启动数据报传输"""
+        self.loop = asyncio.get_running_loop()
+        self.transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: _ReliableUDPProtocol(self), sock=self.socket)
+        # 构造期间登记的定时器（心跳等）在这里开始计时
+        self._rearm_timer()
+
+    def _sendto(self, data: bytes, addr: tuple):
+        """通过 asyncio 传输发送数据报，start() 之前直接使用非阻塞 socket"""
+        if self.send_batch is not None:
+            self.send_batch.append((data, addr))
+            return
+        if self.transport is not None:
+            self.transport.sendto(data, addr)
+        else:
+            self.socket.sendto(data, addr)
+        self.io_stats['send_datagrams'] += 1
+        self.io_stats['send_calls'] += 1
+    
+    def _sendmsg_gso(self, items: list, addr: tuple):
+        """传输层还有未发出的数据时不能绕过它直接写 socket，否则会打乱发送顺序"""
+        if self.transport is not None and self.transport.get_write_buffer_size():
+            for data in items:
+                self._sendto(data, addr)
+            return
+        super()._sendmsg_gso(items, addr)
+
+    def _schedule(self, delay: float, callback: Callable, *args) -> TimerEntry:
+        """登记定时器，比当前事件循环定时器更早到期时重新设置事件循环定时器"""
+        with self.lock:
+            entry = self.timers.schedule(self.clock() + delay, callback, *args)
+            if self.timers.is_head(entry):
+                self._wake_loop(self._rearm_timer)
+            return entry
+
+    def _wake_loop(self, callback: Callable):
+        """在事件循环线程中执行 callback，允许从其他线程调用"""
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback()
+        else:
+            self.loop.call_soon_threadsafe(callback)
+
+    def _rearm_timer(self):
+        """按最早的截止时间重新设置事件循环定时器"""
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        if not self.running or self.loop is None:
+            return
+        next_deadline = self.timers.next_deadline()
+        if next_deadline is not None:
+            delay = max(0.0, next_deadline - self.clock())
+            self.timer_handle = self.loop.call_later(delay, self._on_loop_timer)
+
+    def _on_loop_timer(self):
+        """事件循环定时器到期，执行所有到期的协议定时器"""
+        self.timer_handle = None
+        with self.lock:
+            self._run_due_timers(self.clock())
+            self._rearm_timer()
+
+    def send_reliable(self, data: dict, addr: tuple, priority: str = PRIORITY_CONTROL,
+                      channel: Optional[int] = None, ttl: Optional[float] = None,
+                      supersede: Optional[Hashable] = None) -> int:
+        """发送可靠数据包，合并发送模式下在本轮事件循环结束时自动 flush"""
+        result = super().send_reliable(data, addr, priority, channel, ttl, supersede)
+        if self.coalesce and not self.flush_scheduled and self.loop is not None:
+            self.flush_scheduled = True
+            self._wake_loop(self._scheduled_flush)
+        return result
+
+    def _scheduled_flush(self):
+        """在事件循环中延后一步执行 flush，让同一轮回调产生的消息合并发送"""
+        if self.loop is not None:
+            self.loop.call_soon(self._do_scheduled_flush)
+
+    def _do_scheduled_flush(self):
+        self.flush_scheduled = False
+        self.flush()
+
+    def close(self):
+        """关闭连接"""
+        self.running = False
+        self.timers.clear()
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            self.socket.close()
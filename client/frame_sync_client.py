@@ -3,7 +3,8 @@ import pygame
 import sys
 import math
 from typing import Optional, TYPE_CHECKING
-from .reliable_udp import ReliableUDP
+from .reliable_udp import ReliableUDP, PRIORITY_REALTIME
+from .loopback_transport import LoopbackNetwork, LoopbackReliableUDP
 from .unit import Unit
 from .grid_manager import GridManager
 from .bullet import Bullet
@@ -17,11 +18,17 @@ def same_player_id(id1, id2) -> bool:
 
 
 class FrameSyncClient:
-    def __init__(self, server_host='127.0.0.1', server_port=8888):
+    def __init__(self, server_host='127.0.0.1', server_port=8888, impairment=None,
+                 network: Optional[LoopbackNetwork] = None):
         self.server_addr = (server_host, server_port)
-        self.udp = ReliableUDP(is_server=False)
+        # 网络损伤模拟配置（测试用），重连时沿用，见 client/network_simulator.py
+        self.impairment = impairment
+        # 进程内的内存回环网络（测试用），指定时不使用 socket，由 network.run() 驱动
+        self.network = network
+        self.udp = self._create_udp()
         self.udp.register_callback('on_message', self._handle_server_message)
         self.udp.register_callback('on_disconnect', self._handle_disconnect)
+        self.udp.register_callback('on_resume', self._handle_resume)
         
         # 游戏状态
         self.player_id = None
@@ -42,6 +49,11 @@ class FrameSyncClient:
         self.server_frame = -1
         self.received_inputs = {}  # {frame: inputs}
         self.pending_inputs = {}  # {frame: inputs} 等待确认的输入
+        # 冗余输入：每个不可靠数据报携带最早的若干个未确认帧和当前帧的输入，丢包在下一次发送时自动补上
+        self.input_redundancy = 5
+        # 服务器在连接成功消息中声明支持冗余输入（player_inputs）后才使用，
+        # 之前（包括不支持的旧版本服务器）逐帧可靠发送 player_input
+        self.redundant_inputs = False
         
         # 输入管理
         self.input_buffer = []
@@ -57,11 +69,7 @@ class FrameSyncClient:
         self.selected_room_id = None  # 选中的房间ID
         
         # 网络状态
-        self.ping = 0  # ping值（毫秒）
-        self.last_ping_time = 0
-        self.ping_sent_time = 0
-        # 使用定点数表示ping间隔，实际间隔 = ping_interval / 1000 秒
-        self.ping_interval = 10000  # 每10秒发送一次ping（毫秒）
+        self.ping = 0  # ping值（毫秒），取自传输层测得的平滑RTT
         
         # 重连相关
         self.reconnect_attempts = 0
@@ -129,16 +137,22 @@ class FrameSyncClient:
         """尝试重连"""
         current_time = self.get_time_ms()
         if self.is_reconnecting and (current_time - self.last_reconnect_time) >= self.reconnect_delay:
-            if self.reconnect_attempts < self.max_reconnect_attempts:
+            if self.reconnect_attempts == 0 and self.udp.resume():
+                # 第一次尝试快速恢复会话：保留连接状态和游戏进度，服务器答复后 _handle_resume 结束重连
+                print("尝试恢复会话")
+                self.reconnect_attempts += 1
+                self.last_reconnect_time = current_time
+            elif self.reconnect_attempts < self.max_reconnect_attempts:
                 print(f"尝试重连 ({self.reconnect_attempts + 1}/{self.max_reconnect_attempts})")
                 self.reconnect_attempts += 1
                 self.last_reconnect_time = current_time
                 
                 # 重新创建UDP连接
                 self.udp.close()
-                self.udp = ReliableUDP(is_server=False)
+                self.udp = self._create_udp()
                 self.udp.register_callback('on_message', self._handle_server_message)
                 self.udp.register_callback('on_disconnect', self._handle_disconnect)
+                self.udp.register_callback('on_resume', self._handle_resume)
                 self.udp.connect(self.server_addr[0], self.server_addr[1])
                 
                 # 尝试重新连接
@@ -168,12 +182,36 @@ class FrameSyncClient:
             self.reconnect_attempts = 0
             self.last_reconnect_time = self.get_time_ms() - self.reconnect_delay  # 立即尝试第一次重连
     
-    def create_room(self, player_name="Player"):
-        """创建房间"""
+    def _handle_resume(self, addr, resumed: bool):
+        """处理恢复会话的结果：成功时直接继续，失败时立即改为重新连接"""
+        if not self.is_reconnecting:
+            return
+        if resumed:
+            print(f"已恢复与服务器 {addr} 的会话")
+            self.connected = True
+            self.is_reconnecting = False
+            self.reconnect_attempts = 0
+        else:
+            print("会话已过期，重新连接")
+            self.last_reconnect_time = self.get_time_ms() - self.reconnect_delay
+    
+    def _create_udp(self) -> ReliableUDP:
+        """创建网络层，指定了回环网络时在其上分配临时端口"""
+        # 合并发送：每次 run_frame 结束时统一 flush
+        # 收件队列：服务器消息在 run_frame 开始时处理，游戏状态只在主线程中修改
+        options = {'is_server': False, 'coalesce': True, 'inbox': True, 'impairment': self.impairment}
+        if self.network is not None:
+            return LoopbackReliableUDP(self.network, **options)
+        return ReliableUDP(**options)
+    
+    def create_room(self, player_name="Player", fec_group=None):
+        """创建房间，fec_group 为帧数据的前向纠错组大小（None 使用服务器默认值，0 表示不启用）"""
         create_data = {
             'type': 'create_room',
             'name': player_name
         }
+        if fec_group is not None:
+            create_data['fec_group'] = fec_group
         
         self.udp.send_reliable(create_data, self.server_addr)
         print("创建房间请求已发送")
@@ -216,8 +254,6 @@ class FrameSyncClient:
             self._handle_frame_inputs(data)
         elif msg_type == 'input_ack':
             self._handle_input_ack(data)
-        elif msg_type == 'pong':
-            self._handle_pong(data)
         elif msg_type == 'create_room_success':
             self._handle_create_room_success(data)
         elif msg_type == 'join_room_success':
@@ -262,6 +298,7 @@ class FrameSyncClient:
         """处理加入房间成功"""
         self.player_id = data['player_id']
         self.room_id = data['room_id']
+        self.redundant_inputs = data.get('redundant_inputs', False)
         self.in_lobby = False
         # 加入房间后自动连接到该房间
         # 不再自动调用connect，因为服务器已经在join_room_success响应中包含了连接成功所需的信息
@@ -282,11 +319,16 @@ class FrameSyncClient:
         """处理连接成功"""
         self.player_id = data['player_id']
         self.room_id = data.get('room_id')
+        self.redundant_inputs = data.get('redundant_inputs', False)
         self.connected = True
         self.in_lobby = False  # 直接进入游戏，不在大厅
         
         # 根据服务端的游戏状态设置客户端的游戏状态
         game_state = data['game_state']
+        if self.game_started and not game_state.get('game_started', False):
+            # game_start 已经先到，这是加入时的过时状态，不能覆盖已经开始的游戏
+            print(f"连接成功! 玩家ID: {self.player_id}, 房间ID: {self.room_id}, 游戏已开始，忽略过时的游戏状态")
+            return
         self.current_frame = game_state['frame']
         self.server_frame = self.current_frame - 1
         self.game_started = game_state.get('game_started', False)
@@ -314,7 +356,7 @@ class FrameSyncClient:
         
         print(f"游戏开始! 起始帧: {data['start_frame']}, 当前帧: {self.current_frame}")
         # ping
-        self.send_ping()
+        self.update_ping()
 
     def _create_initial_game_objects_for_all_players(self, players: dict):
         """为所有玩家创建初始游戏对象"""
@@ -385,6 +427,14 @@ class FrameSyncClient:
         
         # 存储输入
         self.received_inputs[frame] = inputs
+        
+        # 服务器捎带的本玩家已收齐的输入帧，之前的输入不再需要重发
+        input_acks = data.get('input_acks')
+        if input_acks and self.player_id is not None:
+            ack_frame = input_acks.get(str(self.player_id))
+            if ack_frame is not None:
+                for pending_frame in [f for f in self.pending_inputs if f <= ack_frame]:
+                    del self.pending_inputs[pending_frame]
         # print(f"保存帧输入: {frame}, inputs: {inputs}")
         
         # 更新server_frame
@@ -407,29 +457,43 @@ class FrameSyncClient:
         
         predicted_frame = self.server_frame + 2
 
-        # 判断pending_inputs是否存在预测帧
+        # 判断pending_inputs是否存在预测帧，存在时只重发未确认的输入
         if predicted_frame in self.pending_inputs:
             print(f"预测帧已存在: {predicted_frame}")
-            return
+            if not self.redundant_inputs:
+                # 可靠输入由传输层负责重传
+                return
+        else:
+            # 非空帧打印日志
+            if len(self.input_buffer) > 0:
+                print(f"发送非空输入: 帧 {predicted_frame} {self.input_buffer}, 当前帧: {self.current_frame}")
+            
+            # 添加到等待确认列表
+            self.pending_inputs[predicted_frame] = self.input_buffer.copy()
             
+            # 清空输入缓冲区
+            self.input_buffer.clear()
+            
+            if not self.redundant_inputs:
+                # 服务器不支持冗余输入，使用可靠传输逐帧发送，服务器逐帧回复 input_ack
+                input_data = {
+                    'type': 'player_input',
+                    'frame': predicted_frame,
+                    'inputs': self.pending_inputs[predicted_frame]
+                }
+                self.udp.send_reliable(input_data, self.server_addr, PRIORITY_REALTIME)
+                return
+        
+        # 使用不可靠传输发送最早的几个未确认帧和当前帧，不等待重传定时器；
+        # 从最早的帧开始发送，连续丢包超过冗余帧数时较早的帧也会一直重发到被确认
+        frames = sorted(self.pending_inputs)[:self.input_redundancy]
+        if predicted_frame not in frames:
+            frames.append(predicted_frame)
         input_data = {
-            'type': 'player_input',
-            'frame': predicted_frame,
-            'inputs': self.input_buffer.copy()
+            'type': 'player_inputs',
+            'frames': [[frame, self.pending_inputs[frame]] for frame in frames]
         }
-
-        # 非空帧打印日志
-        if len(input_data['inputs']) > 0:
-            print(f"发送非空输入: {input_data}, 当前帧: {self.current_frame}")
-        
-        # 使用可靠传输发送
-        self.udp.send_reliable(input_data, self.server_addr)
-        
-        # 添加到等待确认列表
-        self.pending_inputs[predicted_frame] = self.input_buffer.copy()
-        
-        # 清空输入缓冲区
-        self.input_buffer.clear()
+        self.udp.send_unreliable(input_data, self.server_addr, PRIORITY_REALTIME)
     
     def apply_inputs(self, frame: int):
         """应用输入到游戏状态"""
@@ -582,7 +646,14 @@ class FrameSyncClient:
         return self.current_frame * 50
 
     def run_frame(self):
-        """运行客户端帧逻辑"""
+        """运行客户端帧逻辑：先处理本帧之前收到的消息，结束时把本帧产生的消息打包发送"""
+        self.udp.poll()
+        try:
+            return self._run_frame()
+        finally:
+            self.udp.flush()
+    
+    def _run_frame(self):
         current_time = self.get_time_ms()
         
         # 处理重连
@@ -602,8 +673,8 @@ class FrameSyncClient:
             self.last_room_list_update = current_time
         
         if not self.game_started:
-            # 即使游戏未开始也发送ping
-            self.send_ping()
+            # 即使游戏未开始也更新ping
+            self.update_ping()
             return False
         
         # 锁帧
@@ -643,7 +714,7 @@ class FrameSyncClient:
         
         self.run_one_frame()
 
-        self.send_ping()
+        self.update_ping()
 
         return True
 
@@ -664,30 +735,11 @@ class FrameSyncClient:
         # 只有当真正处理了一个游戏逻辑帧后，才增加逻辑帧计数
         self.logic_frame_count += 1
        
-    def send_ping(self):
-        """发送ping请求"""
-        current_time = self.get_time_ms()
-        if current_time - self.last_ping_time >= self.ping_interval and self.connected:
-            ping_data = {
-                'type': 'ping',
-                'timestamp': current_time
-            }
-            self.udp.send_reliable(ping_data, self.server_addr)
-            self.ping_sent_time = current_time
-            self.last_ping_time = current_time
-            
-            # 每次ping时上报当前帧信息，帮助服务器同步
-            if self.connected and hasattr(self, 'server_frame'):
-                ping_data['server_frame'] = self.server_frame
-    
-    def _handle_pong(self, data: dict):
-        """处理pong响应"""
-        current_time = self.get_time_ms()
-        sent_time = data['timestamp']
-        self.ping = current_time - sent_time  # 保持为毫秒
-        server_frame = data['server_frame']
-        # print(f"Ping: {self.ping:.2f}ms, self.current_frame: {self.current_frame}, server_frame: {server_frame}")
-        # self.current_frame = server_frame - 1
+    def update_ping(self):
+        """更新ping值，直接使用可靠传输层根据确认包测得的平滑RTT"""
+        rtt = self.udp.get_rtt(self.server_addr)
+        if rtt is not None:
+            self.ping = rtt
     
     def send_start_game_request(self):
         """发送开始游戏请求到服务器"""
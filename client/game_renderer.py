@@ -535,6 +535,16 @@ class GameRenderer:
             logic_fps_text = self.font.render(f"逻辑帧率: {self.client.logic_fps:.1f} FPS", True, self.colors['ui_text'])
             self.screen.blit(logic_fps_text, (10, 190))
             
+            # 传输层统计：重传率、重复包和收发流量
+            metrics = self.client.udp.get_metrics(self.client.server_addr)
+            if metrics:
+                counters = metrics['counters']
+                transport_text = self.font.render(
+                    f"重传率: {metrics['loss_rate'] * 100:.1f}% 重复: {counters['duplicates']} "
+                    f"收/发: {counters['bytes_received'] / 1024:.0f}/{counters['bytes_sent'] / 1024:.0f}KB",
+                    True, self.colors['ui_text'])
+                self.screen.blit(transport_text, (10, 220))
+            
             # 连接状态
             status = "已连接" if self.client.connected else "未连接"
             if self.client.is_reconnecting:
@@ -0,0 +1,167 @@
+import heapq
+import itertools
+from typing import Callable, Dict, List, Optional
+from .reliable_udp import ReliableUDP
+
+# 客户端没有绑定端口时由回环网络分配的临时端口起点
+EPHEMERAL_PORT_START = 40000
+
+
+class LoopbackNetwork:
+    """
+    进程内的内存回环网络：ReliableUDP 端点之间的数据报在内存队列中传递，不使用 socket 和线程。
+    时间是虚拟的，只在 run() 中按下一个事件（数据报、协议定时器、周期回调）的时间跳跃前进，
+    服务器和大量客户端可以在一个进程中以 CPU 速度运行；同样的输入总是得到同样的事件顺序，
+    适合基准测试和可复现的测试。需要延迟和丢包时给端点配置 impairment（见 network_simulator.py）。
+    用法：
+        network = LoopbackNetwork()
+        server = FrameSyncServer('127.0.0.1', 8888, backend=BACKEND_LOOPBACK, network=network)
+        network.every(0.001, server.run_frame)
+        client = LoopbackReliableUDP(network)
+        client.connect('127.0.0.1', 8888)
+        network.run(1.0)
+    """
+
+    def __init__(self, start_time: float = 0.0):
+        self.now = start_time
+        self.endpoints: Dict[tuple, 'LoopbackReliableUDP'] = {}  # {地址: 端点}，按绑定顺序处理定时器
+        self.queue: List[tuple] = []  # 待交付的数据报 [(data, 源地址, 目标地址)]，按发送顺序交付
+        self.tickers = []  # 周期回调的最小堆 [(下次调用时间, 序号, 间隔, 回调)]
+        self._order = itertools.count()
+        self.next_port = EPHEMERAL_PORT_START
+        self.stats = {'datagrams': 0, 'bytes': 0, 'unroutable': 0}
+
+    def clock(self) -> float:
+        """虚拟时钟（秒），作为端点的 clock 使用"""
+        return self.now
+
+    @staticmethod
+    def _normalize(addr: tuple) -> tuple:
+        host, port = addr
+        return ('127.0.0.1' if host in ('localhost', '') else host, port)
+
+    def bind(self, endpoint: 'LoopbackReliableUDP', addr: Optional[tuple]) -> tuple:
+        """登记端点，addr 为 None 或端口为 0 时分配临时端口，地址已被占用时抛出 OSError"""
+        if addr is None or addr[1] == 0:
+            host = '127.0.0.1' if addr is None else addr[0]
+            while self._normalize((host, self.next_port)) in self.endpoints:
+                self.next_port += 1
+            addr = (host, self.next_port)
+            self.next_port += 1
+        addr = self._normalize(addr)
+        if addr in self.endpoints:
+            raise OSError(f"地址已被占用: {addr}")
+        self.endpoints[addr] = endpoint
+        return addr
+
+    def unbind(self, addr: tuple):
+        self.endpoints.pop(addr, None)
+
+    def send(self, data: bytes, source: tuple, dest: tuple):
+        """发送一个数据报，在 run() 中交付，没有端点绑定目标地址时丢弃"""
+        self.stats['datagrams'] += 1
+        self.stats['bytes'] += len(data)
+        self.queue.append((bytes(data), source, self._normalize(dest)))
+
+    def every(self, interval: float, callback: Callable):
+        """每隔 interval 秒（虚拟时间）调用一次 callback，用于驱动服务器和客户端的 run_frame"""
+        heapq.heappush(self.tickers, (self.now + interval, next(self._order), interval, callback))
+
+    def run(self, seconds: float, until: Optional[Callable[[], bool]] = None) -> bool:
+        """
+        推进 seconds 秒虚拟时间：交付数据报，按时间顺序执行各端点到期的定时器和周期回调。
+        until 返回 True 时提前结束。返回 until 是否满足（没有 until 时总是 True）
+        """
+        deadline = self.now + seconds
+        while True:
+            self._deliver()
+            if until is not None and until():
+                return True
+            next_time = self._next_deadline()
+            if next_time is None or next_time > deadline:
+                self.now = max(self.now, deadline)
+                return until is None
+            self.now = max(self.now, next_time)
+            self._run_due()
+
+    def _deliver(self):
+        """交付队列中的数据报，交付过程中产生的新数据报（如确认）在同一轮中继续交付"""
+        queue = self.queue
+        index = 0
+        while index < len(queue):
+            data, source, dest = queue[index]
+            index += 1
+            endpoint = self.endpoints.get(dest)
+            if endpoint is None:
+                self.stats['unroutable'] += 1
+                continue
+            try:
+                endpoint._receive_loopback(data, source)
+            except Exception as e:
+                print(f"交付数据报到 {dest} 错误: {e}")
+        queue.clear()
+
+    def _next_deadline(self) -> Optional[float]:
+        deadlines = [deadline for deadline in (endpoint.timers.next_deadline()
+                                               for endpoint in self.endpoints.values()) if deadline is not None]
+        if self.tickers:
+            deadlines.append(self.tickers[0][0])
+        return min(deadlines) if deadlines else None
+
+    def _run_due(self):
+        now = self.now
+        for endpoint in list(self.endpoints.values()):
+            deadline = endpoint.timers.next_deadline()
+            if deadline is not None and deadline <= now:
+                with endpoint.lock:
+                    endpoint._run_due_timers(now)
+        while self.tickers and self.tickers[0][0] <= now:
+            due, _, interval, callback = heapq.heappop(self.tickers)
+            heapq.heappush(self.tickers, (due + interval, next(self._order), interval, callback))
+            callback()
+
+
+class LoopbackReliableUDP(ReliableUDP):
+    """
+    在 LoopbackNetwork 上收发的可靠UDP：协议逻辑与 ReliableUDP 相同，
+    不创建 socket 和后台线程，使用网络的虚拟时钟，定时器由 LoopbackNetwork.run() 执行。
+    客户端（或端口为 0 的服务器）由网络分配临时端口，绑定后的地址在 self.address 中
+    """
+
+    def __init__(self, network: LoopbackNetwork, host='127.0.0.1', port=0, is_server=False, **kwargs):
+        self.network = network
+        self.address = None
+        kwargs['clock'] = network.clock
+        super().__init__(host, port, is_server, **kwargs)
+
+    def _start_io(self):
+        """在回环网络上绑定地址，服务器使用指定的地址，客户端分配临时端口"""
+        self.address = self.network.bind(self, (self.host, self.port) if self.is_server else None)
+        self.port = self.address[1]
+
+    def _stop_io(self):
+        self.network.unbind(self.address)
+
+    def _sendto(self, data: bytes, addr: tuple):
+        """把数据报放入回环网络的交付队列，flush 期间先放入批量发送列表"""
+        if self.send_batch is not None:
+            self.send_batch.append((data, addr))
+            return
+        self.network.send(data, self.address, addr)
+        self.io_stats['send_datagrams'] += 1
+        self.io_stats['send_calls'] += 1
+
+    def _receive_loopback(self, data: bytes, addr: tuple):
+        """回环网络交付的数据报"""
+        if not self.running:
+            return
+        self.io_stats['recv_wakeups'] += 1
+        self.io_stats['recv_datagrams'] += 1
+        self.io_stats['recv_max_batch'] = max(self.io_stats['recv_max_batch'], 1)
+        self._receive_datagram(data, addr)
+
+    def get_socket_stats(self) -> dict:
+        """收发批量统计，没有内核 socket，不包括缓冲区大小和内核计数"""
+        stats = dict(self.io_stats)
+        stats['gso'] = False
+        return stats
@@ -5,10 +5,10 @@ from .game_renderer import GameRenderer
 from .input_handler import InputHandler
 
 
-def start_client(ip, port):
+def start_client(ip, port, impairment=None):
     pygame.init()
     
-    client = FrameSyncClient(ip, port)
+    client = FrameSyncClient(ip, port, impairment=impairment)
     renderer = GameRenderer(client)
     input_handler = InputHandler(client, renderer)
     
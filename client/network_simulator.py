@@ -0,0 +1,120 @@
+import json
+import random
+from typing import Optional
+
+# 单个方向的默认链路条件，全部为 0 表示不做任何损伤
+DEFAULT_CONDITIONS = {
+    'latency_ms': 0.0,  # 固定单向延迟
+    'jitter_ms': 0.0,  # 延迟在 [-jitter, +jitter] 内均匀抖动，抖动本身会造成乱序
+    'loss': 0.0,  # 独立随机丢包率
+    # 突发丢包（Gilbert-Elliott 模型），None 表示不启用，启用时替代 loss：
+    # {'p': 好->坏 转移概率, 'r': 坏->好 转移概率, 'good_loss': 好状态丢包率, 'bad_loss': 坏状态丢包率}
+    'gilbert': None,
+    'duplicate': 0.0,  # 复制一份数据报的概率，副本独立计算延迟
+    'reorder': 0.0,  # 数据报被额外延迟 reorder_delay_ms 的概率，使其落后于之后发出的数据报
+    'reorder_delay_ms': 20.0,
+    'bandwidth_kbps': 0.0,  # 带宽上限（千比特/秒），0 表示不限制，超出时数据报排队
+    'queue_ms': 200.0  # 带宽受限时的最大排队时延，超过则丢弃（尾部丢弃）
+}
+
+
+class ImpairedLink:
+    """
+    单个方向的链路损伤模型
+    只计算每个数据报的命运（丢弃、延迟多少、是否复制），不负责调度，
+    由 ReliableUDP 用自己的定时器在对应时间发送或交付
+    """
+
+    def __init__(self, conditions: Optional[dict] = None, seed=None):
+        unknown = set(conditions or ()) - set(DEFAULT_CONDITIONS)
+        if unknown:
+            raise ValueError(f"未知的链路条件: {', '.join(sorted(unknown))}")
+        self.conditions = dict(DEFAULT_CONDITIONS, **(conditions or {}))
+        gilbert = self.conditions['gilbert']
+        if gilbert and set(gilbert) != {'p', 'r', 'good_loss', 'bad_loss'}:
+            raise ValueError("gilbert 需要 p, r, good_loss, bad_loss 四个参数")
+        self.rng = random.Random(seed)
+        self.bad_state = False  # Gilbert-Elliott 当前是否处于坏状态
+        self.busy_until = 0.0  # 带宽受限时链路空闲的时间（秒）
+        self.stats = {'submitted': 0, 'dropped': 0, 'queue_dropped': 0, 'duplicated': 0, 'reordered': 0}
+
+    def _lost(self) -> bool:
+        gilbert = self.conditions['gilbert']
+        if not gilbert:
+            return self.rng.random() < self.conditions['loss']
+        # 先按当前状态决定是否丢包，再转移状态
+        lost = self.rng.random() < (gilbert['bad_loss'] if self.bad_state else gilbert['good_loss'])
+        if self.rng.random() < (gilbert['r'] if self.bad_state else gilbert['p']):
+            self.bad_state = not self.bad_state
+        return lost
+
+    def _delay(self) -> float:
+        conditions = self.conditions
+        delay = conditions['latency_ms']
+        if conditions['jitter_ms']:
+            delay += self.rng.uniform(-conditions['jitter_ms'], conditions['jitter_ms'])
+        if conditions['reorder'] and self.rng.random() < conditions['reorder']:
+            delay += conditions['reorder_delay_ms']
+            self.stats['reordered'] += 1
+        return max(0.0, delay) / 1000
+
+    def submit(self, size: int, now: float) -> list:
+        """提交一个 size 字节的数据报，返回各副本距现在的延迟（秒），空列表表示被丢弃"""
+        self.stats['submitted'] += 1
+        if self._lost():
+            self.stats['dropped'] += 1
+            return []
+
+        # 带宽限制：数据报按到达顺序串行发出，排队过久时尾部丢弃
+        bandwidth = self.conditions['bandwidth_kbps']
+        if bandwidth:
+            start = max(now, self.busy_until)
+            if start - now > self.conditions['queue_ms'] / 1000:
+                self.stats['queue_dropped'] += 1
+                return []
+            self.busy_until = start + size * 8 / (bandwidth * 1000)
+        queued = self.busy_until - now if bandwidth else 0.0
+
+        delays = [queued + self._delay()]
+        if self.conditions['duplicate'] and self.rng.random() < self.conditions['duplicate']:
+            self.stats['duplicated'] += 1
+            delays.append(queued + self._delay())
+        return delays
+
+
+class NetworkSimulator:
+    """
+    收发两个方向的链路损伤，由 ReliableUDP 的 impairment 构造参数启用：
+        {'seed': 1, 'outbound': {...}, 'inbound': {...}}
+    方向相对于本端；顶层的链路条件同时作用于两个方向，方向内的同名条件优先。
+    通信双方都启用时两端的损伤叠加（例如双方各 40ms 延迟，RTT 为 160ms）
+    """
+
+    def __init__(self, config: dict):
+        config = dict(config)
+        seed = config.pop('seed', None)
+        outbound = config.pop('outbound', None) or {}
+        inbound = config.pop('inbound', None) or {}
+        # 两个方向使用独立但可复现的随机序列
+        self.outbound = ImpairedLink(dict(config, **outbound), None if seed is None else f"{seed}:outbound")
+        self.inbound = ImpairedLink(dict(config, **inbound), None if seed is None else f"{seed}:inbound")
+
+    def get_stats(self) -> dict:
+        return {'outbound': dict(self.outbound.stats), 'inbound': dict(self.inbound.stats)}
+
+
+def parse_impairment(text: Optional[str]) -> Optional[dict]:
+    """
+    解析命令行中的链路损伤配置：JSON 对象，或者 key=value 逗号分隔的简写
+    例如 "latency_ms=60,jitter_ms=10,loss=0.02,seed=1"（简写只能设置两个方向共用的数值条件）
+    """
+    if not text:
+        return None
+    text = text.strip()
+    if text.startswith('{'):
+        return json.loads(text)
+    config = {}
+    for item in text.split(','):
+        key, _, value = item.partition('=')
+        config[key.strip()] = int(value) if key.strip() == 'seed' else float(value)
+    return config
@@ -0,0 +1,596 @@
+import json
+import struct
+import time
+import zlib
+from typing import Optional, Tuple
+from .zlib_dictionary import PRESET_DICTIONARY
+
+# 编码名称，连接建立时通过心跳包协商
+CODEC_JSON = 'json'        # 旧格式：json.dumps + zlib.compress
+CODEC_BINARY = 'binary'    # 二进制格式：固定包头 + 类型化负载
+
+# 二进制包首字节。zlib 流的首字节固定为 0x78，因此可以用首字节区分两种格式
+MAGIC = 0xA2
+
+# 包头：magic, 包类型, 标志位, 序列号, 累计确认号, 选择确认位图, 发送时间戳（毫秒，取低32位）
+# 累计确认号 ack 表示对端已按序收到 ack 及之前的所有可靠包；
+# 位图第 i 位表示序列号 ack + 2 + i 的包已收到（ack + 1 必然缺失）
+HEADER = struct.Struct('!BBBHHII')
+HEADER_SIZE = HEADER.size
+SACK_BITS = 32
+
+# 时间戳回显（FLAG_ECHO）：紧跟包头，回显对端最近一个包的发送时间戳，以及该包在本端停留的毫秒数，
+# 对端据此用任意数据包测量往返时间：RTT = 当前时间 - 回显时间戳 - 停留时间
+ECHO = struct.Struct('!IH')
+ECHO_SIZE = ECHO.size
+MAX_ECHO_DELAY_MS = 0xFFFF
+
+# 会话令牌（FLAG_SESSION）：紧跟时间戳回显，服务器连接时分配的 64 位随机数，
+# 客户端地址变化（NAT 重新映射、切换网络）后服务器凭令牌把连接状态迁移到新地址
+SESSION = struct.Struct('!Q')
+SESSION_SIZE = SESSION.size
+
+# 通道（FLAG_CHANNEL）：紧跟会话令牌，可靠包所属的通道和通道内序列号。
+# 接收端按通道分别排序交付，一个通道丢包重传时不阻塞其他通道的消息
+CHANNEL = struct.Struct('!BH')
+CHANNEL_SIZE = CHANNEL.size
+MAX_HEADER_SIZE = HEADER_SIZE + ECHO_SIZE + SESSION_SIZE + CHANNEL_SIZE
+
+# 标志位
+FLAG_ACK = 0x01     # ack 和位图字段有效
+FLAG_COMPRESSED = 0x02  # 负载经过 deflate 压缩（使用预置字典）
+FLAG_ECHO = 0x04    # 包头后附带时间戳回显
+FLAG_SESSION = 0x08  # 包头后附带会话令牌
+FLAG_CHANNEL = 0x10  # 包头后附带通道和通道内序列号
+FLAG_FEC = 0x20     # 可靠包属于前向纠错的修复组，接收端需要缓存其负载
+
+# 自适应压缩：小于阈值的负载（确认、心跳、单帧输入）压缩后通常更大，直接发送；
+# 较大的负载压缩后更小才使用压缩结果
+COMPRESS_THRESHOLD = 128
+COMPRESS_LEVEL = 6
+COMPRESS_WBITS = 12     # 4KB 窗口，足够容纳预置字典和一个 MTU 大小的数据包
+COMPRESS_MEMLEVEL = 5   # 较小的哈希表，降低每个包初始化压缩器的开销
+DICTIONARY_ID = 1       # 压缩负载首字节，标识所用的预置字典版本
+MAX_DECOMPRESSED_SIZE = 65507
+DECOMPRESS_CHUNK = 2048  # 解压输出的第一块大小，大于一个 MTU 的负载解压后的典型大小
+
+# 负载首字节：消息类型
+MSG_JSON = 0            # 通用消息，紧凑 JSON
+MSG_PLAYER_INPUT = 1
+MSG_FRAME_INPUTS = 2
+MSG_INPUT_ACK = 3
+MSG_PING = 4
+MSG_PONG = 5
+MSG_HEARTBEAT = 6
+MSG_HEARTBEAT_ACK = 7
+MSG_BUNDLE = 8          # 合并包：一个序列号承载多条消息
+MSG_PLAYER_INPUTS = 9   # 冗余输入：最近若干个未确认帧的输入
+MSG_FRAGMENT = 10       # 分片：超过 MTU 的消息拆成多个可靠包，接收端重组
+MSG_SESSION_EXPIRED = 11  # 服务器答复未知会话令牌，只有一个字节，答复不大于请求
+
+# 合并包开销：消息类型 + 消息数量，以及每条消息的长度前缀
+BUNDLE_OVERHEAD = 2
+BUNDLE_ITEM_OVERHEAD = 2
+BUNDLE_MAX_MESSAGES = 255
+
+# 分片头：消息类型, 消息ID, 分片序号, 分片总数
+FRAGMENT_HEADER = struct.Struct('!BHHH')
+FRAGMENT_OVERHEAD = FRAGMENT_HEADER.size
+FRAGMENT_MAX_COUNT = 0xFFFF
+
+# 修复包（前向纠错）：通道, 成员数；每个成员为 序列号, 通道内序列号；之后是各成员符号的异或。
+# 成员符号为 长度前缀 + 未压缩的负载，按最长的符号补零后逐字节异或，
+# 接收端缺少其中一个成员时，用修复块异或其余成员的符号即可还原
+REPAIR_HEADER = struct.Struct('!BB')
+REPAIR_MEMBER = struct.Struct('!HH')
+REPAIR_MAX_MEMBERS = 255
+
+# 包类型取值与 reliable_udp.PacketType 保持一致
+_TYPE_ACK = 2
+_TYPE_REPAIR = 4
+
+_INT32 = struct.Struct('!i')
+_INT64 = struct.Struct('!q')
+_PLAYER_INPUTS = struct.Struct('!HH')    # player_id, 输入JSON长度
+_FRAME_INPUT = struct.Struct('!iH')      # frame, 输入JSON长度
+_INPUT_ACK_FRAME = struct.Struct('!Hi')  # player_id, 服务器已收齐的输入帧
+_INPUT_ACK = struct.Struct('!iiH')       # frame, server_frame, player_id
+_PONG = struct.Struct('!qi')             # timestamp, server_frame
+_LENGTH = struct.Struct('!H')
+
+# 已载入预置字典的压缩器和解压器模板，每个包复制一份，避免重复分配窗口和处理字典
+_COMPRESSOR = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -COMPRESS_WBITS, COMPRESS_MEMLEVEL,
+                               zdict=PRESET_DICTIONARY)
+_DECOMPRESSOR = zlib.decompressobj(-COMPRESS_WBITS, zdict=PRESET_DICTIONARY)
+
+_INT32_MIN, _INT32_MAX = -2 ** 31, 2 ** 31 - 1
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _dumps(obj) -> bytes:
+    """紧凑 JSON 编码"""
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _loads(data) -> object:
+    """JSON 解码，接受 bytes 或 memoryview（bytes 不会被复制）"""
+    return json.loads(bytes(data))
+
+
+def _is_int(value, low: int, high: int) -> bool:
+    # bool 是 int 的子类，需要排除
+    return type(value) is int and low <= value <= high
+
+
+def _player_id(value) -> Optional[int]:
+    """服务器使用 int 作为玩家ID，JSON 传输后会变成 str，两种形式都转换为 int"""
+    if isinstance(value, str) and value.isdigit() and str(int(value)) == value:
+        value = int(value)
+    return value if _is_int(value, 0, 0xFFFF) else None
+
+
+def now_ms() -> int:
+    """当前时间（毫秒，取低32位）"""
+    return int(time.time() * 1000) & 0xFFFFFFFF
+
+
+# ---------------------------------------------------------------------------
+# 旧格式
+# ---------------------------------------------------------------------------
+
+def encode_json(packet: dict) -> bytes:
+    """旧格式编码：json + zlib"""
+    return zlib.compress(json.dumps(packet).encode('utf-8'))
+
+
+def decode_json(data: bytes, max_size: int = MAX_DECOMPRESSED_SIZE) -> dict:
+    """旧格式解码，解压后超过 max_size 字节的数据视为无效，不会被压缩炸弹耗尽内存和CPU"""
+    return json.loads(_decompress_limited(zlib.decompressobj(), data, max_size).decode())
+
+
+# ---------------------------------------------------------------------------
+# 类型化负载
+# ---------------------------------------------------------------------------
+
+def _encode_typed(data: dict) -> Optional[bytes]:
+    """热点消息的类型化编码，字段不符合预期时返回 None 走通用 JSON"""
+    msg_type = data.get('type')
+    keys = data.keys()
+
+    if msg_type == 'player_input':
+        frame = data.get('frame')
+        inputs = data.get('inputs')
+        if keys != {'type', 'frame', 'inputs'} or not _is_int(frame, _INT32_MIN, _INT32_MAX) \
+                or not isinstance(inputs, list):
+            return None
+        tail = _dumps(inputs) if inputs else b''
+        return bytes((MSG_PLAYER_INPUT,)) + _INT32.pack(frame) + tail
+
+    if msg_type == 'player_inputs':
+        frames = data.get('frames')
+        if keys != {'type', 'frames'} or not isinstance(frames, list) or len(frames) > 255:
+            return None
+        parts = [bytes((MSG_PLAYER_INPUTS, len(frames)))]
+        for item in frames:
+            if not isinstance(item, (list, tuple)) or len(item) != 2:
+                return None
+            frame, inputs = item
+            if not _is_int(frame, _INT32_MIN, _INT32_MAX) or not isinstance(inputs, list):
+                return None
+            body = _dumps(inputs) if inputs else b''
+            if len(body) > 0xFFFF:
+                return None
+            parts.append(_FRAME_INPUT.pack(frame, len(body)))
+            parts.append(body)
+        return b''.join(parts)
+
+    if msg_type == 'frame_inputs':
+        frame = data.get('frame')
+        inputs = data.get('inputs')
+        input_acks = data.get('input_acks', {})
+        if keys - {'input_acks'} != {'type', 'frame', 'inputs'} or not _is_int(frame, _INT32_MIN, _INT32_MAX) \
+                or not isinstance(inputs, dict) or len(inputs) > 255 \
+                or not isinstance(input_acks, dict) or len(input_acks) > 255:
+            return None
+        parts = [bytes((MSG_FRAME_INPUTS, len(inputs))), _INT32.pack(frame)]
+        for player_id, player_inputs in inputs.items():
+            player_id = _player_id(player_id)
+            if player_id is None or not isinstance(player_inputs, list):
+                return None
+            body = _dumps(player_inputs) if player_inputs else b''
+            if len(body) > 0xFFFF:
+                return None
+            parts.append(_PLAYER_INPUTS.pack(player_id, len(body)))
+            parts.append(body)
+        # 可选的输入确认表附在末尾，旧版本解码时会忽略
+        if 'input_acks' in data:
+            parts.append(bytes((len(input_acks),)))
+            for player_id, ack_frame in input_acks.items():
+                player_id = _player_id(player_id)
+                if player_id is None or not _is_int(ack_frame, _INT32_MIN, _INT32_MAX):
+                    return None
+                parts.append(_INPUT_ACK_FRAME.pack(player_id, ack_frame))
+        return b''.join(parts)
+
+    if msg_type == 'input_ack':
+        frame = data.get('frame')
+        server_frame = data.get('server_frame')
+        player_id = data.get('player_id')
+        if keys != {'type', 'frame', 'server_frame', 'player_id'} \
+                or not _is_int(frame, _INT32_MIN, _INT32_MAX) \
+                or not _is_int(server_frame, _INT32_MIN, _INT32_MAX) \
+                or not _is_int(player_id, 0, 0xFFFF):
+            return None
+        return bytes((MSG_INPUT_ACK,)) + _INPUT_ACK.pack(frame, server_frame, player_id)
+
+    if msg_type == 'ping':
+        timestamp = data.get('timestamp')
+        if keys != {'type', 'timestamp'} or not _is_int(timestamp, _INT64_MIN, _INT64_MAX):
+            return None
+        return bytes((MSG_PING,)) + _INT64.pack(timestamp)
+
+    if msg_type == 'pong':
+        timestamp = data.get('timestamp')
+        server_frame = data.get('server_frame')
+        if keys != {'type', 'timestamp', 'server_frame'} \
+                or not _is_int(timestamp, _INT64_MIN, _INT64_MAX) \
+                or not _is_int(server_frame, _INT32_MIN, _INT32_MAX):
+            return None
+        return bytes((MSG_PONG,)) + _PONG.pack(timestamp, server_frame)
+
+    if msg_type == 'heartbeat' and len(keys) == 1:
+        return bytes((MSG_HEARTBEAT,))
+
+    if msg_type == 'heartbeat_ack' and len(keys) == 1:
+        return bytes((MSG_HEARTBEAT_ACK,))
+
+    if msg_type == 'session_expired' and len(keys) == 1:
+        return bytes((MSG_SESSION_EXPIRED,))
+
+    return None
+
+
+def encode_message(data: dict) -> bytes:
+    """编码一条应用层消息（负载部分）"""
+    typed = _encode_typed(data)
+    if typed is not None:
+        return typed
+    return bytes((MSG_JSON,)) + _dumps(data)
+
+
+def decode_message(payload) -> dict:
+    """解码一条应用层消息（bytes 或 memoryview），结果与 JSON 格式解码得到的字典一致"""
+    kind = payload[0]
+
+    if kind == MSG_JSON:
+        return _loads(payload[1:])
+
+    if kind == MSG_PLAYER_INPUT:
+        frame, = _INT32.unpack_from(payload, 1)
+        tail = payload[1 + _INT32.size:]
+        return {'type': 'player_input', 'frame': frame, 'inputs': _loads(tail) if tail else []}
+
+    if kind == MSG_FRAME_INPUTS:
+        count = payload[1]
+        frame, = _INT32.unpack_from(payload, 2)
+        offset = 2 + _INT32.size
+        inputs = {}
+        for _ in range(count):
+            player_id, length = _PLAYER_INPUTS.unpack_from(payload, offset)
+            offset += _PLAYER_INPUTS.size
+            body = payload[offset:offset + length]
+            offset += length
+            # 与 JSON 传输保持一致，玩家ID为字符串
+            inputs[str(player_id)] = _loads(body) if length else []
+        message = {'type': 'frame_inputs', 'frame': frame, 'inputs': inputs}
+        if offset < len(payload):
+            input_acks = {}
+            ack_count = payload[offset]
+            offset += 1
+            for _ in range(ack_count):
+                player_id, ack_frame = _INPUT_ACK_FRAME.unpack_from(payload, offset)
+                offset += _INPUT_ACK_FRAME.size
+                input_acks[str(player_id)] = ack_frame
+            message['input_acks'] = input_acks
+        return message
+
+    if kind == MSG_PLAYER_INPUTS:
+        count = payload[1]
+        offset = 2
+        frames = []
+        for _ in range(count):
+            frame, length = _FRAME_INPUT.unpack_from(payload, offset)
+            offset += _FRAME_INPUT.size
+            body = payload[offset:offset + length]
+            offset += length
+            frames.append([frame, _loads(body) if length else []])
+        return {'type': 'player_inputs', 'frames': frames}
+
+    if kind == MSG_INPUT_ACK:
+        frame, server_frame, player_id = _INPUT_ACK.unpack_from(payload, 1)
+        return {'type': 'input_ack', 'frame': frame, 'server_frame': server_frame, 'player_id': player_id}
+
+    if kind == MSG_PING:
+        timestamp, = _INT64.unpack_from(payload, 1)
+        return {'type': 'ping', 'timestamp': timestamp}
+
+    if kind == MSG_PONG:
+        timestamp, server_frame = _PONG.unpack_from(payload, 1)
+        return {'type': 'pong', 'timestamp': timestamp, 'server_frame': server_frame}
+
+    if kind == MSG_HEARTBEAT:
+        return {'type': 'heartbeat'}
+
+    if kind == MSG_HEARTBEAT_ACK:
+        return {'type': 'heartbeat_ack'}
+
+    if kind == MSG_SESSION_EXPIRED:
+        return {'type': 'session_expired'}
+
+    raise ValueError(f"未知的消息类型: {kind}")
+
+
+def encode_bundle(payloads: list) -> bytes:
+    """把多条已编码的消息合并为一个负载"""
+    parts = [bytes((MSG_BUNDLE, len(payloads)))]
+    for payload in payloads:
+        parts.append(_LENGTH.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_bundle(payload: bytes) -> list:
+    """拆分合并包，返回消息列表"""
+    count = payload[1]
+    offset = BUNDLE_OVERHEAD
+    messages = []
+    for _ in range(count):
+        length, = _LENGTH.unpack_from(payload, offset)
+        offset += _LENGTH.size
+        messages.append(decode_message(payload[offset:offset + length]))
+        offset += length
+    return messages
+
+
+def encode_fragments(message_id: int, payload: bytes, chunk_size: int) -> list:
+    """把一条已编码的消息拆成分片负载列表"""
+    count = (len(payload) + chunk_size - 1) // chunk_size
+    if count > FRAGMENT_MAX_COUNT:
+        raise ValueError(f"消息过大，需要 {count} 个分片")
+    return [FRAGMENT_HEADER.pack(MSG_FRAGMENT, message_id, index, count) +
+            payload[index * chunk_size:(index + 1) * chunk_size]
+            for index in range(count)]
+
+
+def decode_fragment(payload) -> tuple:
+    """解析分片负载，返回 (消息ID, 分片序号, 分片总数, 数据)，数据总是复制为 bytes 以便保留到重组完成"""
+    _, message_id, index, count = FRAGMENT_HEADER.unpack_from(payload)
+    return message_id, index, count, bytes(payload[FRAGMENT_OVERHEAD:])
+
+
+def _xor_symbols(symbols, length: int) -> int:
+    """把若干符号（长度前缀 + 负载）补零到 length 字节后异或，结果以整数表示"""
+    block = 0
+    for payload in symbols:
+        if len(payload) + _LENGTH.size > length:
+            raise ValueError("修复包成员超过修复块长度")
+        block ^= int.from_bytes((_LENGTH.pack(len(payload)) + bytes(payload)).ljust(length, b'\0'), 'big')
+    return block
+
+
+def repair_overhead(count: int) -> int:
+    """count 个成员的修复包负载中除最长负载之外的字节数"""
+    return REPAIR_HEADER.size + REPAIR_MEMBER.size * count + _LENGTH.size
+
+
+def encode_repair(channel: int, members: list) -> bytes:
+    """编码修复包负载，members 为同一通道的 [(序列号, 通道内序列号, 未压缩的负载)]"""
+    length = max(len(payload) for _, _, payload in members) + _LENGTH.size
+    parts = [REPAIR_HEADER.pack(channel, len(members))]
+    parts.extend(REPAIR_MEMBER.pack(seq, cseq) for seq, cseq, _ in members)
+    parts.append(_xor_symbols([payload for _, _, payload in members], length).to_bytes(length, 'big'))
+    return b''.join(parts)
+
+
+def decode_repair(payload) -> tuple:
+    """解析修复包负载，返回 (通道, [(序列号, 通道内序列号)], 修复块)"""
+    channel, count = REPAIR_HEADER.unpack_from(payload)
+    offset = REPAIR_HEADER.size
+    members = [REPAIR_MEMBER.unpack_from(payload, offset + index * REPAIR_MEMBER.size) for index in range(count)]
+    return channel, members, bytes(payload[offset + count * REPAIR_MEMBER.size:])
+
+
+def recover_payload(block: bytes, payloads: list) -> bytes:
+    """用修复块和其余成员的负载还原缺失成员的负载"""
+    symbol = (int.from_bytes(block, 'big') ^ _xor_symbols(payloads, len(block))).to_bytes(len(block), 'big')
+    length, = _LENGTH.unpack_from(symbol)
+    if length + _LENGTH.size > len(symbol):
+        raise ValueError("修复块无效")
+    return symbol[_LENGTH.size:_LENGTH.size + length]
+
+
+def compress_payload(payload: bytes) -> Optional[bytes]:
+    """用预置字典压缩负载，负载小于阈值或压缩后没有变小时返回 None"""
+    if len(payload) < COMPRESS_THRESHOLD:
+        return None
+    compressor = _COMPRESSOR.copy()
+    body = bytes((DICTIONARY_ID,)) + compressor.compress(payload) + compressor.flush()
+    return body if len(body) < len(payload) else None
+
+
+def decompress_payload(body) -> bytes:
+    """解压 compress_payload 的结果"""
+    if body[0] != DICTIONARY_ID:
+        raise ValueError(f"未知的压缩字典: {body[0]}")
+    return _decompress_limited(_DECOMPRESSOR.copy(), body[1:], MAX_DECOMPRESSED_SIZE)
+
+
+def _decompress_limited(decompressor, data, max_size: int) -> bytes:
+    """
+    用 decompressor 解压完整的压缩流，解压后超过 max_size 字节或数据不完整时抛出 ValueError
+    输出按块解压，块大小从一个典型数据包开始加倍：直接传 max_length=MAX_DECOMPRESSED_SIZE 时
+    zlib 每次都会先分配 32KB 的输出缓冲区，而大多数负载解压后只有几百字节，一块就能解完
+    """
+    payload = decompressor.decompress(data, min(DECOMPRESS_CHUNK, max_size))
+    if decompressor.eof and not decompressor.unconsumed_tail:
+        return payload
+    chunks = [payload]
+    total = len(payload)
+    limit = DECOMPRESS_CHUNK * 2
+    while not decompressor.eof and total < max_size:
+        # 输入可能已经全部读入而输出还没有取完，此时用空输入继续取出
+        tail = decompressor.unconsumed_tail
+        chunk = decompressor.decompress(tail, min(limit, max_size - total))
+        if not chunk and not tail:
+            break
+        chunks.append(chunk)
+        total += len(chunk)
+        limit *= 2
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("压缩负载无效或解压后过大")
+    return b''.join(chunks)
+
+
+# ---------------------------------------------------------------------------
+# 二进制格式
+# ---------------------------------------------------------------------------
+
+def encode_binary(packet: dict, ack: Optional[Tuple[int, int]] = None, compress: bool = True,
+                  echo: Optional[Tuple[int, int]] = None, session: Optional[int] = None,
+                  timestamp_ms: Optional[int] = None) -> bytes:
+    """
+    二进制格式编码，packet 与旧格式使用相同的字典结构，ack 为捎带的 (累计确认号, 位图)
+    compress 为 True 时对较大的负载做自适应压缩，echo 为捎带的 (对端时间戳, 停留毫秒数)，
+    session 为捎带的会话令牌，packet 中有 channel 时附带通道和通道内序列号 cseq，
+    packet 中 fec 为 True 时设置 FLAG_FEC。包头时间戳总是实际发送时间，重传包也重新取值，对端回显后才能得到正确的RTT；
+    timestamp_ms 为发送端时钟的当前毫秒数（低32位），None 时取系统时间
+    """
+    packet_type = packet['type']
+    if timestamp_ms is None:
+        timestamp_ms = now_ms()
+
+    flags = 0
+    ack_seq, ack_bits = 0, 0
+    if ack is not None:
+        flags |= FLAG_ACK
+        ack_seq, ack_bits = ack
+    extensions = b''  # 包头扩展字段：时间戳回显、会话令牌、通道
+    if echo is not None:
+        flags |= FLAG_ECHO
+        extensions = ECHO.pack(echo[0], min(echo[1], MAX_ECHO_DELAY_MS))
+    if session is not None:
+        flags |= FLAG_SESSION
+        extensions += SESSION.pack(session)
+    if 'channel' in packet:
+        flags |= FLAG_CHANNEL
+        extensions += CHANNEL.pack(packet['channel'], packet['cseq'])
+    if packet.get('fec'):
+        flags |= FLAG_FEC
+
+    if packet_type == _TYPE_ACK:
+        return HEADER.pack(MAGIC, packet_type, flags, 0, ack_seq, ack_bits, timestamp_ms) + extensions
+    # 合并包等场景下负载已预先编码
+    payload = packet.get('payload')
+    if payload is None:
+        payload = encode_message(packet['data'])
+    if compress:
+        compressed = compress_payload(payload)
+        if compressed is not None:
+            flags |= FLAG_COMPRESSED
+            payload = compressed
+    header = HEADER.pack(MAGIC, packet_type, flags, packet.get('seq') or 0, ack_seq, ack_bits, timestamp_ms)
+    return header + extensions + payload
+
+
+def decode_header(data) -> dict:
+    """只解析二进制包头（data 可以是 memoryview），返回不含负载的包字典"""
+    magic, packet_type, flags, seq, ack_seq, ack_bits, timestamp_ms = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"无效的包头: {magic:#x}")
+
+    packet = {'type': packet_type, 'timestamp_ms': timestamp_ms}
+    if flags & FLAG_ACK:
+        packet['ack'] = (ack_seq, ack_bits)
+    if flags & FLAG_COMPRESSED:
+        packet['compressed'] = True
+    offset = HEADER_SIZE
+    if flags & FLAG_ECHO:
+        packet['echo'] = ECHO.unpack_from(data, offset)
+        offset += ECHO_SIZE
+    if flags & FLAG_SESSION:
+        packet['session'], = SESSION.unpack_from(data, offset)
+        offset += SESSION_SIZE
+    if flags & FLAG_CHANNEL:
+        packet['channel'], packet['cseq'] = CHANNEL.unpack_from(data, offset)
+    if flags & FLAG_FEC:
+        packet['fec'] = True
+    if packet_type != _TYPE_ACK:
+        packet['seq'] = seq
+    return packet
+
+
+def payload_offset(packet: dict) -> int:
+    """decode_header 解析出的包中负载的起始位置"""
+    offset = HEADER_SIZE
+    if 'echo' in packet:
+        offset += ECHO_SIZE
+    if 'session' in packet:
+        offset += SESSION_SIZE
+    if 'channel' in packet:
+        offset += CHANNEL_SIZE
+    return offset
+
+
+def peek_session(data) -> Optional[int]:
+    """不解码整个包头，只取出二进制包携带的会话令牌，JSON 包或没有令牌时返回 None"""
+    if len(data) < HEADER_SIZE or data[0] != MAGIC or not data[2] & FLAG_SESSION:
+        return None
+    offset = HEADER_SIZE + (ECHO_SIZE if data[2] & FLAG_ECHO else 0)
+    if len(data) < offset + SESSION_SIZE:
+        return None
+    return SESSION.unpack_from(data, offset)[0]
+
+
+def decode_payload(packet: dict, payload):
+    """
+    解码负载并按种类写入 packet 的 data / bundle / fragment / repair 字段，
+    返回未压缩的负载（可能是 memoryview）
+    """
+    if packet.pop('compressed', False):
+        payload = decompress_payload(payload)
+    if packet['type'] == _TYPE_REPAIR:
+        packet['repair'] = decode_repair(payload)
+    elif payload[0] == MSG_BUNDLE:
+        packet['bundle'] = decode_bundle(payload)
+    elif payload[0] == MSG_FRAGMENT:
+        packet['fragment'] = decode_fragment(payload)
+    else:
+        packet['data'] = decode_message(payload)
+    return payload
+
+
+def decode_binary(data) -> dict:
+    """二进制格式解码，返回与旧格式相同结构的字典"""
+    packet = decode_header(data)
+    if packet['type'] != _TYPE_ACK:
+        decode_payload(packet, data[payload_offset(packet):])
+    return packet
+
+
+def encode(packet: dict, codec: str, ack: Optional[Tuple[int, int]] = None, compress: bool = True,
+           echo: Optional[Tuple[int, int]] = None, session: Optional[int] = None,
+           timestamp_ms: Optional[int] = None) -> bytes:
+    """
+    按指定编码格式编码数据包，旧格式不支持捎带确认、时间戳回显和会话令牌（忽略 ack、echo、session），
+    并且总是整体压缩
+    """
+    if codec == CODEC_BINARY:
+        return encode_binary(packet, ack, compress, echo, session, timestamp_ms)
+    return encode_json(packet)
+
+
+def decode(data: bytes) -> Tuple[dict, str]:
+    """根据首字节识别编码格式并解码，返回 (packet, codec)"""
+    if data and data[0] == MAGIC:
+        return decode_binary(data), CODEC_BINARY
+    return decode_json(data), CODEC_JSON
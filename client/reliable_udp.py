@@ -1,56 +1,222 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import select
 import socket
+import struct
 import time
 import threading
-import json
-import zlib
+from collections import deque
 from enum import Enum
-from typing import Dict, List, Optional, Callable, Any
+from typing import Dict, List, Optional, Callable, Any, Hashable
+from .packet_codec import (CODEC_BINARY, CODEC_JSON, SACK_BITS, MAX_HEADER_SIZE, BUNDLE_OVERHEAD,
+                           BUNDLE_ITEM_OVERHEAD, BUNDLE_MAX_MESSAGES, FRAGMENT_OVERHEAD, MAGIC, encode,
+                           encode_message, decode_message, encode_bundle, encode_fragments,
+                           decode_json, decode_header, decode_payload, payload_offset,
+                           REPAIR_MAX_MEMBERS, repair_overhead, encode_repair, recover_payload)
+from .timer_queue import TimerQueue, TimerEntry
+from .transport_metrics import TransportMetrics
+from .network_simulator import NetworkSimulator
+
+# 合并发送模式下，send_reliable 把消息放入发送队列，序列号在 flush 时分配
+SEND_QUEUED = -2
+# 发送队列已满（拥塞或对端长时间不确认），消息被拒绝，调用方应稍后重试或降低发送量
+SEND_BLOCKED = -3
+
+# 发送优先级：拥塞时 realtime（帧同步数据）先于 control（连接、房间等控制消息）发送，
+# bulk（房间列表、补发的历史帧等）另外受每个连接每 tick 的字节预算限制
+PRIORITY_REALTIME = 'realtime'
+PRIORITY_CONTROL = 'control'
+PRIORITY_BULK = 'bulk'
+PRIORITIES = (PRIORITY_REALTIME, PRIORITY_CONTROL, PRIORITY_BULK)  # 调度顺序
+# 各优先级排队时延的直方图名称
+QUEUE_DELAY_HISTOGRAMS = {priority: f"queue_delay_{priority}_ms" for priority in PRIORITIES}
+
+# 通道：可靠消息按通道分别排序交付，每个通道有独立的序列号空间和重排缓冲区，
+# 一个通道丢包重传时只阻塞本通道后面的消息。CHANNEL_UNORDERED 的消息收到即交付，只保证可靠不保证顺序
+CHANNEL_DEFAULT = 0
+CHANNEL_UNORDERED = 255
+
+# Linux UDP GSO：一次 sendmsg 提交多个等长数据报，由内核切分发送
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000
+
+SEQUENCE_MODULO = 65536  # 序列号为16位，回绕后从0重新开始
+
+# 未知地址在完成 cookie 握手前只能发送握手心跳，更大的数据报（或解压后更大的负载）直接丢弃，
+# 伪造源地址的大包不会消耗解压和解析的CPU
+HANDSHAKE_MAX_SIZE = 512
+
+def sequence_diff(a: int, b: int) -> int:
+    """回绕安全的序列号比较：返回 a - b，结果在 [-32768, 32767] 之间"""
+    diff = (a - b) % SEQUENCE_MODULO
+    return diff - SEQUENCE_MODULO if diff >= SEQUENCE_MODULO // 2 else diff
 
 class PacketType(Enum):
     UNRELIABLE = 0      # 不可靠数据包
     RELIABLE = 1        # 可靠数据包
     ACK = 2             # 确认包
     HEARTBEAT = 3       # 心跳包
+    REPAIR = 4          # 修复包（前向纠错），不可靠，只用于二进制格式
+
+# 按类型值查找 PacketType，比调用 PacketType(value) 快，接收路径每个数据报都要用到
+_PACKET_TYPES = {packet_type.value: packet_type for packet_type in PacketType}
+
+def _packet_kind(packet: dict) -> str:
+    """统计用的数据包种类：单条消息为消息类型，其余为 bundle / fragment / ack"""
+    if 'kind' in packet:
+        return packet['kind']
+    data = packet.get('data')
+    if isinstance(data, dict):
+        return str(data.get('type', 'unknown'))
+    if 'bundle' in packet:
+        return 'bundle'
+    if 'fragment' in packet:
+        return 'fragment'
+    return _PACKET_TYPES[packet['type']].name.lower()
 
 class ReliableUDP:
-    def __init__(self, host='localhost', port=8888, is_server=False):
+    def __init__(self, host='localhost', port=8888, is_server=False, codec=CODEC_BINARY, coalesce=False,
+                 recv_buffer_size=None, send_buffer_size=None, inbox=False, impairment=None,
+                 clock: Callable[[], float] = time.monotonic):
+        # 时钟（秒）：超时、重传、节奏控制和包头时间戳都按它计时，内存回环网络使用虚拟时钟
+        self.clock = clock
         self.host = host
         self.port = port
         self.is_server = is_server
-        
-        # UDP socket
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.settimeout(0.01)  # 设置超时，避免recvfrom阻塞
-        if is_server:
-            self.socket.bind((host, port))
-        else:
-            # 客户端不需要绑定特定端口，系统会分配
-            pass
+        # 期望使用的编码格式，binary 需要与对端协商，旧版本对端始终使用 json
+        self.codec = codec
+        # 合并发送：可靠消息先进入每个连接的发送队列，由 flush 打包成不超过 MTU 的数据包
+        self.coalesce = coalesce
+        self.mtu = 1200  # 单个数据包的最大字节数
+        self.compression = True  # 二进制格式下对较大的负载使用预置字典自适应压缩
+        # socket 收发缓冲区大小（字节），None 表示使用系统默认值
+        self.recv_buffer_size = recv_buffer_size
+        self.send_buffer_size = send_buffer_size
+        self.recv_batch_size = 64  # 每次唤醒最多连续读取的数据报数量
+        self.recv_ring_size = 16  # 接收缓冲环的槽数，每批最多这么多个数据报在解析后一起处理
+        self.recv_ring = []  # 预分配的接收缓冲区（memoryview），由 recvfrom_into 填充
+        self.gso_enabled = False  # 是否使用 UDP GSO 批量发送，创建 socket 时探测
+        self.send_batch = None  # flush 期间收集待发送的数据报 [(data, addr)]
+        self.io_stats = {
+            'recv_wakeups': 0,  # 接收线程被唤醒的次数
+            'recv_datagrams': 0,
+            'recv_max_batch': 0,  # 单次唤醒读取的最多数据报数
+            'send_datagrams': 0,
+            'send_calls': 0  # 实际发送的系统调用次数，GSO 合并后小于数据报数
+        }
+        # 传输统计：socket 级汇总，每个连接另有 state['metrics']，两者同时更新
+        self.metrics = TransportMetrics()
+        # 网络损伤模拟（测试用）：按配置对收发的数据报注入延迟、丢包、复制、乱序和带宽限制
+        self.simulator = NetworkSimulator(impairment) if impairment else None
         
         # 可靠传输相关 - 为每个连接维护独立的状态
-        self.connection_states = {}  # {addr: {'sequence_number', 'ack_history', 'received_packets', 'expected_sequence'}}
+        self.connection_states = {}  # {addr: {'sequence_number', 'ack_history', 'received_bits', 'expected_sequence'}}
         self.local_sequence_number = 0  # 本地序列号
         
         # 接收缓冲区 - 存储序列号对应的数据和地址
-        self.receive_buffer = {}  # {addr: {seq_num: {'data': data}}}
+        self.receive_buffer = {}  # {addr: {seq_num: {'messages': [data, ...]}}}
+        # 接收窗口：只接收 [expected_sequence, expected_sequence + receive_window) 范围内的包，
+        # 每个连接的去重位图和乱序缓冲区都不超过这个大小
+        self.receive_window = 1024
+        # send_reliable 未指定通道时按消息类型选择通道，未登记的类型使用 CHANNEL_DEFAULT
+        self.message_channels = {}  # {消息类型: 通道}
+        # 前向纠错：接收端缓存修复包覆盖的通道上最近收到的可靠包负载，用于还原组内缺失的包
+        self.fec_cache_size = 256
         
         # 连接管理
         self.connections = {}  # {addr: last_heartbeat}
+        # 会话：服务器为每个连接分配令牌，客户端在包头中携带，地址变化后凭令牌迁移连接状态
+        self.sessions = {}  # {令牌: addr}（仅服务器）
+        self.session_timeout = 10.0  # 持有会话的连接超过该时间（秒）没有数据才断开，期间可以恢复
+        self.resuming = False  # 客户端是否在等待服务器确认恢复会话
+        # 无状态握手：服务器不为未知地址保存任何状态，只答复一个由密钥、地址和时间段计算出的 cookie，
+        # 客户端在握手心跳中回显有效的 cookie 后才创建连接状态，伪造源地址的洪水无法占用内存
+        # 默认关闭：开启后不支持 cookie 的旧版本客户端无法连接，只在需要防护伪造源地址的洪水时开启
+        self.require_cookie = False
+        self.cookie_secret = secrets.token_bytes(16)
+        self.cookie_lifetime = 30.0  # cookie 按该时长（秒）分段，当前和上一个时间段的 cookie 有效
+        self.cookie_rate = 10000  # 每秒最多答复的 cookie 数（全局，不按地址统计），限制被用作反射源时的流量
+        self.cookie_allowance = float(self.cookie_rate)
+        self.cookie_time = self.clock()
         self.callbacks: Dict[str, Optional[Callable]] = {
             'on_message': None,
             'on_connect': None,
             'on_disconnect': None,
-            'on_message_failed': None  # 新增：消息发送失败的回调
+            'on_message_failed': None,  # 新增：消息发送失败的回调
+            'on_inbox': None,  # 收件队列从空变为非空时在网络线程中调用，用于唤醒游戏循环
+            'on_migrate': None,  # 会话迁移到新地址时调用 (旧地址, 新地址)，上层据此更新以地址为键的数据
+            'on_resume': None  # 客户端 resume() 的结果 (服务器地址, 是否成功)
         }
         
+        # 收件队列：启用后消息和连接事件不在网络线程中回调，而是放入队列，
+        # 由游戏循环每帧调用 poll() 在自己的线程中按到达顺序批量处理
+        self.use_inbox = inbox
+        self.inbox = deque()  # [(事件名, 参数)]，deque 的 append/popleft 是线程安全的
+        
         # 配置参数
-        self.retry_timeout = 0.1  # 100ms重试
+        self.retry_timeout = 0.1  # 初始重传超时100ms，测得RTT后按连接自适应
+        self.min_retry_timeout = 0.04  # 重传超时下限，需大于延迟确认时间
+        self.max_retry_timeout = 1.0   # 重传超时上限（含指数退避）
         self.max_retries = 10     # 增加重试次数到10次
         self.heartbeat_interval = 1.0  # 1秒心跳
+        # 连接上超过该时间（秒）没有发出任何数据包才发送心跳，有正常流量时对端靠流量判断存活
+        self.heartbeat_idle = 0.5
+        self.echo_interval = 0.1  # 每个连接最多每隔这么久捎带一次时间戳回显（6字节），足够跟踪RTT变化
+        self.ack_delay = 0.03  # 延迟确认：30ms内没有其他数据包可捎带确认时，单独发送确认包
+        
+        # 拥塞控制（单位：数据包）：未确认的可靠包数量不超过拥塞窗口，超出部分进入发送队列
+        self.initial_cwnd = 16
+        self.min_cwnd = 4
+        self.max_cwnd = 256  # 需小于接收窗口
+        self.max_send_queue = 512  # 每个优先级的发送队列上限，超过后 send_reliable 返回 SEND_BLOCKED
+        self.bulk_budget = 2400  # 每个连接每个 tick 最多发送的 bulk 字节数
+        self.bulk_interval = 0.05  # bulk 预算的补充周期（秒），与房间帧间隔一致
+        self.pacing_burst = 4  # 按节奏发送时允许连续发出的包数
+        
+        # 分片：超过 MTU 的消息拆成多个可靠包，每个分片独立确认和重传
+        self.max_message_size = 1 << 20  # 单条消息编码后的最大字节数
+        self.fragment_timeout = 10.0  # 不完整消息的重组超时（秒）
+        self.max_reassembly_bytes = 4 << 20  # 每个连接重组缓冲区的字节上限
         
         # 线程控制
         self.running = True
-        self.last_heartbeat_time = time.time()
+        # 连接状态由接收线程、处理线程和调用方线程共同访问
+        self.lock = threading.RLock()
+        
+        # 定时器队列：重传、心跳、连接超时都按截止时间调度（使用 self.clock）
+        self.timers = TimerQueue()
+        self.timer_condition = threading.Condition(self.lock)
+        self.connection_timers: Dict[tuple, TimerEntry] = {}  # {addr: 连接超时定时器}
+        self._schedule(self.heartbeat_interval, self._on_heartbeat_timer)
+        
+        # 启动网络IO。数据报收发是可替换的后端，子类覆盖以下方法即可换成其他实现
+        # （asyncio、多进程 worker 的管道、client/loopback_transport.py 的内存回环网络）：
+        #   _start_io() 创建收发资源并开始接收，收到的数据报交给 _receive_datagram(data, addr)
+        #   _sendto(data, addr) 发送一个数据报，flush 期间先放入 send_batch
+        #   _stop_io() 释放收发资源，get_socket_stats() 返回收发统计
+        # 不启动处理线程的后端需要自己按 timers 的截止时间调用 _run_due_timers
+        self._start_io()
+        
+        print(f"ReliableUDP {'Server' if is_server else 'Client'} started on {host}:{port}")
+    
+    def _start_io(self):
+        """创建UDP socket，启动接收线程和处理线程"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # 非阻塞 socket：接收线程用 select 等待可读，然后一次读空内核队列
+        self.socket.setblocking(False)
+        self._configure_socket()
+        # 接收缓冲环：每个槽都能容纳最大的UDP数据报，预先创建 memoryview，收包时只需切片
+        self.recv_ring = [memoryview(bytearray(65507)) for _ in range(self.recv_ring_size)]
+        if self.is_server:
+            self.socket.bind((self.host, self.port))
+        else:
+            # 客户端不需要绑定特定端口，系统会分配
+            pass
         
         # 启动处理线程
         self.receive_thread = threading.Thread(target=self._receive_loop)
@@ -60,8 +226,23 @@ class ReliableUDP:
         self.process_thread = threading.Thread(target=self._process_loop)
         self.process_thread.daemon = True
         self.process_thread.start()
-        
-        print(f"ReliableUDP {'Server' if is_server else 'Client'} started on {host}:{port}")
+    
+    def _configure_socket(self):
+        """设置收发缓冲区大小，并探测内核是否支持 UDP GSO"""
+        if self.recv_buffer_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer_size)
+        if self.send_buffer_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
+        if self.simulator is not None:
+            # 损伤模拟逐个数据报计算延迟和丢包，不使用 GSO 批量发送
+            self.gso_enabled = False
+            return
+        try:
+            # 段长度为 0 表示默认不切分，只用来确认内核支持该选项
+            self.socket.setsockopt(SOL_UDP, UDP_SEGMENT, 0)
+            self.gso_enabled = hasattr(self.socket, 'sendmsg')
+        except OSError:
+            self.gso_enabled = False
     
     def register_callback(self, event: str, callback: Callable):
         """注册事件回调"""
@@ -73,31 +254,82 @@ class ReliableUDP:
         if addr not in self.connection_states:
             self.connection_states[addr] = {
                 'sequence_number': 0,
-                'ack_history': {},  # {seq_num: (send_time, data, retry_count)}
-                'received_packets': set(),  # 已接收的包序列号
-                'expected_sequence': 0
+                'ack_history': {},  # {seq_num: {'send_time', 'data', 'retry_count', 'addr', 'timer'}}
+                'received_any': False,  # 是否收到过可靠数据包，之后发出的包才捎带确认
+                'received_bits': 0,  # 接收窗口位图，第 i 位表示 expected_sequence + i 已收到
+                'expected_sequence': 0,
+                'codec': CODEC_JSON,  # 与该连接通信使用的编码格式，协商成功后切换为 binary
+                'ack_pending': False,  # 是否有尚未发送给对端的确认信息
+                'ack_timer': None,  # 延迟确认定时器
+                'srtt': None,  # 平滑RTT（秒）
+                'echo': None,  # (对端发送时间戳, 收到时间) 等待在下一个发出的包中回显
+                'echo_seen': False,  # 对端是否回显过时间戳，之后用回显测量RTT
+                'echo_time': 0.0,  # 最后一次捎带回显的时间
+                'last_send': 0.0,  # 最后一次向该连接发出数据包的时间（self.clock）
+                'peer_timestamp': None,  # 对端最新的发送时间戳，用于判断迁移包是否比旧地址的包更新
+                'session': None,  # 会话令牌，服务器分配，客户端从服务器的包头中获得
+                'session_confirmed': False,  # 对端是否已携带令牌，确认前服务器在每个包中下发令牌
+                'cookie': None,  # 客户端从服务器获得的握手 cookie
+                'accepted': False,  # 客户端：服务器是否已接受握手（收到过 cookie 以外的包），此前持续发送握手心跳
+                'rttvar': None,  # RTT偏差（秒）
+                'rto': self.retry_timeout,  # 当前重传超时（秒）
+                'rto_backoff_until': 0.0,  # 在此之前（self.clock）到期的重传定时器不再退避重传超时
+                'outbound': [],  # 合并发送模式下等待 flush 的可靠消息 [(优先级, 通道, 消息, 过期票据)]
+                'supersede': {},  # {取代键: 过期票据} 每个键最近一条消息的票据
+                'channel_sequences': {},  # {通道: 下一个通道内序列号}
+                'channels': {},  # {通道: {'expected': 期望的通道内序列号, 'buffer': {通道内序列号: item}}} 有序通道的重排缓冲区
+                # 发送端前向纠错 {'channel', 'group_size', 'members': [(序列号, 通道内序列号, 负载, 过期票据)]}
+                'fec': None,
+                'fec_cache': {},  # 接收端：{序列号: 未压缩的负载} 最近收到的带 FLAG_FEC 的可靠包
+                'cwnd': float(self.initial_cwnd),  # 拥塞窗口（包）
+                'ssthresh': float(self.max_cwnd),  # 慢启动阈值（包）
+                'recovery_seq': None,  # 上次缩小窗口时已发出的最大序列号，此前发出的包丢失不再缩小窗口
+                # 按优先级分开的发送队列，等待拥塞窗口的可靠包 [(packet, 入队时间)]
+                'send_queues': {priority: deque() for priority in PRIORITIES},
+                'bulk_allowance': float(self.bulk_budget),  # 剩余的 bulk 字节预算，可以透支为负数
+                'bulk_time': self.clock(),  # 上次补充 bulk 预算的时间
+                'pacing_time': 0.0,  # 下一个包最早的发送时间
+                'pacing_timer': None,  # 发送节奏定时器
+                'queue_delay': 0.0,  # 最近一个包在发送队列中等待的时间（秒）
+                'fragment_id': 0,  # 下一条分片消息的ID
+                'reassembly': {},  # {消息ID: {'chunks', 'received', 'start_time'}} 未收齐的分片消息
+                'reassembly_bytes': 0,  # 重组缓冲区中已收到的字节数
+                'metrics': TransportMetrics()  # 该连接的传输统计
             }
+            if self.is_server:
+                self._issue_session(addr, self.connection_states[addr])
         return self.connection_states[addr]
     
+    def _issue_session(self, addr: tuple, state: dict):
+        """为新连接分配会话令牌"""
+        token = secrets.randbits(64)
+        while token == 0 or token in self.sessions:
+            token = secrets.randbits(64)
+        state['session'] = token
+        self.sessions[token] = addr
+    
     def _get_next_sequence(self, addr: tuple) -> int:
         """获取下一个序列号"""
         if self.is_server and addr:
             # 服务器为每个客户端维护独立的序列号
             state = self._get_connection_state(addr)
             seq = state['sequence_number']
-            state['sequence_number'] = (state['sequence_number'] + 1) % 65536
+            state['sequence_number'] = (state['sequence_number'] + 1) % SEQUENCE_MODULO
             return seq
         else:
             # 客户端或者没有指定地址时使用本地序列号
             seq = self.local_sequence_number
-            self.local_sequence_number = (self.local_sequence_number + 1) % 65536
+            self.local_sequence_number = (self.local_sequence_number + 1) % SEQUENCE_MODULO
             return seq
     
-    def _create_packet(self, data: dict, packet_type: PacketType, seq_num: int) -> dict:
-        """创建数据包"""
-        if seq_num is None:
-            seq_num = self._get_next_sequence()
-        
+    def _peek_next_sequence(self, addr: tuple) -> int:
+        """下一个将要分配的序列号（不分配）"""
+        if self.is_server and addr:
+            return self._get_connection_state(addr)['sequence_number']
+        return self.local_sequence_number
+    
+    def _create_packet(self, data: dict, packet_type: PacketType, seq_num: Optional[int]) -> dict:
+        """创建数据包，可靠包的 seq_num 为 None 时在离开发送队列时分配"""
         packet = {
             'type': packet_type.value,
             'seq': seq_num,
@@ -106,50 +338,999 @@ class ReliableUDP:
         }
         return packet
     
-    def send_reliable(self, data: dict, addr: tuple) -> int:
-        """发送可靠数据包"""
+    def _schedule(self, delay: float, callback: Callable, *args) -> TimerEntry:
+        """在 delay 秒后由处理线程调用 callback(*args)"""
+        with self.timer_condition:
+            entry = self.timers.schedule(self.clock() + delay, callback, *args)
+            # 新定时器比处理线程当前等待的更早到期时，唤醒处理线程重新计算等待时间
+            if self.timers.is_head(entry):
+                self.timer_condition.notify()
+            return entry
+    
+    def set_channel(self, msg_type: str, channel: int):
+        """登记消息类型使用的通道：0-254 为相互独立的有序通道，CHANNEL_UNORDERED 为可靠无序"""
+        if not 0 <= channel <= CHANNEL_UNORDERED:
+            raise ValueError(f"无效的通道: {channel}")
+        self.message_channels[msg_type] = channel
+    
+    def set_fec(self, addr: tuple, group_size: int, channel: int = CHANNEL_DEFAULT):
+        """
+        为连接的一个通道启用前向纠错：该通道每发出 group_size 个可靠包追加一个异或修复包，
+        对端丢失组内任意一个包时不等重传即可还原。group_size 为 0 时关闭，只对二进制格式的对端生效
+        """
+        if not 0 <= group_size <= REPAIR_MAX_MEMBERS:
+            raise ValueError(f"无效的修复组大小: {group_size}")
+        with self.lock:
+            state = self._get_connection_state(addr)
+            state['fec'] = {'channel': channel, 'group_size': group_size, 'members': []} if group_size else None
+    
+    def send_reliable(self, data: dict, addr: tuple, priority: str = PRIORITY_CONTROL,
+                      channel: Optional[int] = None, ttl: Optional[float] = None,
+                      supersede: Optional[Hashable] = None) -> int:
+        """
+        发送可靠数据包，合并发送模式下返回 SEND_QUEUED，priority 为 PRIORITIES 之一，
+        channel 为 None 时按消息类型选择通道（见 set_channel）
+        ttl（秒）过后，或之后又发送了同一 supersede 键的消息时，这条消息不再发送和重传：
+        还在发送队列中的直接丢弃，已发出未确认的在重传时从包中去掉（只剩空包时对端只推进序列号）。
+        旧格式对端不支持，消息照常可靠送达
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的发送优先级: {priority}")
+        if channel is None:
+            channel = self.message_channels.get(data.get('type'), CHANNEL_DEFAULT)
+        elif not 0 <= channel <= CHANNEL_UNORDERED:
+            raise ValueError(f"无效的通道: {channel}")
         # 检查连接是否仍然有效
         if not self.is_server and addr not in self.connections:
             print(f"无法发送消息到 {addr}，连接已断开")
             return -1
+        
+        with self.lock:
+            state = self._get_connection_state(addr)
+            # 背压：发送队列积压过多时拒绝新消息
+            if len(state['send_queues'][priority]) >= self.max_send_queue:
+                self._count(state, 'send_blocked')
+                return SEND_BLOCKED
+            self._count(state, 'messages_sent')
+            ticket = self._issue_ticket(state, ttl, supersede) if ttl is not None or supersede is not None else None
+            if self.coalesce:
+                state['outbound'].append((priority, channel, data, ticket))
+                return SEND_QUEUED
             
-        seq_num = self._get_next_sequence(addr)
-        packet = self._create_packet(data, PacketType.RELIABLE, seq_num)
+            packet = self._create_packet(data, PacketType.RELIABLE, None)
+            if state['codec'] == CODEC_BINARY:
+                # 预先编码，超过 MTU 的消息分片发送
+                payload = encode_message(data)
+                if len(payload) > self.mtu - MAX_HEADER_SIZE:
+                    sent = self._send_fragments(addr, state, payload, priority, channel, ticket)
+                    return SEND_QUEUED if sent else -1
+                packet['payload'] = payload
+                if ticket is not None:
+                    packet['tickets'], packet['parts'] = [ticket], [payload]
+            self._queue_reliable_packet(packet, addr, state, priority, channel)
+            # 拥塞窗口已满时包留在发送队列中，序列号在实际发送时分配
+            return packet['seq'] if packet['seq'] is not None else SEND_QUEUED
+    
+    def _issue_ticket(self, state: dict, ttl: Optional[float], supersede: Optional[Hashable]) -> dict:
+        """
+        为可以过期的可靠消息创建票据，同一 supersede 键之前的消息随即作废，调用方持有 self.lock
+        票据只在二进制格式的包中携带（不参与编码），包中记录每条消息的票据和已编码的负载
+        """
+        ticket = {'key': supersede, 'deadline': self.clock() + ttl if ttl is not None else None,
+                  'obsolete': False}
+        if supersede is not None:
+            previous = state['supersede'].get(supersede)
+            if previous is not None:
+                previous['obsolete'] = True
+            state['supersede'][supersede] = ticket
+        return ticket
+    
+    @staticmethod
+    def _is_obsolete(ticket: Optional[dict], now: float) -> bool:
+        """票据对应的消息是否已被取代或超过有效期，没有票据的消息永不过期"""
+        return ticket is not None and (
+            ticket['obsolete'] or ticket['deadline'] is not None and now >= ticket['deadline'])
+    
+    def _trim_packet(self, state: dict, packet: dict) -> bool:
+        """
+        从可靠包中去掉已过期的消息并重新生成负载，序列号和通道不变，返回包中是否还有有效的消息；
+        全部过期时负载为空的合并包，对端收到后只推进序列号，调用方持有 self.lock
+        """
+        tickets = packet.get('tickets')
+        if tickets is None:
+            return True
+        now = self.clock()
+        live = [index for index, ticket in enumerate(tickets) if not self._is_obsolete(ticket, now)]
+        if len(live) == len(tickets):
+            return True
         
-        # 添加到确认历史
-        state = self._get_connection_state(addr)
+        self._count(state, 'expired', len(tickets) - len(live))
+        # 负载变了，与修复包中的不一致，重传的包不再让对端缓存
+        packet.pop('fec', None)
+        packet['tickets'] = [tickets[index] for index in live]
+        packet['parts'] = [packet['parts'][index] for index in live]
+        packet['payload'] = packet['parts'][0] if len(live) == 1 else encode_bundle(packet['parts'])
+        if not live:
+            packet['kind'] = 'expired'
+        return bool(live)
+    
+    def _queue_reliable_packet(self, packet: dict, addr: tuple, state: dict, priority: str, channel: int):
+        """可靠包进入对应优先级的发送队列，并在拥塞窗口和发送节奏允许时立即发送，调用方持有 self.lock"""
+        now = self.clock()
+        packet['channel'] = channel
+        state['send_queues'][priority].append((packet, now))
+        if priority != PRIORITY_BULK and state['pacing_timer'] is not None and state['pacing_time'] <= now:
+            # 节奏允许发送时定时器只是在等待 bulk 预算，不能让更高优先级的包跟着等待
+            state['pacing_timer'].cancel()
+            state['pacing_timer'] = None
+        self._pump_send_queue(addr, state)
+    
+    def _queued_packets(self, state: dict) -> int:
+        """各优先级发送队列中的包数之和"""
+        return sum(len(queue) for queue in state['send_queues'].values())
+    
+    def _refill_bulk(self, state: dict, now: float):
+        """按经过的时间补充 bulk 字节预算，最多积累一个 tick 的预算"""
+        elapsed = now - state['bulk_time']
+        state['bulk_time'] = now
+        state['bulk_allowance'] = min(float(self.bulk_budget),
+                                      state['bulk_allowance'] + elapsed * self.bulk_budget / self.bulk_interval)
+    
+    def _next_priority(self, state: dict) -> Optional[str]:
+        """下一个可以发送的优先级：realtime、control 依次优先，bulk 需要有剩余预算"""
+        queues = state['send_queues']
+        if queues[PRIORITY_REALTIME]:
+            return PRIORITY_REALTIME
+        if queues[PRIORITY_CONTROL]:
+            return PRIORITY_CONTROL
+        if queues[PRIORITY_BULK] and state['bulk_allowance'] > 0:
+            return PRIORITY_BULK
+        return None
+    
+    def _pump_send_queue(self, addr: tuple, state: dict):
+        """在拥塞窗口内按优先级和节奏发送队列中的包，节奏或 bulk 预算不允许时登记定时器稍后继续"""
+        queues = state['send_queues']
+        if state['pacing_timer'] is not None or not (
+                queues[PRIORITY_REALTIME] or queues[PRIORITY_CONTROL] or queues[PRIORITY_BULK]):
+            return
+        
+        now = self.clock()
+        # 把一个RTT内的窗口均匀分布发送，未测得RTT时不限制节奏
+        interval = state['srtt'] / state['cwnd'] if state['srtt'] else 0.0
+        # 空闲之后最多允许连续发出 pacing_burst 个包
+        state['pacing_time'] = max(state['pacing_time'], now - interval * self.pacing_burst)
+        self._refill_bulk(state, now)
+        
+        while len(state['ack_history']) < int(state['cwnd']):
+            priority = self._next_priority(state)
+            if priority is None:
+                if queues[PRIORITY_BULK]:
+                    # 只剩 bulk 且预算用完，等预算恢复为正数后继续
+                    delay = -state['bulk_allowance'] * self.bulk_interval / self.bulk_budget + 0.001
+                    state['pacing_timer'] = self._schedule(delay, self._on_pacing_timer, addr)
+                return
+            if state['pacing_time'] > now:
+                state['pacing_timer'] = self._schedule(state['pacing_time'] - now, self._on_pacing_timer, addr)
+                return
+            packet, queued_at = queues[priority].popleft()
+            if not self._trim_packet(state, packet):
+                # 还没分配序列号，整个包直接丢弃
+                continue
+            state['queue_delay'] = now - queued_at
+            self._observe(state, 'queue_delay_ms', state['queue_delay'] * 1000)
+            self._observe(state, QUEUE_DELAY_HISTOGRAMS[priority], state['queue_delay'] * 1000)
+            state['pacing_time'] += interval
+            packet['seq'] = self._get_next_sequence(addr)
+            # 通道内序列号与序列号同时分配，同一通道的包按发出顺序交付
+            channel = packet['channel']
+            if channel == CHANNEL_UNORDERED:
+                packet['cseq'] = 0
+            else:
+                packet['cseq'] = state['channel_sequences'].get(channel, 0)
+                state['channel_sequences'][channel] = (packet['cseq'] + 1) % SEQUENCE_MODULO
+            fec_payload = self._fec_payload(state, packet) if state['fec'] is not None else None
+            if fec_payload is not None:
+                # 从第一个包开始标记，接收端据此缓存负载，第一个修复组也能还原
+                packet['fec'] = True
+            sent = self._send_reliable_packet(packet, addr, state)
+            if fec_payload is not None:
+                self._add_fec_member(addr, state, packet, fec_payload)
+            if priority == PRIORITY_BULK:
+                state['bulk_allowance'] -= sent
+    
+    def _fec_payload(self, state: dict, packet: dict) -> Optional[bytes]:
+        """可以加入修复组的可靠包返回其未压缩的负载，其他通道、旧格式对端和较大的包返回 None"""
+        fec = state['fec']
+        if packet['channel'] != fec['channel'] or state['codec'] != CODEC_BINARY:
+            return None
+        payload = packet.get('payload')
+        if payload is None:
+            payload = encode_message(packet['data'])
+        if len(payload) + repair_overhead(fec['group_size']) > self.mtu - MAX_HEADER_SIZE:
+            # 修复包不能超过 MTU，较大的包只靠重传
+            return None
+        return payload
+    
+    def _add_fec_member(self, addr: tuple, state: dict, packet: dict, payload: bytes):
+        """把首次发出的可靠包加入当前修复组，组满时发出修复包，调用方持有 self.lock"""
+        fec = state['fec']
+        fec['members'].append((packet['seq'], packet['cseq'], payload, packet.get('tickets')))
+        if len(fec['members']) < fec['group_size']:
+            return
+        
+        # 已过期或被取代的消息不再放进修复包，否则对端可以用修复包还原出发送端已经放弃的消息
+        now = self.clock()
+        members = [(seq_num, cseq, payload) for seq_num, cseq, payload, tickets in fec['members']
+                   if not any(self._is_obsolete(ticket, now) for ticket in tickets or ())]
+        fec['members'] = []
+        if not members:
+            return
+        repair = {
+            'type': PacketType.REPAIR.value,
+            'seq': 0,
+            'payload': encode_repair(fec['channel'], members),
+            'kind': 'repair',  # 统计用的种类，不参与编码
+            'timestamp': time.time()
+        }
+        self._count(state, 'fec_repairs')
+        self._send_packet(repair, addr)
+    
+    def _on_pacing_timer(self, addr: tuple):
+        """发送节奏定时器到期，继续发送队列中的包"""
+        state = self.connection_states.get(addr)
+        if state is None:
+            return
+        state['pacing_timer'] = None
+        self._pump_send_queue(addr, state)
+    
+    def _send_reliable_packet(self, packet: dict, addr: tuple, state: dict) -> int:
+        """登记确认历史和重传定时器后发送可靠数据包，返回发出的字节数，调用方持有 self.lock"""
+        seq_num = packet['seq']
         # print(f"send reliable packet: {packet}, addr: {addr}, state: {state}")
         state['ack_history'][seq_num] = {
-            'send_time': time.time(),
+            'send_time': self.clock(),
             'data': packet,
             'retry_count': 0,
-            'addr': addr
+            'addr': addr,
+            'timer': self._schedule(state['rto'], self._on_retry_timer, addr, seq_num)
         }
 
-        # print(f"发送可靠数据包: {packet}, 地址: {addr}, state: {state}")
+        self._count(state, 'reliable_sent')
         
         # 发送数据包
-        self._send_packet(packet, addr)
-        return seq_num
+        return self._send_packet(packet, addr)
+    
+    def flush(self):
+        """把各连接发送队列中的可靠消息打包发送，每个数据包使用一个序列号"""
+        with self.lock:
+            # 本次 flush 产生的数据报先收集起来，最后批量提交给内核
+            self.send_batch = []
+            try:
+                # 同一条消息广播给多个连接时只编码一次
+                encoded_cache = {}
+                for addr, state in list(self.connection_states.items()):
+                    if state['outbound']:
+                        messages = state['outbound']
+                        state['outbound'] = []
+                        self._flush_connection(addr, state, messages, encoded_cache)
+            finally:
+                batch, self.send_batch = self.send_batch, None
+                if batch:
+                    self._send_datagrams(batch)
+    
+    def _flush_connection(self, addr: tuple, state: dict, messages: list, encoded_cache: dict):
+        """打包发送单个连接的消息，不同优先级或不同通道的消息分别打包，调用方持有 self.lock"""
+        if state['codec'] != CODEC_BINARY:
+            # 旧版本对端不支持合并包，逐条发送
+            for priority, channel, data, ticket in messages:
+                packet = self._create_packet(data, PacketType.RELIABLE, None)
+                self._queue_reliable_packet(packet, addr, state, priority, channel)
+            return
+        
+        now = self.clock()
+        groups = {}  # {(优先级, 通道): [(消息, 过期票据)]}
+        for priority, channel, data, ticket in messages:
+            if self._is_obsolete(ticket, now):
+                self._count(state, 'expired')
+                continue
+            groups.setdefault((priority, channel), []).append((data, ticket))
+        for priority, channel in sorted(groups, key=lambda key: PRIORITIES.index(key[0])):
+            self._flush_messages(addr, state, groups[(priority, channel)], priority, channel, encoded_cache)
+    
+    def _flush_messages(self, addr: tuple, state: dict, messages: list, priority: str, channel: int,
+                        encoded_cache: dict):
+        """把同一优先级、同一通道的消息按 MTU 打包成合并包"""
+        budget = self.mtu - MAX_HEADER_SIZE - BUNDLE_OVERHEAD
+        bundle, tickets, size = [], [], 0
+        for data, ticket in messages:
+            payload = encoded_cache.get(id(data))
+            if payload is None:
+                payload = encode_message(data)
+                encoded_cache[id(data)] = payload
+            
+            item_size = len(payload) + BUNDLE_ITEM_OVERHEAD
+            if bundle and (size + item_size > budget or len(bundle) >= BUNDLE_MAX_MESSAGES):
+                self._send_bundle(addr, state, bundle, tickets, kind, priority, channel)
+                bundle, tickets, size = [], [], 0
+            if len(payload) > self.mtu - MAX_HEADER_SIZE:
+                # 单条消息超过 MTU，分片发送，保持与前后消息的顺序
+                self._send_fragments(addr, state, payload, priority, channel, ticket)
+                continue
+            if not bundle:
+                kind = str(data.get('type', 'unknown'))
+            bundle.append(payload)
+            tickets.append(ticket)
+            size += item_size
+        
+        if bundle:
+            self._send_bundle(addr, state, bundle, tickets, kind, priority, channel)
     
-    def send_unreliable(self, data: dict, addr: tuple):
-        """发送不可靠数据包"""
+    def _send_bundle(self, addr: tuple, state: dict, payloads: list, tickets: list, kind: str, priority: str,
+                     channel: int):
+        """以一个序列号发送一组已编码的消息"""
+        packet = {
+            'type': PacketType.RELIABLE.value,
+            'seq': None,  # 发送时分配
+            # 只有一条消息时不需要合并包头
+            'payload': payloads[0] if len(payloads) == 1 else encode_bundle(payloads),
+            'kind': kind if len(payloads) == 1 else 'bundle',  # 统计用的种类，不参与编码
+            'timestamp': time.time()
+        }
+        if any(ticket is not None for ticket in tickets):
+            packet['tickets'], packet['parts'] = tickets, payloads
+        self._queue_reliable_packet(packet, addr, state, priority, channel)
+    
+    def _send_fragments(self, addr: tuple, state: dict, payload: bytes, priority: str, channel: int,
+                        ticket: Optional[dict] = None) -> bool:
+        """把一条已编码的消息拆成连续序列号的可靠包发送，返回是否已发送"""
+        if len(payload) > self.max_message_size:
+            print(f"消息过大 ({len(payload)} 字节)，超过上限 {self.max_message_size}，地址: {addr}")
+            return False
+        
+        message_id = state['fragment_id']
+        state['fragment_id'] = (message_id + 1) % 65536
+        chunk_size = self.mtu - MAX_HEADER_SIZE - FRAGMENT_OVERHEAD
+        fragments = encode_fragments(message_id, payload, chunk_size)
+        self._count(state, 'fragments_sent', len(fragments))
+        for fragment in fragments:
+            packet = {
+                'type': PacketType.RELIABLE.value,
+                'seq': None,
+                'payload': fragment,
+                'kind': 'fragment',
+                'timestamp': time.time()
+            }
+            if ticket is not None:
+                # 过期后去掉的分片使对端无法重组，不完整的消息在重组超时后丢弃
+                packet['tickets'], packet['parts'] = [ticket], [fragment]
+            self._queue_reliable_packet(packet, addr, state, priority, channel)
+        return True
+    
+    def _reassemble(self, addr: tuple, state: dict, message_id: int, index: int, count: int,
+                    chunk: bytes) -> Optional[dict]:
+        """收下一个分片，消息收齐时返回解码后的消息"""
+        reassembly = state['reassembly']
+        now = self.clock()
+        # 丢弃超时的不完整消息
+        for expired_id in [mid for mid, entry in reassembly.items()
+                           if now - entry['start_time'] > self.fragment_timeout]:
+            print(f"分片消息 {expired_id} 重组超时，地址: {addr}")
+            self._drop_reassembly(state, expired_id)
+            self._count(state, 'reassembly_dropped')
+        
+        entry = reassembly.get(message_id)
+        if entry is None:
+            entry = reassembly[message_id] = {'chunks': [None] * count, 'received': 0, 'start_time': now}
+        if index >= len(entry['chunks']) or entry['chunks'][index] is not None:
+            return None
+        
+        if state['reassembly_bytes'] + len(chunk) > self.max_reassembly_bytes:
+            # 超过内存上限，放弃整条消息
+            print(f"分片重组缓冲区超过上限，丢弃消息 {message_id}，地址: {addr}")
+            self._drop_reassembly(state, message_id)
+            self._count(state, 'reassembly_dropped')
+            return None
+        
+        entry['chunks'][index] = chunk
+        entry['received'] += 1
+        state['reassembly_bytes'] += len(chunk)
+        if entry['received'] < len(entry['chunks']):
+            return None
+        
+        payload = b''.join(entry['chunks'])
+        self._drop_reassembly(state, message_id)
+        return decode_message(payload)
+    
+    def _drop_reassembly(self, state: dict, message_id: int):
+        """移除一条分片消息的重组缓冲"""
+        entry = state['reassembly'].pop(message_id, None)
+        if entry is not None:
+            state['reassembly_bytes'] -= sum(len(chunk) for chunk in entry['chunks'] if chunk is not None)
+    
+    def send_unreliable(self, data: dict, addr: tuple, priority: str = PRIORITY_CONTROL):
+        """发送不可靠数据包，立即发出；bulk 消息同样消耗字节预算，预算用完时直接丢弃"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的发送优先级: {priority}")
         packet = self._create_packet(data, PacketType.UNRELIABLE, 0)
-        self._send_packet(packet, addr)
+        with self.lock:
+            state = self.connection_states.get(addr)
+            if priority == PRIORITY_BULK and state is not None:
+                self._refill_bulk(state, self.clock())
+                if state['bulk_allowance'] <= 0:
+                    self._count(state, 'bulk_dropped')
+                    return
+            self._count(state, 'messages_sent')
+            sent = self._send_packet(packet, addr)
+            if priority == PRIORITY_BULK and state is not None:
+                state['bulk_allowance'] -= sent
+    
+    def get_codec(self, addr: tuple) -> str:
+        """获取与指定地址通信使用的编码格式"""
+        state = self.connection_states.get(addr)
+        return state['codec'] if state else CODEC_JSON
     
-    def _send_packet(self, packet: dict, addr: tuple):
-        """发送数据包"""
+    def _count(self, state: Optional[dict], name: str, amount: int = 1):
+        """累加 socket 和连接（state 不为 None 时）的计数器，调用方持有 self.lock"""
+        self.metrics.counters[name] += amount
+        if state is not None:
+            state['metrics'].counters[name] += amount
+    
+    def _observe(self, state: dict, name: str, value: float):
+        """向 socket 和连接的直方图记录一个值，调用方持有 self.lock"""
+        self.metrics.histograms[name].observe(value)
+        state['metrics'].histograms[name].observe(value)
+    
+    def _record_sent(self, addr: tuple, kind: str, nbytes: int):
+        """记录发出的数据报和连接的最后发送时间"""
+        with self.lock:
+            self.metrics.on_sent(kind, nbytes)
+            state = self.connection_states.get(addr)
+            if state is not None:
+                state['metrics'].on_sent(kind, nbytes)
+                state['last_send'] = self.clock()
+    
+    def _send_packet(self, packet: dict, addr: tuple) -> int:
+        """发送数据包，返回编码后的字节数（出错时为 0）"""
         try:
-            # 压缩数据
+            # 按对端协商的格式编码，二进制格式在包头捎带确认信息
             # print(f"发送数据包: {packet}, addr: {addr}")
-            json_str = json.dumps(packet)
-            compressed_data = zlib.compress(json_str.encode('utf-8'))
-            self.socket.sendto(compressed_data, addr)
+            codec = self.get_codec(addr)
+            ack, echo, session = None, None, None
+            if codec == CODEC_BINARY:
+                ack, echo, session = self._build_ack(addr), self._build_echo(addr), self._session_for(addr)
+            data = encode(packet, codec, ack, self.compression, echo, session, self._timestamp_ms())
+            self._transmit(data, addr)
+            self._record_sent(addr, _packet_kind(packet), len(data))
+            return len(data)
         except Exception as e:
             print(f"发送数据包 {packet} 错误: {e}, addr: {addr}")
+            return 0
+    
+    def _transmit(self, data: bytes, addr: tuple):
+        """发送编码后的数据报，启用损伤模拟时按模拟结果丢弃、延迟或复制"""
+        if self.simulator is None:
+            self._sendto(data, addr)
+            return
+        for delay in self.simulator.outbound.submit(len(data), self.clock()):
+            if delay > 0:
+                self._schedule(delay, self._sendto, data, addr)
+            else:
+                self._sendto(data, addr)
+    
+    def _sendto(self, data: bytes, addr: tuple):
+        """把编码后的数据报交给socket发送，flush 期间先放入批量发送列表"""
+        if self.send_batch is not None:
+            self.send_batch.append((data, addr))
+            return
+        self.socket.sendto(data, addr)
+        self.io_stats['send_datagrams'] += 1
+        self.io_stats['send_calls'] += 1
+    
+    def _send_datagrams(self, datagrams: list):
+        """批量发送数据报，发往同一地址的连续等长数据报用一次 GSO sendmsg 提交"""
+        by_addr = {}
+        for data, addr in datagrams:
+            by_addr.setdefault(addr, []).append(data)
+        
+        for addr, items in by_addr.items():
+            index = 0
+            while index < len(items):
+                count = self._gso_run_length(items, index) if self.gso_enabled else 1
+                try:
+                    if count > 1:
+                        self._sendmsg_gso(items[index:index + count], addr)
+                    else:
+                        self._sendto(items[index], addr)
+                except OSError as e:
+                    if count > 1:
+                        # 网卡或内核不支持时退回逐个发送
+                        print(f"UDP GSO 发送失败，改为逐个发送: {e}")
+                        self.gso_enabled = False
+                        continue
+                    print(f"发送数据报错误: {e}, addr: {addr}")
+                index += count
+    
+    def _gso_run_length(self, items: list, start: int) -> int:
+        """从 start 开始可以合并成一次 GSO 发送的数据报数量：等长数据报后最多跟一个更短的"""
+        segment = len(items[start])
+        end, total = start + 1, segment
+        while (end < len(items) and end - start < GSO_MAX_SEGMENTS
+               and len(items[end]) == segment and total + segment <= GSO_MAX_BYTES):
+            total += segment
+            end += 1
+        if (end < len(items) and end - start < GSO_MAX_SEGMENTS
+                and len(items[end]) < segment and total + len(items[end]) <= GSO_MAX_BYTES):
+            end += 1
+        return end - start
+    
+    def _sendmsg_gso(self, items: list, addr: tuple):
+        """一次系统调用发送多个数据报，内核按第一个数据报的长度切分"""
+        segment = struct.pack('=H', len(items[0]))
+        self.socket.sendmsg([b''.join(items)], [(SOL_UDP, UDP_SEGMENT, segment)], 0, addr)
+        self.io_stats['send_datagrams'] += len(items)
+        self.io_stats['send_calls'] += 1
+    
+    def get_socket_stats(self) -> dict:
+        """socket 缓冲区大小、收发批量统计和内核接收队列/丢包计数（内核计数仅 Linux 可用）"""
+        stats = dict(self.io_stats)
+        stats['gso'] = self.gso_enabled
+        try:
+            stats['recv_buffer_size'] = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            stats['send_buffer_size'] = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+            stats.update(self._read_kernel_udp_stats(os.fstat(self.socket.fileno()).st_ino))
+        except OSError:
+            pass
+        return stats
+    
+    @staticmethod
+    def _read_kernel_udp_stats(inode: int) -> dict:
+        """从 /proc/net/udp 读取该 socket 的收发队列字节数和内核丢包数"""
+        for path in ('/proc/net/udp', '/proc/net/udp6'):
+            try:
+                with open(path) as f:
+                    lines = f.readlines()[1:]
+            except OSError:
+                continue
+            for line in lines:
+                fields = line.split()
+                if len(fields) >= 13 and fields[9] == str(inode):
+                    tx_queue, rx_queue = fields[4].split(':')
+                    return {
+                        'tx_queue': int(tx_queue, 16),
+                        'rx_queue': int(rx_queue, 16),
+                        'drops': int(fields[12])
+                    }
+        return {}
+    
+    def _build_ack(self, addr: tuple) -> Optional[tuple]:
+        """生成捎带的 (累计确认号, 选择确认位图)，并清除待发送的延迟确认"""
+        with self.lock:
+            state = self.connection_states.get(addr)
+            if state is None or not state['received_any']:
+                return None
+            
+            state['ack_pending'] = False
+            if state['ack_timer'] is not None:
+                state['ack_timer'].cancel()
+                state['ack_timer'] = None
+            
+            # 接收窗口位图第 0 位是 expected_sequence（必然未收到），之后的位即选择确认位图
+            expected = state['expected_sequence']
+            ack_bits = (state['received_bits'] >> 1) & ((1 << SACK_BITS) - 1)
+            return (expected - 1) % SEQUENCE_MODULO, ack_bits
+    
+    def _build_echo(self, addr: tuple) -> Optional[tuple]:
+        """生成捎带的时间戳回显 (对端时间戳, 停留毫秒数)，每个收到的时间戳只回显一次，并限制回显频率"""
+        with self.lock:
+            state = self.connection_states.get(addr)
+            if state is None or state['echo'] is None:
+                return None
+            now = self.clock()
+            if now - state['echo_time'] < self.echo_interval:
+                return None
+            timestamp_ms, received_at = state['echo']
+            state['echo'] = None
+            state['echo_time'] = now
+            return timestamp_ms, int((now - received_at) * 1000)
+    
+    def _session_for(self, addr: tuple) -> Optional[int]:
+        """包头中携带的会话令牌：客户端总是携带，服务器在客户端确认前下发"""
+        state = self.connection_states.get(addr)
+        if state is None or state['session'] is None:
+            return None
+        if self.is_server and state['session_confirmed']:
+            return None
+        return state['session']
+    
+    def _check_session(self, packet: dict, addr: tuple) -> bool:
+        """
+        处理包头中的会话令牌，返回是否继续处理该包，调用方持有 self.lock
+        服务器：令牌属于其他地址时把连接迁移过来；未知令牌说明会话已过期，丢弃并通知客户端
+        客户端：记录服务器分配的令牌
+        """
+        token = packet['session']
+        if not self.is_server:
+            state = self._get_connection_state(addr)
+            if state['session'] != token:
+                state['session'] = token
+            return True
+        
+        owner = self.sessions.get(token)
+        if owner is None:
+            # 不处理过期会话的包：其中的序列号属于旧连接，会破坏新连接的状态。
+            # 令牌可以伪造，答复与 cookie 共用全局速率限制，不为该地址创建连接状态，
+            # 使用一个字节的类型化负载，答复不大于请求，不会被用来放大流量
+            self.metrics.counters['handshake_dropped'] += 1
+            self._send_handshake_reply({'type': 'session_expired'}, CODEC_BINARY, addr, packet['size'])
+            return False
+        if owner != addr:
+            old_state = self.connection_states[owner]
+            latest = old_state['peer_timestamp']
+            # 只有比旧地址上收到的包更新的包才能触发迁移，迟到的旧包直接丢弃
+            if latest is not None and (packet['timestamp_ms'] - latest) & 0xFFFFFFFF >= 0x80000000:
+                return False
+            self._migrate_connection(owner, addr)
+        self.connection_states[addr]['session_confirmed'] = True
+        return True
+    
+    def _make_cookie(self, addr: tuple, period: int) -> int:
+        """按密钥、地址和时间段计算 64 位 cookie"""
+        digest = hashlib.blake2b(f"{addr[0]}:{addr[1]}:{period}".encode(), key=self.cookie_secret,
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+    
+    def _check_cookie(self, packet: dict, packet_type: PacketType, codec: str, addr: tuple) -> bool:
+        """
+        服务器收到未知地址的数据包，返回是否为其创建连接状态，调用方持有 self.lock
+        回显了有效 cookie 的心跳通过；其他心跳答复一个 cookie（不超过全局速率），其余包直接丢弃。
+        答复使用与心跳相同的编码格式，大小与握手心跳相当，不会被用来放大流量
+        """
+        if not self.require_cookie:
+            return True
+        # 握手心跳的负载小于压缩阈值，压缩过的包和超过 HANDSHAKE_MAX_SIZE 的包不解码负载
+        if packet_type != PacketType.HEARTBEAT or packet.get('compressed') or packet['size'] > HANDSHAKE_MAX_SIZE:
+            self.metrics.counters['handshake_dropped'] += 1
+            return False
+        self._decode_payload(packet)
+        data = packet.get('data')
+        cookie = data.get('cookie') if isinstance(data, dict) else None
+        period = int(self.clock() // self.cookie_lifetime)
+        if isinstance(cookie, int) and 0 <= cookie < 1 << 64:
+            echoed = cookie.to_bytes(8, 'big')
+            for valid in (period, period - 1):
+                if hmac.compare_digest(echoed, self._make_cookie(addr, valid).to_bytes(8, 'big')):
+                    return True
+        
+        self.metrics.counters['handshake_dropped'] += 1
+        if self._send_handshake_reply({'type': 'cookie', 'cookie': self._make_cookie(addr, period)}, codec, addr):
+            self.metrics.counters['handshake_cookies'] += 1
+        return False
+    
+    def _send_handshake_reply(self, data: dict, codec: str, addr: tuple, max_size: Optional[int] = None) -> bool:
+        """
+        向未知地址发送握手答复（cookie、session_expired），不创建连接状态，调用方持有 self.lock
+        所有答复共用一个全局令牌桶（cookie_rate），max_size 为答复的大小上限（通常是请求的大小）。
+        返回是否已发送
+        """
+        now = self.clock()
+        self.cookie_allowance = min(float(self.cookie_rate),
+                                    self.cookie_allowance + (now - self.cookie_time) * self.cookie_rate)
+        self.cookie_time = now
+        if self.cookie_allowance < 1:
+            return False
+        reply = self._create_packet(data, PacketType.UNRELIABLE, 0)
+        try:
+            datagram = encode(reply, codec, compress=self.compression, timestamp_ms=self._timestamp_ms())
+            if max_size is not None and len(datagram) > max_size:
+                return False
+            self.cookie_allowance -= 1
+            self._transmit(datagram, addr)
+            self.metrics.on_sent(data['type'], len(datagram))
+        except Exception as e:
+            print(f"发送握手答复错误: {e}, addr: {addr}")
+            return False
+        return True
+    
+    def _migrate_connection(self, old_addr: tuple, new_addr: tuple):
+        """
+        把连接状态从旧地址迁移到新地址，序列号、接收窗口和未确认的包都保持不变，
+        未确认的包立即发往新地址，不等待重传超时，调用方持有 self.lock
+        """
+        print(f"会话迁移: {old_addr} -> {new_addr}")
+        if new_addr in self.connection_states:
+            self._discard_connection(new_addr)
+        state = self.connection_states.pop(old_addr)
+        self.connection_states[new_addr] = state
+        self.sessions[state['session']] = new_addr
+        self.receive_buffer[new_addr] = self.receive_buffer.pop(old_addr, {})
+        self.connections.pop(old_addr, None)
+        timer = self.connection_timers.pop(old_addr, None)
+        if timer is not None:
+            timer.cancel()
+        self._touch_connection(new_addr)
+        self._count(state, 'migrations')
+        
+        # 定时器参数中带有地址，全部按新地址重新登记
+        if state['ack_timer'] is not None:
+            state['ack_timer'].cancel()
+            state['ack_timer'] = None
+            if state['ack_pending']:
+                self._schedule_ack(new_addr, state)
+        if state['pacing_timer'] is not None:
+            state['pacing_timer'].cancel()
+            state['pacing_timer'] = None
+        self._resend_unacked(new_addr, state)
+        self._pump_send_queue(new_addr, state)
+        
+        self._emit('on_migrate', old_addr, new_addr)
+    
+    def _resend_unacked(self, addr: tuple, state: dict):
+        """立即重发所有未确认的包（地址变化或恢复连接后，之前发出的包很可能已经丢失）"""
+        for seq_num, info in state['ack_history'].items():
+            info['timer'].cancel()
+            info['addr'] = addr
+            info['retry_count'] += 1  # Karn 算法：重发过的包不参与RTT采样
+            info['send_time'] = self.clock()
+            info['timer'] = self._schedule(state['rto'], self._on_retry_timer, addr, seq_num)
+            self._count(state, 'retransmits')
+            self._trim_packet(state, info['data'])
+            self._send_packet(info['data'], addr)
+    
+    def export_connection(self, addr: tuple) -> Optional[dict]:
+        """
+        导出连接状态并从本端移除，用于把连接交给另一个进程继续处理（见 frame_sync_cluster.py）。
+        返回可以 pickle 的快照：定时器不导出，由 import_connection 重新登记，连接不存在时返回 None
+        """
+        with self.lock:
+            state = self.connection_states.get(addr)
+            if state is None:
+                return None
+            snapshot = {key: value for key, value in state.items() if key not in ('ack_timer', 'pacing_timer')}
+            snapshot['ack_history'] = {seq_num: {key: value for key, value in info.items() if key != 'timer'}
+                                       for seq_num, info in state['ack_history'].items()}
+            snapshot['send_queues'] = {priority: list(queue) for priority, queue in state['send_queues'].items()}
+            snapshot['receive_buffer'] = self.receive_buffer.get(addr, {})
+            self._discard_connection(addr)
+            return snapshot
+    
+    def import_connection(self, addr: tuple, snapshot: dict):
+        """导入 export_connection 导出的连接状态，未确认的包按当前重传超时重新计时，不立即重发"""
+        with self.lock:
+            if addr in self.connection_states:
+                self._discard_connection(addr)
+            state = dict(snapshot, ack_timer=None, pacing_timer=None,
+                         send_queues={priority: deque(queue) for priority, queue in snapshot['send_queues'].items()})
+            self.receive_buffer[addr] = state.pop('receive_buffer')
+            self.connection_states[addr] = state
+            if state['session'] is not None:
+                self.sessions[state['session']] = addr
+            self._touch_connection(addr)
+            for seq_num, info in state['ack_history'].items():
+                info['addr'] = addr
+                info['timer'] = self._schedule(state['rto'], self._on_retry_timer, addr, seq_num)
+            if state['ack_pending']:
+                self._schedule_ack(addr, state)
+            self._pump_send_queue(addr, state)
+    
+    def _timestamp_ms(self) -> int:
+        """包头时间戳：本端时钟的毫秒数（低32位），对端只回显不解读，与系统时间无关"""
+        return int(self.clock() * 1000) & 0xFFFFFFFF
+    
+    def _on_timestamp(self, state: dict, packet: dict):
+        """记录对端的发送时间戳等待回显，并用对端回显的本端时间戳测量RTT，调用方持有 self.lock"""
+        state['echo'] = (packet['timestamp_ms'], self.clock())
+        latest = state['peer_timestamp']
+        if latest is None or (packet['timestamp_ms'] - latest) & 0xFFFFFFFF < 0x80000000:
+            state['peer_timestamp'] = packet['timestamp_ms']
+        if 'echo' not in packet:
+            return
+        timestamp_ms, delay_ms = packet['echo']
+        rtt_ms = (self._timestamp_ms() - timestamp_ms - delay_ms) & 0xFFFFFFFF
+        # 时间戳取低32位，回绕或时钟跳变时得到的异常值（超过1分钟）直接丢弃
+        if rtt_ms > 60000:
+            return
+        state['echo_seen'] = True
+        self._update_rtt(state, rtt_ms / 1000)
+        self._observe(state, 'rtt_ms', rtt_ms)
+    
+    def _schedule_ack(self, addr: tuple, state: dict):
+        """登记延迟确认，期间发往该地址的任何数据包都会捎带确认"""
+        state['ack_pending'] = True
+        if state['ack_timer'] is None:
+            state['ack_timer'] = self._schedule(self.ack_delay, self._on_ack_timer, addr)
+    
+    def _on_ack_timer(self, addr: tuple):
+        """延迟确认定时器到期，没有数据可捎带时单独发送确认包"""
+        state = self.connection_states.get(addr)
+        if state is None:
+            return
+        state['ack_timer'] = None
+        if state['ack_pending']:
+            ack_packet = {
+                'type': PacketType.ACK.value,
+                'timestamp': time.time()
+            }
+            self._send_packet(ack_packet, addr)
+    
+    def _process_ack(self, state: dict, ack_seq: int, ack_bits: int):
+        """处理累计确认和选择确认，从确认历史中移除已确认的包"""
+        ack_history = state['ack_history']
+        acked = []
+        # 确认历史按发送顺序排列，序列号递增（回绕安全比较）
+        while ack_history:
+            seq_num = next(iter(ack_history))
+            if sequence_diff(seq_num, ack_seq) > 0:
+                break
+            acked.append(ack_history.pop(seq_num))
+        
+        offset = 0
+        while ack_bits:
+            if ack_bits & 1:
+                seq_num = (ack_seq + 2 + offset) % SEQUENCE_MODULO
+                if seq_num in ack_history:
+                    acked.append(ack_history.pop(seq_num))
+            ack_bits >>= 1
+            offset += 1
+        
+        self._on_packets_acked(state, acked)
+    
+    def _on_packets_acked(self, state: dict, acked: list):
+        """取消已确认包的重传定时器，并用其中最近发送的未重传包更新RTT估计"""
+        if not acked:
+            return
+        
+        now = self.clock()
+        sample = None
+        self._count(state, 'acked', len(acked))
+        for info in acked:
+            info['timer'].cancel()
+            for ticket in info['data'].get('tickets', ()):
+                # 已送达的消息不会再被取代
+                if ticket is not None and state['supersede'].get(ticket['key']) is ticket:
+                    del state['supersede'][ticket['key']]
+            # 加性增：慢启动阶段每个确认窗口加一，之后每个RTT加一
+            if state['cwnd'] < state['ssthresh']:
+                state['cwnd'] += 1
+            else:
+                state['cwnd'] += 1 / state['cwnd']
+            # Karn 算法：重传过的包无法区分确认对应哪次发送，不参与RTT采样；
+            # 对端支持时间戳回显时改用回显测量，确认包含延迟确认的等待时间，不再采样
+            if info['retry_count'] == 0 and not state['echo_seen']:
+                rtt = now - info['send_time']
+                if sample is None or rtt < sample:
+                    sample = rtt
+        
+        state['cwnd'] = min(state['cwnd'], float(self.max_cwnd))
+        
+        if sample is not None:
+            self._update_rtt(state, sample)
+            self._observe(state, 'rtt_ms', sample * 1000)
+        
+        # 窗口腾出空间，继续发送排队的包
+        self._pump_send_queue(acked[0]['addr'], state)
+    
+    def _on_packet_lost(self, addr: tuple, state: dict, seq_num: int):
+        """
+        重传超时：退避重传超时；乘性减，重传超时视为拥塞信号，同一个窗口内的多次丢包只缩小一次窗口
+        """
+        # 重传超时退避并保留到下一个有效的RTT采样（Karn 算法），否则RTT大于初始超时的链路上
+        # 每个包都会在确认前被重传，重传包又不参与采样，超时永远无法收敛。
+        # 退避只在这里做，重传定时器直接使用 state['rto']。每个包有独立的重传定时器，
+        # 退避前的一个重传超时内到期的其他定时器不再退避（相当于 RFC 6298 的单个定时器），
+        # 否则一次突发丢包会让超时连续翻倍；链路持续中断时同一个包每次超时仍然翻倍
+        now = self.clock()
+        if now >= state['rto_backoff_until']:
+            state['rto_backoff_until'] = now + state['rto']
+            state['rto'] = min(state['rto'] * 2, self.max_retry_timeout)
+        if state['recovery_seq'] is not None and sequence_diff(seq_num, state['recovery_seq']) <= 0:
+            return
+        state['recovery_seq'] = (self._peek_next_sequence(addr) - 1) % SEQUENCE_MODULO
+        state['ssthresh'] = max(state['cwnd'] / 2, float(self.min_cwnd))
+        state['cwnd'] = state['ssthresh']
+    
+    def get_congestion_stats(self, addr: tuple) -> Optional[dict]:
+        """获取与指定地址的拥塞窗口、在途包数和发送队列深度，连接不存在时返回 None"""
+        with self.lock:
+            state = self.connection_states.get(addr)
+            if state is None:
+                return None
+            return {
+                'cwnd': state['cwnd'],
+                'ssthresh': state['ssthresh'],
+                'in_flight': len(state['ack_history']),
+                'send_queue': self._queued_packets(state),
+                'send_queues': {priority: len(queue) for priority, queue in state['send_queues'].items()},
+                'bulk_allowance': state['bulk_allowance'],
+                'outbound': len(state['outbound']),
+                'queue_delay_ms': state['queue_delay'] * 1000
+            }
+    
+    def get_metrics(self, addr: Optional[tuple] = None) -> Optional[dict]:
+        """
+        传输统计快照：指定地址时返回该连接的计数器、直方图和当前状态，连接不存在时返回 None；
+        不指定地址时返回整个 socket 的汇总（包括已断开的连接）
+        """
+        with self.lock:
+            if addr is None:
+                snapshot = self.metrics.to_dict()
+                snapshot['connections'] = len(self.connection_states)
+                snapshot['inbox'] = len(self.inbox)
+                snapshot['socket'] = self.get_socket_stats()
+                if self.simulator is not None:
+                    snapshot['impairment'] = self.simulator.get_stats()
+                return snapshot
+
+            state = self.connection_states.get(addr)
+            if state is None:
+                return None
+            snapshot = state['metrics'].to_dict()
+            snapshot.update({
+                'srtt_ms': state['srtt'] * 1000 if state['srtt'] is not None else None,
+                'rto_ms': state['rto'] * 1000,
+                'codec': state['codec'],
+                'cwnd': state['cwnd'],
+                'in_flight': len(state['ack_history']),
+                'send_queue': self._queued_packets(state),
+                'send_queues': {priority: len(queue) for priority, queue in state['send_queues'].items()},
+                'outbound': len(state['outbound']),
+                'receive_buffer': len(self.receive_buffer.get(addr, ())),
+                'channel_buffers': {channel: len(entry['buffer']) for channel, entry in state['channels'].items()},
+                'fec_group': state['fec']['group_size'] if state['fec'] is not None else 0,
+                'reassembly_bytes': state['reassembly_bytes']
+            })
+            return snapshot
+
+    def dump_metrics(self, path: Optional[str] = None) -> str:
+        """把 socket 汇总和所有连接的统计导出为 JSON，指定 path 时同时写入文件"""
+        with self.lock:
+            report = {
+                'time': time.time(),
+                'socket': self.get_metrics(),
+                'connections': {f"{addr[0]}:{addr[1]}": self.get_metrics(addr) for addr in self.connection_states}
+            }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return text
+
+    def is_congested(self, addr: tuple) -> bool:
+        """
+        realtime 或 control 队列中是否有包在等待拥塞窗口，调用方可据此降低非必要消息的发送量
+        （bulk 队列因字节预算产生的积压不算拥塞）
+        """
+        state = self.connection_states.get(addr)
+        return bool(state and (state['send_queues'][PRIORITY_REALTIME] or state['send_queues'][PRIORITY_CONTROL]))
+    
+    def _update_rtt(self, state: dict, sample: float):
+        """Jacobson/Karels 算法更新平滑RTT、RTT偏差和重传超时"""
+        if state['srtt'] is None:
+            state['srtt'] = sample
+            state['rttvar'] = sample / 2
+        else:
+            state['rttvar'] = 0.75 * state['rttvar'] + 0.25 * abs(state['srtt'] - sample)
+            state['srtt'] = 0.875 * state['srtt'] + 0.125 * sample
+        
+        rto = state['srtt'] + max(0.01, 4 * state['rttvar'])
+        if state['echo_seen']:
+            # 回显测得的是链路RTT，确认还可能被对端延迟 ack_delay
+            rto += self.ack_delay
+        state['rto'] = min(max(rto, self.min_retry_timeout), self.max_retry_timeout)
+    
+    def get_rtt(self, addr: tuple) -> Optional[float]:
+        """获取与指定地址的平滑RTT（毫秒），尚未测得时返回 None"""
+        state = self.connection_states.get(addr)
+        if state is None or state['srtt'] is None:
+            return None
+        return state['srtt'] * 1000
+    
+    def get_rto(self, addr: tuple) -> float:
+        """获取与指定地址的当前重传超时（毫秒）"""
+        state = self.connection_states.get(addr)
+        return (state['rto'] if state else self.retry_timeout) * 1000
     
     def send_ack(self, seq_num: int, addr: tuple):
-        """发送确认包"""
+        """发送确认包（旧格式，每个可靠包单独确认）"""
         ack_packet = {
             'type': PacketType.ACK.value,
             'ack_seq': seq_num,
@@ -159,175 +1340,544 @@ class ReliableUDP:
         self._send_packet(ack_packet, addr)
     
     def _receive_loop(self):
-        """接收循环"""
+        """接收循环：等待 socket 可读后一次读取多个数据报"""
         while self.running:
             try:
-                data, addr = self.socket.recvfrom(65507)  # 最大UDP包大小
-                self._handle_received_data(data, addr)
-            except socket.timeout:
-                continue
+                # 超时只用于检查 running，数据到达时立即唤醒
+                readable, _, _ = select.select([self.socket], [], [], 0.5)
+                if readable:
+                    self._drain_socket()
             except Exception as e:
                 if self.running:  # 只在运行状态下打印错误
                     print(f"接收数据错误: {e}")
     
-    def _handle_received_data(self, data: bytes, addr: tuple):
-        """处理接收到的数据"""
+    def _drain_socket(self):
+        """读取内核队列中的数据报（最多 recv_batch_size 个），每填满一轮接收缓冲环加锁处理一次"""
+        total = 0
+        while total < self.recv_batch_size:
+            received, drained = self._receive_into_ring(min(len(self.recv_ring), self.recv_batch_size - total))
+            total += len(received)
+            if received:
+                with self.lock:
+                    for packet, packet_type, seq_num, codec, addr in received:
+                        self._handle_packet(packet, packet_type, seq_num, codec, addr)
+            # 处理完之后缓冲环才能被下一轮覆盖，received 中的 memoryview 随之释放
+            del received
+            if drained:
+                break
+        
+        self.io_stats['recv_wakeups'] += 1
+        self.io_stats['recv_datagrams'] += total
+        self.io_stats['recv_max_batch'] = max(self.io_stats['recv_max_batch'], total)
+    
+    def _receive_into_ring(self, limit: int) -> tuple:
+        """用 recvfrom_into 把数据报读入缓冲环并解析包头，返回 (解析结果列表, 内核队列是否已读空)"""
+        received = []
+        # 每个数据报都要用到的方法先取出来，减少循环中的属性查找
+        recvfrom_into, decode_datagram = self.socket.recvfrom_into, self._decode_datagram
+        for buffer in self.recv_ring[:limit]:
+            try:
+                nbytes, addr = recvfrom_into(buffer)
+            except BlockingIOError:
+                return received, True
+            except ConnectionError:
+                # 之前发出的数据报触发的 ICMP 错误，不影响后续读取
+                continue
+            if self.simulator is not None:
+                # 损伤模拟延后交付，缓冲区会被覆盖，需要复制
+                self._receive_datagram(bytes(buffer[:nbytes]), addr)
+                continue
+            decoded = decode_datagram(buffer[:nbytes], addr)
+            if decoded is not None:
+                received.append(decoded + (addr,))
+        return received, False
+    
+    def _decode_datagram(self, data, addr: tuple) -> Optional[tuple]:
+        """
+        解码来自 addr 的数据报，返回 (packet, packet_type, seq_num, codec)，无法解码或丢弃时返回 None
+        二进制包只解析包头，负载以 memoryview 形式保存在 packet['raw'] 中，
+        确认包、重复包、超出窗口的包和未完成握手的包不需要解码负载
+        """
         try:
-            # 解压数据
-            decompressed = zlib.decompress(data)
-            packet = json.loads(decompressed.decode())
+            # 按首字节识别编码格式
+            if data and data[0] == MAGIC:
+                view = data if type(data) is memoryview else memoryview(data)
+                packet, codec = decode_header(view), CODEC_BINARY
+                if 'seq' in packet:
+                    packet['raw'] = view[payload_offset(packet):]
+            elif self.is_server and self.require_cookie and addr not in self.connection_states:
+                # 未知地址的旧格式数据报只可能是握手心跳，先按大小过滤，解压也只取握手心跳所需的长度
+                if len(data) > HANDSHAKE_MAX_SIZE:
+                    self.metrics.counters['handshake_dropped'] += 1
+                    return None
+                packet, codec = decode_json(data, HANDSHAKE_MAX_SIZE), CODEC_JSON
+            else:
+                packet, codec = decode_json(data), CODEC_JSON
             
-            packet_type = PacketType(packet['type'])
+            packet_type = _PACKET_TYPES.get(packet['type'])
+            if packet_type is None:
+                raise ValueError(f"未知的包类型: {packet['type']}")
             seq_num = packet.get('seq')
+            packet['size'] = len(data)
+        except Exception as e:
+            print(f"处理接收数据错误: {e}")
+            self.metrics.counters['decode_errors'] += 1
+            return None
+        return packet, packet_type, seq_num, codec
+    
+    @staticmethod
+    def _decode_payload(packet: dict):
+        """按需解码 _decode_datagram 延后的二进制负载，返回未压缩的负载，没有延后的负载时返回 None"""
+        raw = packet.pop('raw', None)
+        if raw is not None:
+            return decode_payload(packet, raw)
+        return None
+    
+    def _receive_datagram(self, data: bytes, addr: tuple):
+        """收到一个数据报，启用损伤模拟时按模拟结果丢弃、延迟或复制后再处理"""
+        if self.simulator is None:
+            self._handle_received_data(data, addr)
+            return
+        for delay in self.simulator.inbound.submit(len(data), self.clock()):
+            self._schedule(delay, self._handle_received_data, data, addr)
+    
+    def _handle_received_data(self, data: bytes, addr: tuple):
+        """处理接收到的数据"""
+        decoded = self._decode_datagram(data, addr)
+        if decoded is None:
+            return
+        
+        with self.lock:
+            self._handle_packet(*decoded, addr)
+    
+    def _handle_packet(self, packet: dict, packet_type: PacketType, seq_num: int, codec: str, addr: tuple):
+        """处理解码后的数据包，调用方持有 self.lock"""
+        try:
+            # 会话令牌可能把连接从旧地址迁移过来，需要在更新连接状态之前处理
+            if 'session' in packet and not self._check_session(packet, addr):
+                return
+            # 未知地址必须先完成 cookie 握手，在此之前不创建任何连接状态
+            if self.is_server and addr not in self.connection_states and not self._check_cookie(
+                    packet, packet_type, codec, addr):
+                return
             
             # 更新连接状态
-            self.connections[addr] = time.time()
+            self._touch_connection(addr)
+            self._record_received(addr, packet['size'])
+            if not self.is_server:
+                # 收到 cookie 时在 _handle_server_reply 中重新置为 False
+                self._get_connection_state(addr)['accepted'] = True
+            
+            # 对端发来二进制包，说明其支持二进制编码
+            if codec == CODEC_BINARY and self.codec == CODEC_BINARY:
+                self._get_connection_state(addr)['codec'] = CODEC_BINARY
             
             # 确保该地址的接收缓冲区存在
             if addr not in self.receive_buffer:
                 self.receive_buffer[addr] = {}
             
+            # 二进制包头的发送时间戳和时间戳回显
+            if 'timestamp_ms' in packet:
+                self._on_timestamp(self._get_connection_state(addr), packet)
+            
+            # 二进制包头捎带的确认信息
+            if 'ack' in packet:
+                self._process_ack(self._get_connection_state(addr), *packet['ack'])
+            
             if packet_type == PacketType.RELIABLE:
-                # 可靠数据包 - 发送ACK
-                self.send_ack(seq_num, addr)
-                
-                # 获取连接状态
-                state = self._get_connection_state(addr)
-                
-                # 检查是否已接收过
-                if seq_num not in state['received_packets']:
-                    state['received_packets'].add(seq_num)
-                    
-                    # 按顺序处理，同时保存数据和地址信息
-                    self.receive_buffer[addr][seq_num] = {
-                        'data': packet['data']
-                    }
-                    self._process_receive_buffer(addr)
+                self._receive_reliable(addr, self._get_connection_state(addr), packet, seq_num)
+            
+            elif packet_type == PacketType.REPAIR:
+                self._decode_payload(packet)
+                self._record_received_kind(addr, packet)
+                self._handle_repair(addr, self._get_connection_state(addr), *packet['repair'])
             
             elif packet_type == PacketType.UNRELIABLE:
                 # 不可靠数据包 - 直接处理
-                if self.callbacks['on_message']:
-                    self.callbacks['on_message'](packet['data'], addr)
+                self._decode_payload(packet)
+                self._record_received_kind(addr, packet)
+                if not self.is_server and self._handle_server_reply(packet['data'], addr):
+                    return
+                self._count(self.connection_states.get(addr), 'messages_received')
+                self._emit('on_message', packet['data'], addr)
             
             elif packet_type == PacketType.ACK:
-                # 确认包 - 从确认历史中移除
-                state = self._get_connection_state(addr)
-                ack_seq = packet['ack_seq']
-                if ack_seq in state['ack_history']:
-                    del state['ack_history'][ack_seq]
-                    # print(f"删除确认历史: {ack_seq}, 地址: {addr}")
-                else:
-                    print(f"确认包 {ack_seq} 不存在，地址: {addr}")
+                self._record_received_kind(addr, packet)
+                if 'ack_seq' in packet:
+                    # 旧格式确认包 - 从确认历史中移除
+                    state = self._get_connection_state(addr)
+                    ack_seq = packet['ack_seq']
+                    if ack_seq in state['ack_history']:
+                        self._on_packets_acked(state, [state['ack_history'].pop(ack_seq)])
+                        # print(f"删除确认历史: {ack_seq}, 地址: {addr}")
+                    else:
+                        print(f"确认包 {ack_seq} 不存在，地址: {addr}")
             
             elif packet_type == PacketType.HEARTBEAT:
-                # 心跳包 - 更新连接状态
-                self.connections[addr] = time.time()
-                if self.is_server:
-                    # 服务器回应心跳
+                # 心跳包 - 连接状态已在上面更新
+                # 客户端在心跳中携带支持的编码格式，协商使用二进制编码
+                self._decode_payload(packet)
+                self._record_received_kind(addr, packet)
+                codecs = packet.get('data', {}).get('codecs', [])
+                if self.codec == CODEC_BINARY and CODEC_BINARY in codecs:
+                    self._get_connection_state(addr)['codec'] = CODEC_BINARY
+                if self.is_server and (codecs or packet['data'].get('resume') or 'cookie' in packet['data']):
+                    # 只回应握手心跳和恢复会话的心跳，让客户端立即结束握手、切换编码或确认恢复；
+                    # 其他心跳不需要回应，服务器空闲时自己会发送心跳
                     self.send_unreliable({'type': 'heartbeat_ack'}, addr)
         
         except Exception as e:
             print(f"处理接收数据错误: {e}")
     
+    def _receive_reliable(self, addr: tuple, state: dict, packet: dict, seq_num: int):
+        """处理收到（或由修复包还原）的可靠包：确认、去重，然后按通道或序列号顺序交付，调用方持有 self.lock"""
+        # 相对期望序列号的位置：负数是已交付的重复包，超出窗口的包丢弃等待重传
+        offset = sequence_diff(seq_num, state['expected_sequence'])
+        if offset >= self.receive_window:
+            self._count(state, 'out_of_window')
+            return
+        
+        # 可靠数据包 - 二进制对端延迟并捎带确认，旧版本对端逐包发送ACK
+        if state['codec'] == CODEC_BINARY:
+            self._schedule_ack(addr, state)
+        else:
+            self.send_ack(seq_num, addr)
+        
+        # 检查是否已接收过
+        if offset >= 0 and not state['received_bits'] >> offset & 1:
+            state['received_bits'] |= 1 << offset
+            state['received_any'] = True
+            
+            # 按顺序处理，合并包中的消息按打包顺序交付，分片在交付时重组
+            payload = self._decode_payload(packet)
+            self._record_received_kind(addr, packet)
+            if payload is not None and packet.get('fec'):
+                self._cache_fec_payload(state, seq_num, payload)
+            if offset > 0:
+                self._count(state, 'out_of_order')
+            if 'fragment' in packet:
+                item = {'fragment': packet['fragment']}
+            else:
+                item = {'messages': packet['bundle'] if 'bundle' in packet else [packet['data']]}
+            if 'channel' in packet:
+                # 带通道的包在通道内排序，不等待其他通道的包
+                self._process_receive_buffer(addr)
+                self._receive_on_channel(addr, state, packet['channel'], packet['cseq'], item)
+            else:
+                # 旧版本对端的包没有通道，按序列号全局排序
+                self.receive_buffer[addr][seq_num] = item
+                self._process_receive_buffer(addr)
+        else:
+            self._count(state, 'duplicates')
+    
+    def _cache_fec_payload(self, state: dict, seq_num: int, payload):
+        """缓存属于修复组（带 FLAG_FEC）的可靠包负载，只保留最近 fec_cache_size 个"""
+        cache = state['fec_cache']
+        cache[seq_num] = bytes(payload)
+        if len(cache) > self.fec_cache_size:
+            del cache[next(iter(cache))]
+    
+    def _handle_repair(self, addr: tuple, state: dict, channel: int, members: list, block: bytes):
+        """
+        收到修复包：组内恰好缺少一个包、其余成员的负载都在缓存中时还原缺失的包，
+        与正常收到一样确认和交付，发送端收到确认后不再重传，调用方持有 self.lock
+        """
+        missing = []
+        for seq_num, cseq in members:
+            offset = sequence_diff(seq_num, state['expected_sequence'])
+            if 0 <= offset < self.receive_window and not state['received_bits'] >> offset & 1:
+                missing.append((seq_num, cseq))
+        if len(missing) != 1:
+            return
+        
+        seq_num, cseq = missing[0]
+        cache = state['fec_cache']
+        others = [cache.get(member) for member, _ in members if member != seq_num]
+        if None in others:
+            return
+        # 还原的包没有自己的数据报，字节数已计入修复包
+        packet = {'type': PacketType.RELIABLE.value, 'seq': seq_num, 'channel': channel, 'cseq': cseq, 'size': 0}
+        payload = recover_payload(block, others)
+        decode_payload(packet, payload)
+        self._cache_fec_payload(state, seq_num, payload)
+        self._count(state, 'fec_recovered')
+        self._receive_reliable(addr, state, packet, seq_num)
+    
+    def _handle_server_reply(self, data: dict, addr: tuple) -> bool:
+        """
+        客户端处理服务器对握手和恢复会话的答复，调用方持有 self.lock
+        返回是否为传输层的控制消息（cookie、session_expired、heartbeat_ack），控制消息不交给上层
+        """
+        msg_type = data.get('type')
+        if msg_type == 'cookie':
+            state = self.connection_states.get(addr)
+            if state is not None:
+                # 服务器还没有该连接的状态，继续发送握手心跳直到收到其他的包
+                state['accepted'] = False
+            if state is not None and data.get('cookie') != state['cookie']:
+                state['cookie'] = data.get('cookie')
+                # 立即带着 cookie 重新握手，并重发服务器在握手完成前丢弃的包
+                self._send_heartbeat(addr)
+                self._resend_unacked(addr, state)
+        elif msg_type == 'session_expired':
+            # 服务器已经没有这个会话（如服务器重启），丢弃本地连接状态，上层需要重新连接
+            print(f"会话已过期: {addr}")
+            self._discard_connection(addr)
+            if self.resuming:
+                self.resuming = False
+                self._emit('on_resume', addr, False)
+            else:
+                self._emit('on_disconnect', addr)
+        elif msg_type == 'heartbeat_ack':
+            if self.resuming:
+                self.resuming = False
+                self._emit('on_resume', addr, True)
+        else:
+            return False
+        return True
+    
+    def _record_received(self, addr: tuple, nbytes: int):
+        """记录收到的数据报（含重复包和窗口外的包），调用方持有 self.lock"""
+        self.metrics.on_received(nbytes)
+        self._get_connection_state(addr)['metrics'].on_received(nbytes)
+    
+    def _record_received_kind(self, addr: tuple, packet: dict):
+        """按种类记录已接受的数据包字节数，调用方持有 self.lock"""
+        kind = _packet_kind(packet)
+        self.metrics.on_received_kind(kind, packet['size'])
+        self._get_connection_state(addr)['metrics'].on_received_kind(kind, packet['size'])
+    
     def _process_receive_buffer(self, addr: tuple):
-        """处理特定客户端的接收缓冲区，按顺序交付"""
+        """
+        推进特定客户端的接收窗口，按顺序交付没有通道的包；
+        带通道的包收到时已放入通道的重排缓冲区，这里只推进窗口
+        """
         if addr not in self.receive_buffer:
             return
             
         state = self._get_connection_state(addr)
         buffer = self.receive_buffer[addr]
         
-        while state['expected_sequence'] in buffer:
+        while state['received_bits'] & 1:
+            item = buffer.pop(state['expected_sequence'], None)
+            # 先推进期望序列号和接收窗口，回调中发出的数据包捎带的确认才会包含当前包
+            state['expected_sequence'] = (state['expected_sequence'] + 1) % SEQUENCE_MODULO
+            state['received_bits'] >>= 1
+            if item is not None:
+                self._deliver_item(addr, state, item)
+    
+    def _receive_on_channel(self, addr: tuple, state: dict, channel: int, cseq: int, item: dict):
+        """把带通道的包放入通道的重排缓冲区，并交付通道内已连续的包，调用方持有 self.lock"""
+        if channel == CHANNEL_UNORDERED:
+            self._deliver_item(addr, state, item)
+            return
+        
+        entry = state['channels'].get(channel)
+        if entry is None:
+            entry = state['channels'][channel] = {'expected': 0, 'buffer': {}}
+        # 同一通道的包序列号也是按发出顺序分配的，等待中的包都在接收窗口内
+        offset = sequence_diff(cseq, entry['expected'])
+        if offset < 0 or offset >= self.receive_window:
+            self._count(state, 'out_of_window')
+            return
+        if offset > 0:
+            self._count(state, 'channel_held')
+        entry['buffer'][cseq] = item
+        
+        buffer = entry['buffer']
+        while entry['expected'] in buffer:
+            item = buffer.pop(entry['expected'])
+            entry['expected'] = (entry['expected'] + 1) % SEQUENCE_MODULO
+            self._deliver_item(addr, state, item)
+    
+    def _deliver_item(self, addr: tuple, state: dict, item: dict):
+        """交付一个可靠包中的消息，合并包按打包顺序交付，分片收齐后交付重组的消息"""
+        messages = item.get('messages')
+        if messages is None:
             try:
-                item = buffer.pop(state['expected_sequence'])
-                data = item['data']
-                
-                if self.callbacks['on_message']:
-                    # print(f"处理接收数据: {data}, 源: {addr}")
-                    self.callbacks['on_message'](data, addr)
-                
-                state['expected_sequence'] = (state['expected_sequence'] + 1) % 65536
+                message = self._reassemble(addr, state, *item['fragment'])
             except Exception as e:
-                print(f"处理接收缓冲区时出错: {e}")
+                print(f"分片消息重组错误: {e}")
+                message = None
+            messages = [message] if message is not None else []
+        
+        self._count(state, 'messages_received', len(messages))
+        for data in messages:
+            # print(f"处理接收数据: {data}, 源: {addr}")
+            self._emit('on_message', data, addr)
+    
+    def _emit(self, event: str, *args):
+        """触发事件：启用收件队列时入队等待 poll()，否则直接在当前线程回调"""
+        if self.use_inbox:
+            was_empty = not self.inbox
+            self.inbox.append((event, args))
+            if was_empty and self.callbacks['on_inbox']:
+                self.callbacks['on_inbox']()
+            return
+        self._dispatch(event, args)
+    
+    def _dispatch(self, event: str, args: tuple):
+        """调用事件回调，回调中的异常不影响网络处理"""
+        callback = self.callbacks.get(event)
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"执行 {event} 回调时出错: {e}")
+    
+    def poll(self) -> int:
+        """
+        在调用线程中处理收件队列，返回处理的事件数
+        只处理调用时已在队列中的事件，处理期间新到达的留到下一次 poll
+        """
+        inbox = self.inbox
+        count = len(inbox)
+        for _ in range(count):
+            event, args = inbox.popleft()
+            self._dispatch(event, args)
+        return count
     
     def _process_loop(self):
-        """处理循环 - 重传和心跳"""
+        """处理循环 - 休眠到最近的定时器截止时间，执行重传、心跳和连接超时检查"""
         while self.running:
-            current_time = time.time()
-            
-            # 检查需要重传的数据包
-            # 使用 list() 创建副本以避免在迭代时修改字典
-            for addr, state in list(self.connection_states.items()):
-                expired_packets = []
-                for seq_num, info in list(state['ack_history'].items()):
-                    if current_time - info['send_time'] > self.retry_timeout:
-                        if info['retry_count'] < self.max_retries:
-                            # 重传
-                            info['retry_count'] += 1
-                            info['send_time'] = current_time
-                            self._send_packet(info['data'], info['addr'])
-                        else:
-                            # 超过最大重试次数
-                            expired_packets.append(seq_num)
-                            print(f"数据包 {seq_num} 超过最大重试次数")
-                
-                # 移除过期的数据包
-                for seq_num in expired_packets:
-                    # 首先尝试调用 on_message_failed 回调，告知特定消息发送失败
-                    if self.callbacks['on_message_failed']:
-                        try:
-                            # 传递地址和序列号，以便上层应用识别是哪个消息失败了
-                            self.callbacks['on_message_failed'](addr, seq_num)
-                        except Exception as callback_error:
-                            print(f"执行 on_message_failed 回调时出错: {callback_error}")
-                    
-                    # 然后从确认历史中移除该数据包
-                    del state['ack_history'][seq_num]
-                    print(f"过期，删除确认历史: {seq_num}, 地址: {addr}")
-            
-            # 发送心跳
-            if current_time - self.last_heartbeat_time > self.heartbeat_interval:
-                self._send_heartbeats()
-                self.last_heartbeat_time = current_time
-            
-            # 检查连接超时
-            self._check_connection_timeout()
-            
-            time.sleep(0.01)  # 10ms间隔
+            with self.timer_condition:
+                now = self.clock()
+                if not self._run_due_timers(now):
+                    next_deadline = self.timers.next_deadline()
+                    timeout = None if next_deadline is None else next_deadline - now
+                    self.timer_condition.wait(timeout)
+    
+    def _run_due_timers(self, now: float) -> bool:
+        """执行所有已到期的定时器，返回是否有定时器被执行，调用方持有 self.lock"""
+        due = self.timers.pop_due(now)
+        for entry in due:
+            try:
+                entry.callback(*entry.args)
+            except Exception as e:
+                print(f"执行定时器 {entry.callback.__name__} 时出错: {e}")
+        return bool(due)
+    
+    def _on_retry_timer(self, addr: tuple, seq_num: int):
+        """重传定时器到期"""
+        state = self.connection_states.get(addr)
+        if state is None or seq_num not in state['ack_history']:
+            return
+        
+        info = state['ack_history'][seq_num]
+        self._on_packet_lost(addr, state, seq_num)
+        if info['retry_count'] < self.max_retries:
+            # 重传，重传超时已由 _on_packet_lost 退避（指数退避）
+            info['retry_count'] += 1
+            info['send_time'] = self.clock()
+            info['timer'] = self._schedule(state['rto'], self._on_retry_timer, addr, seq_num)
+            self._count(state, 'retransmits')
+            self._trim_packet(state, info['data'])
+            self._send_packet(info['data'], info['addr'])
+            return
+        
+        # 超过最大重试次数
+        print(f"数据包 {seq_num} 超过最大重试次数")
+        self._count(state, 'failed')
+        
+        # 首先通知 on_message_failed，传递地址和序列号，以便上层应用识别是哪个消息失败了
+        self._emit('on_message_failed', addr, seq_num)
+        
+        # 然后从确认历史中移除该数据包
+        del state['ack_history'][seq_num]
+        print(f"过期，删除确认历史: {seq_num}, 地址: {addr}")
+        self._pump_send_queue(addr, state)
+    
+    def _on_heartbeat_timer(self):
+        """心跳定时器到期"""
+        self._send_heartbeats()
+        self._schedule(self.heartbeat_interval, self._on_heartbeat_timer)
     
     def _send_heartbeats(self):
-        """发送心跳包"""
-        heartbeat_data = {'type': 'heartbeat'}
+        """
+        向空闲的连接发送心跳：heartbeat_idle 内发出过任何数据包的连接不需要心跳，
+        对端收到任何数据包都会刷新连接活跃时间，RTT 由包头的时间戳回显测量
+        """
         if self.is_server:
-            # 服务器向所有客户端发送心跳
-            for addr in list(self.connections.keys()):
-                self.send_unreliable(heartbeat_data, addr)
+            addrs = list(self.connections.keys())
         else:
-            # 客户端向服务器发送心跳
-            if hasattr(self, 'server_addr'):
-                self.send_unreliable(heartbeat_data, self.server_addr)
+            addrs = [self.server_addr] if hasattr(self, 'server_addr') else []
+        
+        now = self.clock()
+        for addr in addrs:
+            state = self.connection_states.get(addr)
+            # 客户端握手、编码协商或恢复会话未完成时不论是否空闲都发送握手心跳
+            negotiating = not self.is_server and (
+                self.resuming or state is not None and not state['accepted']
+                or self.codec == CODEC_BINARY and self.get_codec(addr) != CODEC_BINARY)
+            if state is None or negotiating or now - state['last_send'] >= self.heartbeat_idle:
+                self._send_heartbeat(addr)
+    
+    def _send_heartbeat(self, addr: tuple):
+        """发送单个心跳包，客户端编码协商未完成时携带支持的编码格式"""
+        heartbeat_data = {'type': 'heartbeat'}
+        if not self.is_server and self.codec == CODEC_BINARY and self.get_codec(addr) != CODEC_BINARY:
+            heartbeat_data['codecs'] = [CODEC_BINARY, CODEC_JSON]
+        if self.resuming:
+            heartbeat_data['resume'] = True
+        state = self.connection_states.get(addr)
+        if not self.is_server and state is not None and state['cookie'] is not None and state['session'] is None:
+            # 收到会话令牌说明服务器已经创建了连接状态，之后不再需要 cookie
+            heartbeat_data['cookie'] = state['cookie']
+        packet = self._create_packet(heartbeat_data, PacketType.HEARTBEAT, 0)
+        self._send_packet(packet, addr)
+    
+    def _touch_connection(self, addr: tuple):
+        """刷新连接活跃时间，新连接登记超时定时器"""
+        self.connections[addr] = self.clock()
+        if addr not in self.connection_timers:
+            self.connection_timers[addr] = self._schedule(
+                self.heartbeat_interval * 3, self._on_connection_timer, addr)
     
-    def _check_connection_timeout(self):
-        """检查连接超时"""
-        current_time = time.time()
+    def _on_connection_timer(self, addr: tuple):
+        """连接超时定时器到期，期间收到过数据则按最后活跃时间重新登记"""
         timeout = self.heartbeat_interval * 3  # 3倍心跳间隔
+        state = self.connection_states.get(addr)
+        if self.is_server and state and state['session_confirmed']:
+            # 持有会话的客户端可能只是暂时断网，保留更长时间等待它恢复
+            timeout = self.session_timeout
+        last_time = self.connections.get(addr)
+        if last_time is None:
+            self.connection_timers.pop(addr, None)
+            return
         
-        expired_connections = []
-        for addr, last_time in self.connections.items():
-            if current_time - last_time > timeout:
-                expired_connections.append(addr)
+        remaining = last_time + timeout - self.clock()
+        if remaining > 0:
+            self.connection_timers[addr] = self._schedule(remaining, self._on_connection_timer, addr)
+            return
         
-        for addr in expired_connections:
-            del self.connections[addr]
-            # 从连接状态中移除
-            if addr in self.connection_states:
-                del self.connection_states[addr]
-            # 从接收缓冲区中移除
-            if addr in self.receive_buffer:
-                del self.receive_buffer[addr]
-            
-            if self.callbacks['on_disconnect']:
-                self.callbacks['on_disconnect'](addr)
+        del self.connections[addr]
+        del self.connection_timers[addr]
+        if not self.is_server and state and state['session'] is not None:
+            # 客户端保留连接状态（序列号、未确认的包），之后可以用 resume() 恢复会话
+            self._emit('on_disconnect', addr)
+            return
+        self._discard_connection(addr)
+        self._emit('on_disconnect', addr)
+    
+    def _discard_connection(self, addr: tuple):
+        """移除连接状态、会话和接收缓冲区，并取消其定时器"""
+        state = self.connection_states.pop(addr, None)
+        if state:
+            for info in state['ack_history'].values():
+                info['timer'].cancel()
+            for name in ('pacing_timer', 'ack_timer'):
+                if state[name] is not None:
+                    state[name].cancel()
+            if self.sessions.get(state['session']) == addr:
+                del self.sessions[state['session']]
+        # 从接收缓冲区中移除
+        if addr in self.receive_buffer:
+            del self.receive_buffer[addr]
+        self.connections.pop(addr, None)
+        timer = self.connection_timers.pop(addr, None)
+        if timer is not None:
+            timer.cancel()
     
     def connect(self, server_host: str, server_port: int):
         """客户端连接服务器"""
@@ -335,18 +1885,48 @@ class ReliableUDP:
             return
         
         self.server_addr = (server_host, server_port)
-        self.connections[self.server_addr] = time.time()
+        with self.lock:
+            self._touch_connection(self.server_addr)
         
         # 初始化服务器连接状态
         self._get_connection_state(self.server_addr)
         
+        # 发送握手心跳，协商编码格式。旧版本服务器会忽略其中的 codecs 字段
+        self._send_heartbeat(self.server_addr)
+        
         # 发送连接请求 TODO 外面发送了连接请求
         # connect_data = {'type': 'connect'}
         # self.send_reliable(connect_data, self.server_addr)
     
+    def resume(self) -> bool:
+        """
+        客户端断线后快速恢复会话：保留序列号和未确认的数据，立即发送携带令牌的心跳并重发未确认的包，
+        服务器凭令牌找回连接（地址变化时迁移到新地址）。没有会话时返回 False，需要重新连接；
+        结果通过 on_resume 回调通知，服务器答复前心跳定时器会继续发送恢复心跳
+        """
+        if self.is_server or not hasattr(self, 'server_addr'):
+            return False
+        with self.lock:
+            state = self.connection_states.get(self.server_addr)
+            if state is None or state['session'] is None:
+                return False
+            self.resuming = True
+            self._touch_connection(self.server_addr)
+            self._send_heartbeat(self.server_addr)
+            self._resend_unacked(self.server_addr, state)
+            self._pump_send_queue(self.server_addr, state)
+        return True
+    
     def close(self):
         """关闭连接"""
-        self.running = False
+        with self.timer_condition:
+            self.running = False
+            self.timers.clear()
+            self.timer_condition.notify()
+        self._stop_io()
+    
+    def _stop_io(self):
+        """关闭 socket，接收线程随之退出"""
         if hasattr(self, 'socket'):
             self.socket.close()
 
@@ -0,0 +1,65 @@
+import heapq
+import itertools
+from typing import Callable, List, Optional
+
+
+class TimerEntry:
+    """定时器条目，取消后在出堆时丢弃（惰性删除）"""
+    __slots__ = ('deadline', 'order', 'callback', 'args', 'active')
+
+    def __init__(self, deadline: float, order: int, callback: Callable, args: tuple):
+        self.deadline = deadline
+        self.order = order
+        self.callback = callback
+        self.args = args
+        self.active = True
+
+    def __lt__(self, other: 'TimerEntry') -> bool:
+        return (self.deadline, self.order) < (other.deadline, other.order)
+
+    def cancel(self):
+        """取消定时器"""
+        self.active = False
+
+
+class TimerQueue:
+    """按截止时间排序的最小堆定时器队列，本身不加锁，由调用方保证线程安全"""
+
+    def __init__(self):
+        self._heap: List[TimerEntry] = []
+        self._order = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, deadline: float, callback: Callable, *args) -> TimerEntry:
+        """在 deadline 时刻调用 callback(*args)"""
+        entry = TimerEntry(deadline, next(self._order), callback, args)
+        heapq.heappush(self._heap, entry)
+        return entry
+
+    def is_head(self, entry: TimerEntry) -> bool:
+        """entry 是否是最早到期的定时器"""
+        return bool(self._heap) and self._heap[0] is entry
+
+    def next_deadline(self) -> Optional[float]:
+        """最早的截止时间，没有定时器时返回 None"""
+        heap = self._heap
+        while heap and not heap[0].active:
+            heapq.heappop(heap)
+        return heap[0].deadline if heap else None
+
+    def pop_due(self, now: float) -> List[TimerEntry]:
+        """弹出所有已到期且未取消的定时器"""
+        heap = self._heap
+        due = []
+        while heap and heap[0].deadline <= now:
+            entry = heapq.heappop(heap)
+            if entry.active:
+                entry.active = False
+                due.append(entry)
+        return due
+
+    def clear(self):
+        """清空所有定时器"""
+        self._heap.clear()
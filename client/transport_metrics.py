@@ -0,0 +1,110 @@
+from bisect import bisect_left
+from typing import Optional
+
+# 延迟直方图的桶上界（毫秒），最后一个桶收集所有更大的值
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+class Histogram:
+    """固定桶直方图：记录一次只需一次二分查找和几次加法，可以在生产环境常开"""
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> Optional[float]:
+        """按桶估算百分位数，返回所在桶的上界（最后一个桶返回最大值）"""
+        if self.count == 0:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        labels = [f"le_{bound}" for bound in self.bounds] + ['inf']
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': {label: count for label, count in zip(labels, self.counts) if count}
+        }
+
+
+class TransportMetrics:
+    """
+    一个连接（或整个 socket）的传输统计：计数器、按消息类型的字节数和延迟直方图
+    只在网络层持有 self.lock 时更新，读取时通过 to_dict 生成快照
+    """
+    COUNTERS = (
+        'datagrams_sent', 'bytes_sent', 'datagrams_received', 'bytes_received',
+        'reliable_sent',  # 首次发出的可靠包
+        'retransmits', 'acked', 'failed',  # 超过最大重试次数被放弃的可靠包
+        'duplicates', 'out_of_order', 'out_of_window',
+        'channel_held',  # 在通道重排缓冲区中等待同一通道前面的包的可靠包
+        'messages_sent', 'messages_received', 'send_blocked',
+        'fragments_sent', 'reassembly_dropped', 'decode_errors',
+        'migrations',  # 会话迁移到新地址的次数
+        'bulk_dropped',  # 字节预算用完而被丢弃的 bulk 不可靠消息
+        'expired',  # 超过有效期或被同一取代键的新消息取代而不再发送的可靠消息
+        'fec_repairs', 'fec_recovered',  # 发出的修复包数、由修复包还原（不等重传）的可靠包数
+        'handshake_cookies', 'handshake_dropped'  # 答复的 cookie 数、未完成握手的地址发来而被丢弃的包
+    )
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.bytes_sent_by_type = {}  # {消息类型: 字节数}，合并包记为 bundle，分片记为 fragment
+        self.bytes_received_by_type = {}
+        self.histograms = {
+            'rtt_ms': Histogram(),
+            'queue_delay_ms': Histogram(),  # 可靠包在发送队列中等待拥塞窗口的时间
+            # 按发送优先级分开的排队时间
+            'queue_delay_realtime_ms': Histogram(),
+            'queue_delay_control_ms': Histogram(),
+            'queue_delay_bulk_ms': Histogram()
+        }
+
+    def on_sent(self, kind: str, nbytes: int):
+        counters = self.counters
+        counters['datagrams_sent'] += 1
+        counters['bytes_sent'] += nbytes
+        self.bytes_sent_by_type[kind] = self.bytes_sent_by_type.get(kind, 0) + nbytes
+
+    def on_received(self, nbytes: int):
+        self.counters['datagrams_received'] += 1
+        self.counters['bytes_received'] += nbytes
+
+    def on_received_kind(self, kind: str, nbytes: int):
+        """已接受并解码的数据包按种类记录字节数，重复包和窗口外的包不解码，只计入总数"""
+        self.bytes_received_by_type[kind] = self.bytes_received_by_type.get(kind, 0) + nbytes
+
+    def loss_rate(self) -> float:
+        """重传占可靠包发送次数的比例，近似反映链路丢包率"""
+        sent = self.counters['reliable_sent'] + self.counters['retransmits']
+        return self.counters['retransmits'] / sent if sent else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'counters': dict(self.counters),
+            'loss_rate': self.loss_rate(),
+            'bytes_sent_by_type': dict(self.bytes_sent_by_type),
+            'bytes_received_by_type': dict(self.bytes_received_by_type),
+            'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+        }
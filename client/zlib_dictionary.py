@@ -0,0 +1,74 @@
+import re
+from collections import Counter
+from typing import Iterable
+
+# 预置字典的最大字节数。压缩窗口为 4KB（wbits=12），字典加单个数据包需要放进窗口
+DICTIONARY_SIZE = 2048
+
+# JSON 片段切分：带引号的字符串（含紧随的冒号）、数字、字面量、结构符号
+_TOKEN = re.compile(rb'"[^"]*":?|-?\d+|true|false|null|[{}\[\],]')
+
+
+def build_dictionary(samples: Iterable[bytes], size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    从抓取的消息负载中统计高频片段生成 zlib 预置字典
+    片段为 1~4 个连续的 JSON 记号，按 出现的样本数 x 长度 选取，
+    价值最高的片段放在字典末尾（离数据最近，引用距离最短）
+    """
+    counts = Counter()
+    for sample in samples:
+        tokens = [match.group() for match in _TOKEN.finditer(sample)]
+        seen = set()
+        for start in range(len(tokens)):
+            for length in range(1, 5):
+                if start + length > len(tokens):
+                    break
+                seen.add(b''.join(tokens[start:start + length]))
+        counts.update(seen)
+
+    candidates = sorted(((count * len(segment), segment) for segment, count in counts.items()
+                         if count > 1 and len(segment) > 3), reverse=True)
+    chosen, total = [], 0
+    for _, segment in candidates:
+        if total + len(segment) > size:
+            continue
+        if any(segment in other for other in chosen):
+            continue
+        chosen.append(segment)
+        total += len(segment)
+    return b''.join(reversed(chosen))
+
+
+# 由 bench_compression.py --build 从典型流量（帧输入、玩家列表、房间列表、补帧包）生成。
+# 收发双方必须使用相同的字典，修改字典时需要同时更新 packet_codec.DICTIONARY_ID
+PRESET_DICTIONARY = (
+    b'[0,0,"unit_ids":["2_11""player_count":1}]"unit_ids":["1_10",,"unit_ids":'
+    b'["3_11","unit_ids":["1_9"{"id":3,,"unit_ids":["3_2","name":"Player4",4,"'
+    b'name":"Player4""Player4","color":[,"unit_ids":["1_10",0,255,255],0,255]2'
+    b'55,0,[255,0}][{"3":{"id":3,"3":{"id":false},"3":},"2":{"name":"Player4",'
+    b'"color":"tank"}][false}}}{"id":1,{"id":2,"unit_type":"tank"},"id":3,"nam'
+    b'e":,"y":,"building_id":"2_base",true},"2":,"building_id":"1_base","is_ho'
+    b'st":false},"1":{"id":1"2":{"id":2"color":[0,,"2":{"id":,"color":[0,"room'
+    b's":[{{"1":{"id":,"building_id":"3_base","2_base","unit_type":"tank",{"ty'
+    b'pe":"produce_unit","name":"Player3",3,"name":"Player3"],"x":"Player3","c'
+    b'olor":["1_base","unit_type":"tank","building_id":"4_base","3_base","unit'
+    b'_type":"tank""color":[255,,"color":[2550],"is_host":},{"room_id":"4_base'
+    b'","unit_type":"tank""player_count":3},"id":1,"name":"id":2,"name":"playe'
+    b'r_count":1},"building_id":"2_base","unit_type":},{"type":"player_count":'
+    b'4},,"player_count":3}255],"is_host":"player_count":2},"produce_unit","bu'
+    b'ilding_id":"2_base","player_count":1},"player_count":4}"building_id":"1_'
+    b'base","unit_type":,"player_count":2}"name":"Player3","color":"is_host":t'
+    b'rue},"players":{"1":{,"is_host":true},"player_count":,"players":{"1":],"'
+    b'is_host":true"building_id":"3_base","unit_type":"produce_unit","building'
+    b'_id":"1_base"][{"type":"is_host":false}},"is_host":false}],"is_host":fal'
+    b'se"produce_unit","building_id":"3_base""building_id":"4_base","unit_type'
+    b'":,"name":"Player1",,"name":"Player2",1,"name":"Player1"2,"name":"Player'
+    b'2""produce_unit","building_id":"4_base""Player1","color":["Player2","col'
+    b'or":["rooms":[{"room_id":{"type":"room_list","unit_type":"tank"}]"room_l'
+    b'ist","rooms":[{"type":"player_list",[{"type":"produce_unit","unit_type":'
+    b'"tank"}"name":"Player1","color":"name":"Player2","color":"player_list","'
+    b'players":{{"type":"produce_unit","type":"room_list","rooms":,{"type":"mo'
+    b've_units""type":"player_list","players":[{"type":"move_units"{"type":"mo'
+    b've_units","type":"produce_unit","building_id":"move_units","unit_ids":["'
+    b'type":"move_units","unit_ids":'
+)
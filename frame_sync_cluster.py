@@ -0,0 +1,406 @@
+"""
+多进程帧同步服务器
+
+单个 FrameSyncServer 进程只能用到一个CPU核心。多进程模式下：
+- 前端进程持有对外的 UDP socket，只负责接收数据报并分发给 worker 进程（不解码负载）；
+- 每个 worker 运行一个完整的 FrameSyncServer，负责可靠传输、房间逻辑，并直接用继承的 socket 发送，
+  客户端看到的服务器地址不变。
+
+没有使用多个 socket 绑定同一端口（SO_REUSEPORT）的方式：内核按四元组哈希选择 socket，
+同一房间的玩家会落到不同的进程。分发规则：
+- 携带会话令牌的数据报按令牌分发（令牌对 worker 数取模等于签发它的 worker），地址变化后仍然到达同一个 worker；
+- 没有令牌的数据报按来源地址哈希分发；
+- 玩家加入其他 worker 上的房间时，连接状态（序列号、接收窗口、未确认的包）整体转交给房间所在的 worker，
+  前端记录转交后的路由，因此同一房间的所有数据包都由同一个 worker 处理。
+
+大厅操作（create_room、get_room_list、join_room）看到的是全局房间列表：
+worker 在房间变化时把本地房间上报给前端，前端汇总后广播给所有 worker。
+
+所有收到的数据报都经过前端这一个进程，前端的分发能力是多进程模式吞吐量的上限，
+worker 数增加到一定程度后不再提高吞吐量。前端每次唤醒时读到的数据报越多，每个数据报分摊的管道写入越少，
+bench_cluster.py 单独测量前端每个数据报的CPU时间；worker 数带来的扩展要在核心数足够的机器上测量。
+"""
+
+import _thread
+import multiprocessing
+import os
+import secrets
+import select
+import signal
+import socket
+import threading
+import time
+from typing import Optional
+from client.packet_codec import peek_session
+from client.reliable_udp import ReliableUDP
+from frame_sync_server import FrameSyncServer, BACKEND_THREAD, DEFAULT_SOCKET_BUFFER
+
+# 前端与 worker 之间通过管道传递元组消息，第一项为消息类型：
+# 前端 -> worker: ('datagrams', [(data, addr)]), ('import', addr, 快照, [消息]), ('messages', addr, [消息]),
+#                 ('rooms', {room_id: 房间信息})
+# worker -> 前端: ('datagrams', [(data, addr)]) 转交后仍送到旧 worker 的数据报，
+#                 ('handoff', addr, 目标 worker, 快照, [消息]), ('messages', addr, [消息]),
+#                 ('rooms', {room_id: 房间信息}) 本 worker 的全部房间, ('release', addr, 令牌)
+
+
+class DispatchedReliableUDP(ReliableUDP):
+    """
+    worker 使用的可靠UDP：不从 socket 接收，数据报由前端经管道转交，
+    发送仍然直接使用从前端继承的 socket
+    """
+
+    def __init__(self, host, port, sock: socket.socket, conn, worker_index: int, workers: int, **kwargs):
+        self.shared_socket = sock
+        self.conn = conn
+        self.conn_lock = threading.Lock()  # 管道发送端由管道线程、处理线程和主循环线程共用
+        self.worker_index = worker_index
+        self.workers = workers
+        self.moved = {}  # {addr: 转交时间} 已转交给其他 worker 的连接，之后收到的数据报交回前端重新分发
+        super().__init__(host, port, **kwargs)
+        self.callbacks['on_cluster'] = None  # 前端发来的房间列表，经收件队列在主循环中处理
+
+    def _start_io(self):
+        """使用继承的 socket 发送，启动管道接收线程和处理线程"""
+        self.socket = self.shared_socket
+        self._configure_socket()
+
+        self.receive_thread = threading.Thread(target=self._pipe_loop)
+        self.receive_thread.daemon = True
+        self.receive_thread.start()
+
+        self.process_thread = threading.Thread(target=self._process_loop)
+        self.process_thread.daemon = True
+        self.process_thread.start()
+
+    def _pipe_loop(self):
+        """接收前端转交的数据报和集群消息，前端退出时中断主线程"""
+        while self.running:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                if self.running:
+                    print(f"worker {self.worker_index}: 前端进程已退出")
+                    _thread.interrupt_main()
+                return
+            try:
+                self._handle_front_message(message)
+            except Exception as e:
+                print(f"处理前端消息 {message[0]} 错误: {e}")
+
+    def _handle_front_message(self, message: tuple):
+        kind = message[0]
+        if kind == 'datagrams':
+            datagrams = message[1]
+            rerouted = []
+            # 持锁检查 moved，保证转交过程中不会为已导出的连接重新创建状态
+            with self.lock:
+                for data, addr in datagrams:
+                    if addr in self.moved:
+                        rerouted.append((data, addr))
+                    else:
+                        self._receive_datagram(data, addr)
+            self.io_stats['recv_wakeups'] += 1
+            self.io_stats['recv_datagrams'] += len(datagrams)
+            self.io_stats['recv_max_batch'] = max(self.io_stats['recv_max_batch'], len(datagrams))
+            if rerouted:
+                self.send_to_front(('datagrams', rerouted))
+        elif kind == 'import':
+            _, addr, snapshot, messages = message
+            with self.lock:
+                self.moved.pop(addr, None)
+                self.import_connection(addr, snapshot)
+                for data in messages:
+                    self._emit('on_message', data, addr)
+        elif kind == 'messages':
+            _, addr, messages = message
+            with self.lock:
+                for data in messages:
+                    self._emit('on_message', data, addr)
+        else:
+            self._emit('on_cluster', message)
+
+    def send_to_front(self, message: tuple):
+        """向前端发送消息，前端已退出时忽略"""
+        with self.conn_lock:
+            try:
+                self.conn.send(message)
+            except OSError:
+                pass
+
+    def hand_off(self, addr: tuple, worker: int, messages: list) -> bool:
+        """把连接连同尚未处理的消息转交给另一个 worker，连接不存在时返回 False"""
+        with self.lock:
+            snapshot = self.export_connection(addr)
+            if snapshot is None:
+                return False
+            now = time.monotonic()
+            # 转交记录只需要保留到迟到的数据报不再出现
+            self.moved = {moved_addr: moved_at for moved_addr, moved_at in self.moved.items()
+                          if now - moved_at < self.session_timeout}
+            self.moved[addr] = now
+            self.send_to_front(('handoff', addr, worker, snapshot, messages))
+        return True
+
+    def _issue_session(self, addr: tuple, state: dict):
+        """令牌对 worker 数取模等于本 worker 的序号，前端据此分发携带令牌的数据报"""
+        token = secrets.randbits(56) * self.workers + self.worker_index
+        while token == 0 or token in self.sessions:
+            token = secrets.randbits(56) * self.workers + self.worker_index
+        state['session'] = token
+        self.sessions[token] = addr
+
+    def _migrate_connection(self, old_addr: tuple, new_addr: tuple):
+        """会话迁移后旧地址不再使用，通知前端删除旧地址的路由"""
+        super()._migrate_connection(old_addr, new_addr)
+        self.send_to_front(('release', old_addr, None))
+
+    def _discard_connection(self, addr: tuple):
+        """连接移除后通知前端删除该连接的路由"""
+        state = self.connection_states.get(addr)
+        super()._discard_connection(addr)
+        if state is not None:
+            self.send_to_front(('release', addr, state['session']))
+
+
+class ClusterWorker(FrameSyncServer):
+    """运行在 worker 进程中的帧同步服务器，房间只存在于创建它的 worker 上"""
+
+    def __init__(self, worker_index: int, workers: int, sock: socket.socket, conn, **kwargs):
+        self.worker_index = worker_index
+        self.workers = workers
+        self.shared_socket = sock
+        self.conn = conn
+        # 前端汇总的全局房间 {room_id: {'worker', 'player_count', 'game_started'}}
+        self.cluster_rooms = {}
+        self.reported_rooms = None  # 最近一次上报给前端的本地房间
+        kwargs['backend'] = BACKEND_THREAD
+        super().__init__(**kwargs)
+        self.udp.register_callback('on_cluster', self._handle_cluster_message)
+
+    def _create_udp(self, host: str, port: int, udp_options: dict) -> ReliableUDP:
+        return DispatchedReliableUDP(host, port, self.shared_socket, self.conn,
+                                     self.worker_index, self.workers, **udp_options)
+
+    def _handle_cluster_message(self, message: tuple):
+        """处理前端广播的集群消息"""
+        if message[0] == 'rooms':
+            self.cluster_rooms = message[1]
+
+    def _handle_message(self, data: dict, addr: tuple):
+        """加入其他 worker 上的房间时转交连接，其余消息按单进程服务器处理"""
+        if addr in self.udp.moved:
+            # 转交之前已经收下、还在收件队列中的消息，随后转发给接手的 worker
+            self.udp.send_to_front(('messages', addr, [data]))
+            return
+        if data.get('type') in ('join_room', 'connect'):
+            room_id = data.get('room_id')
+            worker = self._room_worker(room_id)
+            if room_id not in self.rooms and worker is not None and worker != self.worker_index:
+                self._hand_off(addr, worker, data)
+                return
+        super()._handle_message(data, addr)
+
+    def _room_worker(self, room_id) -> Optional[int]:
+        """
+        房间所在的 worker：优先使用前端汇总的房间列表；刚创建的房间要等创建它的 worker 上报、
+        前端广播后才出现在列表中，这之前按房间 ID 末尾的 worker 序号判断，不存在时返回 None
+        """
+        info = self.cluster_rooms.get(room_id)
+        if info is not None:
+            return info['worker']
+        if isinstance(room_id, str):
+            suffix = room_id.rpartition('_')[2]
+            if suffix.isdigit() and int(suffix) < self.workers:
+                return int(suffix)
+        return None
+
+    def _hand_off(self, addr: tuple, worker: int, data: dict):
+        """把玩家的连接和加入房间请求转交给房间所在的 worker"""
+        # 玩家离开本 worker 上的房间，房间内其他玩家会收到断开通知
+        self._handle_disconnect(addr)
+        if self.udp.hand_off(addr, worker, [data]):
+            print(f"worker {self.worker_index}: 连接 {addr} 转交给 worker {worker}（房间 {data.get('room_id')}）")
+
+    def _new_room_id(self) -> str:
+        """多个 worker 可能在同一毫秒创建房间，ID 带上 worker 序号保证全局唯一"""
+        return f"{super()._new_room_id()}_{self.worker_index}"
+
+    def _list_rooms(self) -> list:
+        """全局房间列表：本 worker 的房间使用本地最新状态，其他 worker 的房间来自前端汇总"""
+        room_list = super()._list_rooms()
+        for room_id, info in self.cluster_rooms.items():
+            if info['worker'] != self.worker_index and not info['game_started']:
+                room_list.append({
+                    'room_id': room_id,
+                    'player_count': info['player_count']
+                })
+        return room_list
+
+    def run_frame(self):
+        """运行一帧，本地房间有变化时上报给前端"""
+        super().run_frame()
+        rooms = {room_id: {'player_count': len(room.players), 'game_started': room.game_started}
+                 for room_id, room in self.rooms.items()}
+        if rooms != self.reported_rooms:
+            self.reported_rooms = rooms
+            self.udp.send_to_front(('rooms', rooms))
+
+
+def run_worker(worker_index: int, workers: int, sock: socket.socket, conn, options: dict):
+    """worker 进程入口，前端退出（管道关闭）时 worker 随之退出"""
+    if options.get('metrics_file'):
+        options = dict(options, metrics_file=f"{options['metrics_file']}.{worker_index}")
+    server = ClusterWorker(worker_index, workers, sock, conn, **options)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: server.request_metrics_dump())
+    server.run()
+
+
+class ClusterServer:
+    """多进程服务器前端：接收数据报并分发给 worker，转发 worker 之间的连接转交，汇总全局房间列表"""
+
+    def __init__(self, host='127.0.0.1', port=8888, workers: Optional[int] = None,
+                 recv_buffer_size=DEFAULT_SOCKET_BUFFER, send_buffer_size=DEFAULT_SOCKET_BUFFER, **server_options):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        # 传给每个 worker 的 FrameSyncServer 参数（metrics_file、metrics_interval、impairment、fec_group、require_cookie）
+        self.server_options = dict(server_options, host=host, port=port,
+                                   recv_buffer_size=recv_buffer_size, send_buffer_size=send_buffer_size)
+        self.recv_batch_size = 256  # 每次唤醒最多连续读取的数据报数量，按 worker 分组后各用一次管道写入
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        if recv_buffer_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer_size)
+        if send_buffer_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer_size)
+        self.socket.bind((host, port))
+
+        self.routes = {}  # {addr: worker} 转交后的连接
+        self.session_routes = {}  # {令牌: worker} 转交后的会话，令牌默认路由到签发它的 worker
+        self.rooms = {}  # {room_id: {'worker', 'player_count', 'game_started'}} 全局房间列表
+        self.pipes = []
+        self.processes = []
+        self.stats = {
+            'datagrams': [0] * self.workers,  # 分发给每个 worker 的数据报数
+            'rerouted': 0,  # 转交后送到旧 worker、再次分发的数据报数
+            'handoffs': 0
+        }
+
+    def start(self):
+        """启动 worker 进程"""
+        for index in range(self.workers):
+            front_end, worker_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_worker, name=f"frame-sync-worker-{index}",
+                                              args=(index, self.workers, self.socket, worker_end, self.server_options))
+            process.daemon = True
+            process.start()
+            worker_end.close()
+            self.pipes.append(front_end)
+            self.processes.append(process)
+        print(f"多进程帧同步服务器启动完成: {self.host}:{self.port}，{self.workers} 个 worker")
+
+    def _route(self, data: bytes, addr: tuple) -> int:
+        """选择处理数据报的 worker"""
+        session = peek_session(data)
+        if session is not None:
+            return self.session_routes.get(session, session % self.workers)
+        worker = self.routes.get(addr)
+        if worker is not None:
+            return worker
+        return hash(addr) % self.workers
+
+    def _dispatch(self, datagrams: list):
+        """按 worker 分组，每个 worker 一次管道写入"""
+        batches = {}
+        for data, addr in datagrams:
+            batches.setdefault(self._route(data, addr), []).append((data, addr))
+        for worker, batch in batches.items():
+            self.stats['datagrams'][worker] += len(batch)
+            self.pipes[worker].send(('datagrams', batch))
+
+    def _drain_socket(self):
+        """读取内核队列中的数据报（最多 recv_batch_size 个）并分发"""
+        datagrams = []
+        for _ in range(self.recv_batch_size):
+            try:
+                datagrams.append(self.socket.recvfrom(65507))
+            except BlockingIOError:
+                break
+            except ConnectionError:
+                continue
+        if datagrams:
+            self._dispatch(datagrams)
+
+    def _handle_worker_message(self, worker: int, message: tuple):
+        """处理 worker 发来的消息"""
+        kind = message[0]
+        if kind == 'datagrams':
+            self.stats['rerouted'] += len(message[1])
+            self._dispatch(message[1])
+        elif kind == 'handoff':
+            _, addr, target, snapshot, messages = message
+            self.routes[addr] = target
+            if snapshot['session'] is not None:
+                self.session_routes[snapshot['session']] = target
+            self.stats['handoffs'] += 1
+            self.pipes[target].send(('import', addr, snapshot, messages))
+        elif kind == 'messages':
+            _, addr, messages = message
+            target = self.routes.get(addr)
+            if target is not None and target != worker:
+                self.pipes[target].send(message)
+        elif kind == 'release':
+            _, addr, session = message
+            if self.routes.get(addr) == worker:
+                del self.routes[addr]
+            if session is not None and self.session_routes.get(session) == worker:
+                del self.session_routes[session]
+        elif kind == 'rooms':
+            rooms = {room_id: info for room_id, info in self.rooms.items() if info['worker'] != worker}
+            for room_id, info in message[1].items():
+                rooms[room_id] = dict(info, worker=worker)
+            self.rooms = rooms
+            for pipe in self.pipes:
+                pipe.send(('rooms', rooms))
+
+    def request_metrics_dump(self):
+        """通知所有 worker 导出传输统计"""
+        for process in self.processes:
+            if process.pid is not None:
+                os.kill(process.pid, signal.SIGUSR1)
+
+    def run(self):
+        """运行前端分发循环"""
+        if not self.processes:
+            self.start()
+        print("帧同步服务器运行中（多进程）...")
+        try:
+            while True:
+                readable, _, _ = select.select([self.socket] + self.pipes, [], [], 1.0)
+                for source in readable:
+                    if source is self.socket:
+                        self._drain_socket()
+                        continue
+                    worker = self.pipes.index(source)
+                    while source.poll():
+                        self._handle_worker_message(worker, source.recv())
+                dead = [process.name for process in self.processes if not process.is_alive()]
+                if dead:
+                    print(f"worker 进程异常退出: {', '.join(dead)}")
+                    break
+        except KeyboardInterrupt:
+            print("服务器关闭")
+        finally:
+            self.close()
+
+    def close(self):
+        """关闭管道（worker 随之退出）并等待 worker 进程结束"""
+        for pipe in self.pipes:
+            pipe.close()
+        for process in self.processes:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+        self.socket.close()
@@ -1,11 +1,32 @@
 import time
 import json
+import signal
+import asyncio
+import argparse
 from collections import defaultdict
-from client.reliable_udp import ReliableUDP
+from client.reliable_udp import (ReliableUDP, SEND_BLOCKED, PRIORITY_REALTIME, PRIORITY_BULK, CHANNEL_UNORDERED,
+                                 REPAIR_MAX_MEMBERS)
+from client.async_reliable_udp import AsyncReliableUDP
+from client.loopback_transport import LoopbackReliableUDP
+from client.network_simulator import parse_impairment
+
+# 网络后端：thread 为后台线程轮询实现，asyncio 为事件循环实现，
+# loopback 为进程内的内存回环网络（测试和基准测试用，见 client/loopback_transport.py）
+BACKEND_THREAD = 'thread'
+BACKEND_ASYNCIO = 'asyncio'
+BACKEND_LOOPBACK = 'loopback'
+
+# 服务器 socket 默认收发缓冲区，避免多房间同时广播时内核队列溢出丢包
+DEFAULT_SOCKET_BUFFER = 1 << 20
+
+# 帧同步通道：game_start 和 frame_inputs 在独立的有序通道中交付，
+# 房间列表等大厅消息（默认通道）丢包重传时不会阻塞帧数据。
+# 连接成功、加入成功和玩家列表也走这个通道，重传时不会晚于之后发出的 game_start 到达
+CHANNEL_FRAMES = 1
 
 class GameRoom:
     """游戏房间类，每个房间有独立的帧同步状态"""
-    def __init__(self, room_id):
+    def __init__(self, room_id, created_time=None):
         self.room_id = room_id
         self.players = {}  # {addr: player_info}
         
@@ -17,11 +38,14 @@ class GameRoom:
         # 游戏配置
         # 使用定点数表示帧间隔，实际间隔 = frame_interval / 1000 秒
         self.frame_interval = 50  # 20 FPS（毫秒）
-        self.last_frame_time = self.get_time_ms()
+        # created_time 为服务器时钟的当前毫秒数，未指定时取系统时间
+        self.last_frame_time = created_time if created_time is not None else self.get_time_ms()
         self.game_started = False
         
         # 房间属性
         self.host_addr = None  # 房主地址
+        # 帧同步通道的前向纠错：每 fec_group 个帧数据包追加一个修复包，0 表示不启用
+        self.fec_group = 0
         
         # 房间销毁相关
         self.empty_since = None  # 房间变空的时间戳
@@ -43,10 +67,34 @@ class GameRoom:
         return int(time.time() * 1000)
 
 class FrameSyncServer:
-    def __init__(self, host='127.0.0.1', port=8888):
-        self.udp = ReliableUDP(host, port, is_server=True)
+    def __init__(self, host='127.0.0.1', port=8888, backend=BACKEND_THREAD,
+                 recv_buffer_size=DEFAULT_SOCKET_BUFFER, send_buffer_size=DEFAULT_SOCKET_BUFFER,
+                 metrics_file=None, metrics_interval=0, impairment=None, fec_group=0, network=None,
+                 require_cookie=False):
+        self.backend = backend
+        # loopback 后端所在的 LoopbackNetwork，房间 tick 使用它的虚拟时钟
+        self.network = network
+        self.clock = network.clock if backend == BACKEND_LOOPBACK else time.time
+        # 合并发送：每次 run_frame 结束时统一 flush，同一连接的消息打包进同一个数据包
+        # 收件队列：消息在 run_frame 开始时统一处理，房间状态只在主循环线程中修改
+        udp_options = {'is_server': True, 'coalesce': True, 'inbox': True,
+                       'recv_buffer_size': recv_buffer_size, 'send_buffer_size': send_buffer_size,
+                       'impairment': impairment}  # 网络损伤模拟配置，见 client/network_simulator.py
+        self.udp = self._create_udp(host, port, udp_options)
+        # 无状态 cookie 握手，防护伪造源地址的洪水；开启后不支持 cookie 的旧版本客户端无法连接
+        self.udp.require_cookie = require_cookie
         self.udp.register_callback('on_message', self._handle_message)
         self.udp.register_callback('on_disconnect', self._handle_disconnect)
+        self.udp.register_callback('on_inbox', self._on_inbox)
+        self.udp.register_callback('on_migrate', self._handle_migrate)
+        for msg_type in ('connect_success', 'join_room_success', 'player_list', 'game_start', 'frame_inputs'):
+            self.udp.set_channel(msg_type, CHANNEL_FRAMES)
+        # pong 和输入确认互相之间没有顺序要求，收到即交付
+        self.udp.set_channel('pong', CHANNEL_UNORDERED)
+        self.udp.set_channel('input_ack', CHANNEL_UNORDERED)
+        
+        # asyncio 后端：收到消息后唤醒房间定时器，立即处理消息并重新计算下一次 tick 时间
+        self.tick_wakeup: asyncio.Event = None
 
         # 房间管理
         self.rooms = {}  # {room_id: GameRoom}
@@ -55,9 +103,27 @@ class FrameSyncServer:
         # 全局配置
         # 使用定点数表示输入确认超时，实际超时 = input_ack_timeout / 1000 秒
         self.input_ack_timeout = 200  # 200ms（毫秒）
+        # 新房间默认的前向纠错组大小，创建房间时可以在请求中用 fec_group 指定
+        self.fec_group = fec_group
+        
+        # 传输统计导出：每隔 metrics_interval 秒（0 表示不定时导出）或收到 SIGUSR1 时写入 metrics_file
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.last_metrics_time = time.monotonic()
+        self.metrics_requested = False
         
         print("帧同步服务器启动完成")
     
+    def _create_udp(self, host: str, port: int, udp_options: dict) -> ReliableUDP:
+        """创建网络层，子类可以替换实现（如多进程模式下由前端进程分发数据报的 worker）"""
+        if self.backend == BACKEND_ASYNCIO:
+            # asyncio 后端需要在 run_async 中启动
+            return AsyncReliableUDP(host, port, **udp_options)
+        if self.backend == BACKEND_LOOPBACK:
+            # 由 network.run() 驱动，调用方用 network.every() 定期调用 run_frame
+            return LoopbackReliableUDP(self.network, host, port, **udp_options)
+        return ReliableUDP(host, port, **udp_options)
+    
     def _handle_message(self, data: dict, addr: tuple):
         # print(f"收到来自 {addr} 的消息: {data}")
         """处理客户端消息"""
@@ -65,6 +131,8 @@ class FrameSyncServer:
         
         if msg_type == 'connect':
             self._handle_connect(addr, data)
+        elif msg_type == 'player_inputs':
+            self._handle_player_inputs(addr, data)
         elif msg_type == 'player_input':
             self._handle_player_input(addr, data)
         elif msg_type == 'input_ack':
@@ -82,14 +150,22 @@ class FrameSyncServer:
         elif msg_type == 'sync_request':
             self._handle_sync_request(addr, data)
     
+    def _on_inbox(self):
+        """收件队列有新消息（在网络线程中调用），asyncio 后端唤醒主循环"""
+        if self.tick_wakeup is not None:
+            self.tick_wakeup.set()
+    
     def _handle_create_room(self, addr: tuple, data: dict):
         """处理创建房间请求"""
         # 创建新的房间ID
-        room_id = f"room_{self.get_time_ms()}"
+        room_id = self._new_room_id()
         
         # 创建新房间
-        room = GameRoom(room_id)
+        room = GameRoom(room_id, self.get_time_ms())
         room.host_addr = addr  # 设置房主
+        fec_group = data.get('fec_group', self.fec_group)
+        if type(fec_group) is int and 0 <= fec_group <= REPAIR_MAX_MEMBERS:
+            room.fec_group = fec_group
         self.rooms[room_id] = room
         
         print(f"创建新房间: {room_id}")
@@ -145,11 +221,13 @@ class FrameSyncServer:
             'name': player_name,
             'color': self._get_player_color(player_id),
             'connected': True,
-            'last_input_frame': 0
+            'last_input_frame': 0,
+            'input_ack_frame': -1  # 已收齐的最高连续输入帧
         }
         
         # 记录玩家所在房间
         self.player_rooms[addr] = room_id
+        self.udp.set_fec(addr, room.fec_group, CHANNEL_FRAMES)
 
         print(f"player : {room.players[addr]} connected to room {room_id}")
         
@@ -157,7 +235,8 @@ class FrameSyncServer:
         response = {
             'type': 'join_room_success',
             'player_id': player_id,
-            'room_id': room_id
+            'room_id': room_id,
+            'redundant_inputs': True  # 支持冗余输入 player_inputs，旧版本客户端忽略这个字段
         }
         
         self.udp.send_reliable(response, addr)
@@ -168,7 +247,26 @@ class FrameSyncServer:
 
     def _handle_get_room_list(self, addr: tuple, data: dict):
         """处理获取房间列表请求"""
-        # 获取未开始游戏的房间列表
+        response = {
+            'type': 'room_list',
+            'rooms': self._list_rooms()
+        }
+        
+        # 房间列表可能很长，拥塞时不能挤占帧数据；新的房间列表发出后，旧的不再重传
+        self.udp.send_reliable(response, addr, PRIORITY_BULK, supersede='room_list')
+    
+    def _new_room_id(self) -> str:
+        """生成新房间的ID，同一毫秒内创建的房间加上序号区分"""
+        room_id = f"room_{self.get_time_ms()}"
+        if room_id not in self.rooms:
+            return room_id
+        index = 1
+        while f"{room_id}_{index}" in self.rooms:
+            index += 1
+        return f"{room_id}_{index}"
+    
+    def _list_rooms(self) -> list:
+        """获取未开始游戏的房间列表"""
         room_list = []
         for room_id, room in self.rooms.items():
             if not room.game_started:
@@ -176,13 +274,7 @@ class FrameSyncServer:
                     'room_id': room_id,
                     'player_count': len(room.players)
                 })
-        
-        response = {
-            'type': 'room_list',
-            'rooms': room_list
-        }
-        
-        self.udp.send_reliable(response, addr)
+        return room_list
     
     def _handle_start_game(self, addr: tuple, data: dict):
         """处理开始游戏请求"""
@@ -247,11 +339,13 @@ class FrameSyncServer:
             'name': player_name,
             'color': self._get_player_color(player_id),
             'connected': True,
-            'last_input_frame': 0
+            'last_input_frame': 0,
+            'input_ack_frame': -1  # 已收齐的最高连续输入帧
         }
         
         # 记录玩家所在房间
         self.player_rooms[addr] = room_id
+        self.udp.set_fec(addr, room.fec_group, CHANNEL_FRAMES)
 
         print(f"player : {room.players[addr]} connected to room {room_id}")
         
@@ -260,7 +354,8 @@ class FrameSyncServer:
             'type': 'connect_success',
             'player_id': player_id,
             'room_id': room_id,
-            'game_state': self._get_initial_game_state(room, player_id)
+            'game_state': self._get_initial_game_state(room, player_id),
+            'redundant_inputs': True  # 支持冗余输入 player_inputs，旧版本客户端忽略这个字段
         }
         
         self.udp.send_reliable(response, addr)
@@ -270,34 +365,27 @@ class FrameSyncServer:
         self._broadcast_player_list(room)
 
     def get_time_ms(self):
-        """获取当前时间（毫秒）"""
-        return int(time.time() * 1000)
+        """获取当前时间（毫秒），loopback 后端为虚拟时间"""
+        return int(self.clock() * 1000)
     
-    def _handle_player_input(self, addr: tuple, data: dict):
-        """处理玩家输入"""
-        # 检查玩家是否已连接
-        if addr not in self.player_rooms:
-            return
-        
-        room_id = self.player_rooms[addr]
-        room = self.rooms[room_id]
-        
-        if addr not in room.players:
-            return
-        
-        player = room.players[addr]
-        frame = data['frame']
-        inputs = data['inputs']
-        
+    def _get_room_player(self, addr: tuple):
+        """获取玩家所在的房间和玩家信息，玩家未连接时返回 (None, None)"""
+        room = self.rooms.get(self.player_rooms.get(addr))
+        if room is None or addr not in room.players:
+            return None, None
+        return room, room.players[addr]
+    
+    def _store_player_input(self, room: GameRoom, addr: tuple, player: dict, frame: int, inputs: list) -> bool:
+        """存储玩家某一帧的输入，返回是否被接受"""
         # 检查帧是否在有效范围（current_frame-3 到 current_frame+3）
         if frame < room.current_frame - 3 or frame > room.current_frame + 3:
             print(f"忽略超出范围的输入: 来自 {addr} 的帧 {frame}，有效范围 [{room.current_frame-3}, {room.current_frame+3}]")
-            return
+            return False
         
         # 检查是否已经处理过（存在于history_frames中）
         if frame in room.history_frames:
-            print(f"忽略已处理的输入: 来自 {addr} 的帧 {frame}, data:{data}")
-            return
+            print(f"忽略已处理的输入: 来自 {addr} 的帧 {frame}, inputs:{inputs}")
+            return False
         
         # 存储输入
         if frame not in room.frame_inputs:
@@ -305,10 +393,44 @@ class FrameSyncServer:
         room.frame_inputs[frame][player['id']] = inputs
 
         if len(inputs) > 0:
-            print(f"收到来自 {addr} 的输入数据: {data}, 当前帧: {room.current_frame}, player_id: {player['id']}")
+            print(f"收到来自 {addr} 的输入数据: 帧 {frame} {inputs}, 当前帧: {room.current_frame}, player_id: {player['id']}")
         
         # 记录最后输入帧
         player['last_input_frame'] = frame
+        self._advance_input_ack(room, player)
+        return True
+    
+    def _advance_input_ack(self, room: GameRoom, player: dict):
+        """推进玩家的输入确认帧：该帧及之前的每一帧都已收到输入或已补空帧定帧"""
+        player_id = player['id']
+        frame = player.get('input_ack_frame', -1) + 1
+        while player_id in room.history_frames.get(frame, ()) or player_id in room.frame_inputs.get(frame, ()):
+            frame += 1
+        player['input_ack_frame'] = frame - 1
+    
+    def _handle_player_inputs(self, addr: tuple, data: dict):
+        """处理冗余输入：不可靠数据报携带客户端最近若干个未确认帧的输入"""
+        room, player = self._get_room_player(addr)
+        if room is None or not room.game_started:
+            return
+        
+        for frame, inputs in data['frames']:
+            # 冗余副本中已收到或已定帧的部分直接跳过
+            if frame <= player.get('input_ack_frame', -1):
+                continue
+            if player['id'] in room.frame_inputs.get(frame, ()) or frame in room.history_frames:
+                continue
+            self._store_player_input(room, addr, player, frame, inputs)
+    
+    def _handle_player_input(self, addr: tuple, data: dict):
+        """处理玩家输入（旧版本客户端的可靠输入，逐帧回复确认）"""
+        room, player = self._get_room_player(addr)
+        if room is None:
+            return
+        
+        frame = data['frame']
+        if not self._store_player_input(room, addr, player, frame, data['inputs']):
+            return
         
         # 发送输入确认
         ack_data = {
@@ -317,13 +439,28 @@ class FrameSyncServer:
             'server_frame': room.current_frame,
             'player_id': player['id']
         }
-        self.udp.send_reliable(ack_data, addr)
+        # 超过输入确认超时（input_ack_timeout）才能送达的确认已经没有意义，不再重传
+        self.udp.send_reliable(ack_data, addr, PRIORITY_REALTIME, ttl=self.input_ack_timeout / 1000)
     
     def _handle_input_ack(self, addr: tuple, data: dict):
         """处理输入确认"""
         # 服务器不需要处理客户端的输入确认
         pass
     
+    def _handle_migrate(self, old_addr: tuple, new_addr: tuple):
+        """客户端地址变化（会话迁移），把房间中以地址为键的数据换成新地址，玩家顺序不变"""
+        room_id = self.player_rooms.pop(old_addr, None)
+        if room_id is None:
+            return
+        self.player_rooms[new_addr] = room_id
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        room.players = {new_addr if addr == old_addr else addr: player for addr, player in room.players.items()}
+        if room.host_addr == old_addr:
+            room.host_addr = new_addr
+        print(f"房间 {room_id} 中的玩家地址变化: {old_addr} -> {new_addr}")
+    
     def _handle_disconnect(self, addr: tuple):
         """处理玩家断开连接"""
         # 检查玩家是否已连接
@@ -405,6 +542,7 @@ class FrameSyncServer:
         # 收集房间内所有玩家的信息
         players_info = {}
         for addr, player in room.players.items():
+            player['input_ack_frame'] = -1
             players_info[player['id']] = {
                 'id': player['id'],
                 'name': player['name'],
@@ -420,7 +558,8 @@ class FrameSyncServer:
         
         for addr in room.players:
             print(f"房间 {room.room_id} 开始游戏:", addr)
-            self.udp.send_reliable(start_data, addr)
+            # 开始消息必须先于第一帧数据到达
+            self.udp.send_reliable(start_data, addr, PRIORITY_REALTIME)
 
         
         print(f"房间 {room.room_id} 游戏开始!")
@@ -431,14 +570,23 @@ class FrameSyncServer:
         if frame not in room.history_frames:
             return
         
+        # 捎带每个玩家已收齐的最高连续输入帧，客户端据此停止重发冗余输入
+        input_acks = {}
+        for player in room.players.values():
+            self._advance_input_ack(room, player)
+            input_acks[player['id']] = player['input_ack_frame']
+        
         frame_data = {
             'type': 'frame_inputs',
             'frame': frame,
-            'inputs': room.history_frames[frame]
+            'inputs': room.history_frames[frame],
+            'input_acks': input_acks
         }
 
         for addr in room.players:
-            self.udp.send_reliable(frame_data, addr)
+            if self.udp.send_reliable(frame_data, addr, PRIORITY_REALTIME) == SEND_BLOCKED:
+                # 该连接积压过多（通常即将超时断开），跳过本帧，避免继续堆积
+                print(f"房间 {room.room_id} 玩家 {addr} 发送队列已满，跳过帧 {frame}")
 
         # print(f"房间 {room.room_id} 帧 {frame} 广播帧输入 {frame_data}")
         
@@ -466,7 +614,8 @@ class FrameSyncServer:
             'timestamp': data['timestamp'],
             'server_frame': room.current_frame
         }
-        self.udp.send_reliable(pong_data, addr)
+        # pong 用于测量延迟，不应在发送队列中排队；过时的 pong 会得到偏大的延迟，被新的 pong 取代后不再重传
+        self.udp.send_reliable(pong_data, addr, PRIORITY_REALTIME, supersede='pong')
     
     def _handle_sync_request(self, addr: tuple, data: dict):
         """处理同步请求"""
@@ -491,11 +640,14 @@ class FrameSyncServer:
                     'frame': frame,
                     'inputs': room.history_frames[frame]
                 }
-                self.udp.send_reliable(frame_data, addr)
+                # 补发的历史帧可能很多，按字节预算发送，不影响正常的帧广播；
+                # 客户端按帧号保存输入，补发的帧不需要排序，也不占用帧同步通道
+                self.udp.send_reliable(frame_data, addr, PRIORITY_BULK, CHANNEL_UNORDERED)
                 print(f"发送帧 {frame} 数据给客户端 {addr}")
     
     def run_frame(self):
-        """运行所有房间的一帧"""
+        """处理收件队列中的消息，然后运行所有房间的一帧"""
+        self.udp.poll()
         current_time = self.get_time_ms()
         for room_id, room in list(self.rooms.items()):
             # 检查是否需要销毁房间（房间为空且超过1分钟）
@@ -550,6 +702,35 @@ class FrameSyncServer:
                 del room.frame_inputs[f]
 
             room.current_frame += 1
+        
+        # 本轮产生的所有消息（包括接收线程回调中产生的回复）统一打包发送
+        self.udp.flush()
+        
+        if self.metrics_requested or (
+                self.metrics_interval and time.monotonic() - self.last_metrics_time >= self.metrics_interval):
+            self.dump_metrics()
+    
+    def request_metrics_dump(self):
+        """请求在下一次 run_frame 结束时导出传输统计（可在信号处理函数中调用）"""
+        self.metrics_requested = True
+    
+    def dump_metrics(self):
+        """打印传输统计摘要，配置了 metrics_file 时写入完整的 JSON"""
+        self.metrics_requested = False
+        self.last_metrics_time = time.monotonic()
+        metrics = self.udp.get_metrics()
+        counters = metrics['counters']
+        rtt = metrics['histograms']['rtt_ms']
+        print(f"传输统计: 连接 {metrics['connections']}, 发送 {counters['datagrams_sent']} 包/"
+              f"{counters['bytes_sent']} 字节, 接收 {counters['datagrams_received']} 包/"
+              f"{counters['bytes_received']} 字节, 重传率 {metrics['loss_rate'] * 100:.1f}%, "
+              f"重复 {counters['duplicates']}, RTT p50/p99 {rtt['p50']}/{rtt['p99']}ms, "
+              f"内核丢包 {metrics['socket'].get('drops', 0)}")
+        if self.metrics_file:
+            try:
+                self.udp.dump_metrics(self.metrics_file)
+            except OSError as e:
+                print(f"写入传输统计文件 {self.metrics_file} 失败: {e}")
     
     def run(self):
         """运行服务器"""
@@ -562,6 +743,38 @@ class FrameSyncServer:
             print("服务器关闭")
         finally:
             self.udp.close()
+    
+    def _next_tick_delay(self):
+        """距离下一次需要运行 run_frame 的时间（秒），没有需要处理的房间时返回 None"""
+        current_time = self.get_time_ms()
+        deadlines = []
+        for room in self.rooms.values():
+            if room.game_started:
+                deadlines.append(room.last_frame_time + room.frame_interval)
+            elif len(room.players) == 0 and room.empty_since is not None:
+                # 空房间的销毁时间
+                deadlines.append(room.empty_since + 1000)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - current_time) / 1000
+    
+    async def run_async(self):
+        """以协程方式运行服务器，房间 tick 由事件循环定时器驱动，空闲时不占用CPU"""
+        print("帧同步服务器运行中（asyncio）...")
+        await self.udp.start()
+        self.tick_wakeup = asyncio.Event()
+        try:
+            while True:
+                self.run_frame()
+                delay = self._next_tick_delay()
+                self.tick_wakeup.clear()
+                try:
+                    # 等待到下一个房间 tick，期间收到消息（如开始游戏）会提前唤醒
+                    await asyncio.wait_for(self.tick_wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.udp.close()
 
     def _broadcast_player_list(self, room: GameRoom):
         """广播玩家列表给房间内所有玩家"""
@@ -571,15 +784,60 @@ class FrameSyncServer:
             'players': players_info
         }
         
+        # 玩家列表是完整快照，只需要送达最新的一份
         for addr in room.players:
-            self.udp.send_reliable(player_list_msg, addr)
+            self.udp.send_reliable(player_list_msg, addr, supersede='player_list')
         print(f"房间 {room.room_id} 广播玩家列表: {players_info}")
 
 # 添加main函数
 def main():
     """服务器主入口函数"""
-    server = FrameSyncServer("0.0.0.0", 8888)
-    server.run()
+    parser = argparse.ArgumentParser(description="帧同步服务器")
+    parser.add_argument('--host', default="0.0.0.0")
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--backend', choices=[BACKEND_THREAD, BACKEND_ASYNCIO], default=BACKEND_THREAD,
+                        help="网络后端：thread 为线程实现，asyncio 为事件循环实现")
+    parser.add_argument('--recv-buffer', type=int, default=DEFAULT_SOCKET_BUFFER, help="socket 接收缓冲区字节数")
+    parser.add_argument('--send-buffer', type=int, default=DEFAULT_SOCKET_BUFFER, help="socket 发送缓冲区字节数")
+    parser.add_argument('--metrics-file', help="传输统计 JSON 导出路径（收到 SIGUSR1 或定时导出时写入）")
+    parser.add_argument('--metrics-interval', type=float, default=0, help="定时导出传输统计的间隔秒数，0 表示不定时导出")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="多进程模式的 worker 进程数（只支持 thread 后端），0 表示单进程")
+    parser.add_argument('--impair', help="网络损伤模拟，JSON 或简写，如 latency_ms=60,jitter_ms=10,loss=0.02,seed=1")
+    parser.add_argument('--fec', type=int, default=0,
+                        help="新房间默认的前向纠错组大小：每 N 个帧数据包追加一个修复包，0 表示不启用")
+    parser.add_argument('--require-cookie', action='store_true',
+                        help="开启无状态 cookie 握手，防护伪造源地址的洪水（不支持 cookie 的旧版本客户端无法连接）")
+    args = parser.parse_args()
+    
+    if args.workers:
+        # 多进程模式：前端进程分发数据报，房间由各 worker 进程运行，见 frame_sync_cluster.py
+        from frame_sync_cluster import ClusterServer
+        cluster = ClusterServer(args.host, args.port, workers=args.workers,
+                                recv_buffer_size=args.recv_buffer, send_buffer_size=args.send_buffer,
+                                metrics_file=args.metrics_file, metrics_interval=args.metrics_interval,
+                                impairment=parse_impairment(args.impair), fec_group=args.fec,
+                                require_cookie=args.require_cookie)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: cluster.request_metrics_dump())
+        cluster.run()
+        return
+    
+    server = FrameSyncServer(args.host, args.port, backend=args.backend,
+                             recv_buffer_size=args.recv_buffer, send_buffer_size=args.send_buffer,
+                             metrics_file=args.metrics_file, metrics_interval=args.metrics_interval,
+                             impairment=parse_impairment(args.impair), fec_group=args.fec,
+                             require_cookie=args.require_cookie)
+    # kill -USR1 <pid> 按需导出传输统计（Windows 没有该信号）
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: server.request_metrics_dump())
+    if args.backend == BACKEND_ASYNCIO:
+        try:
+            asyncio.run(server.run_async())
+        except KeyboardInterrupt:
+            print("服务器关闭")
+    else:
+        server.run()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -5,6 +5,8 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from client.main import start_client
+from client.network_simulator import parse_impairment
 
 if __name__ == "__main__":
-    start_client("127.0.0.1", 8888)
\ No newline at end of file
+    # 可选参数：网络损伤模拟配置，如 python test_client.py latency_ms=80,jitter_ms=20,loss=0.05,seed=1
+    start_client("127.0.0.1", 8888, parse_impairment(sys.argv[1] if len(sys.argv) > 1 else None))
\ No newline at end of file
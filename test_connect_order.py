@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+连接成功消息丢失测试
+服务器和客户端运行在内存回环网络上，服务器第一次发出的 connect_success 被丢弃，
+房主随即开始游戏：重传的 connect_success 不能晚于 game_start 交付，
+否则客户端会用加入时的游戏状态覆盖已经开始的游戏，一直停在未开始的状态
+用法: python test_connect_order.py
+"""
+
+import client.reliable_udp as reliable_udp
+import frame_sync_server
+import client.frame_sync_client as frame_sync_client
+from client.loopback_transport import LoopbackNetwork
+from client.frame_sync_client import FrameSyncClient
+from frame_sync_server import FrameSyncServer, BACKEND_LOOPBACK
+
+SERVER = ('127.0.0.1', 8888)
+
+
+def quiet():
+    """关闭服务器、客户端和网络层的日志"""
+    for module in (reliable_udp, frame_sync_server, frame_sync_client):
+        module.print = lambda *args, **kwargs: None
+
+
+def drop_first(udp, msg_type: str) -> list:
+    """丢弃 udp 第一次发出的包含 msg_type 消息的可靠包（重传照常发送），返回被丢弃的包"""
+    dropped = []
+    send_packet = udp._send_packet
+    marker = f'"{msg_type}"'.encode()
+
+    def _send_packet(packet: dict, addr: tuple) -> int:
+        payload = packet.get('payload') or b''
+        if not dropped and marker in payload:
+            dropped.append(packet)
+            return 0
+        return send_packet(packet, addr)
+
+    udp._send_packet = _send_packet
+    return dropped
+
+
+def test_lost_connect_success():
+    quiet()
+    network = LoopbackNetwork()
+    server = FrameSyncServer(*SERVER, backend=BACKEND_LOOPBACK, network=network)
+    network.every(0.001, server.run_frame)
+    dropped = drop_first(server.udp, 'connect_success')
+    client = FrameSyncClient(*SERVER, network=network)
+    network.every(0.01, client.run_frame)
+
+    # 创建房间后客户端自动发送 connect，服务器收到后即把它登记为房主
+    client.create_room()
+    assert network.run(2.0, lambda: bool(server.player_rooms)), "服务器没有收到 connect"
+    assert dropped, "没有丢弃 connect_success"
+    assert not client.connected
+    # connect_success 还在等待重传时房主就开始游戏
+    client.udp.send_reliable({'type': 'game_start'}, SERVER)
+    client.udp.flush()
+
+    assert network.run(5.0, lambda: client.connected and client.game_started and client.current_frame >= 20), \
+        f"客户端没有开始游戏: connected={client.connected}, game_started={client.game_started}, " \
+        f"current_frame={client.current_frame}"
+    client.udp.close()
+    server.udp.close()
+
+
+if __name__ == "__main__":
+    test_lost_connect_success()
+    print("通过")